@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Recall@k versus queries/sec of the IVF index against exact search."""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "cli"))
+
+from semantic_search.ann import IVFIndex
+from semantic_search.vectors import normalize_rows, top_k_cosine
+
+
+def clustered_vectors(
+    rng: np.random.Generator, n: int, dim: int, topics: int
+) -> np.ndarray:
+    """Unit vectors scattered around random topic centers, like real text."""
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    labels = rng.integers(0, topics, n)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return normalize_rows(vectors)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ANN recall/QPS benchmark")
+    parser.add_argument("--docs", type=int, default=100_000, help="Corpus size")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    parser.add_argument("--topics", type=int, default=500, help="Synthetic topics")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=10, help="Recall@k cutoff")
+    parser.add_argument("--nlist", type=int, help="IVF lists (default 4*sqrt(n))")
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32, 64],
+        help="nprobe values to sweep",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    normalized = clustered_vectors(rng, args.docs, args.dim, args.topics)
+    queries = clustered_vectors(rng, args.queries, args.dim, args.topics)
+
+    start = time.perf_counter()
+    exact = [top_k_cosine(normalized, q, args.k)[0] for q in queries]
+    exact_qps = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(normalized, args.nlist)
+    build_s = time.perf_counter() - start
+
+    print(f"docs={args.docs} dim={args.dim} nlist={index.nlist} build={build_s:.1f}s")
+    print(f"{'nprobe':>8} {'recall@' + str(args.k):>10} {'QPS':>10} {'speedup':>8}")
+    print(f"{'exact':>8} {1.0:>10.3f} {exact_qps:>10.0f} {1.0:>8.1f}")
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        approx = [index.search(q, args.k, nprobe)[0] for q in queries]
+        qps = len(queries) / (time.perf_counter() - start)
+
+        hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approx, exact))
+        recall = hits / (len(queries) * args.k)
+        print(f"{nprobe:>8} {recall:>10.3f} {qps:>10.0f} {qps / exact_qps:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
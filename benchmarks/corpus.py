@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Deterministic synthetic movie corpus in the movies.json schema.
+
+Words are made-up syllable strings drawn from a Zipfian distribution, so
+term frequencies, postings lengths and stopword-heavy heads look like real
+text. The same --docs, --seed and --vocab always produce the same corpus.
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+SYLLABLES = [
+    "ka", "ro", "mi", "ten", "dra", "lo", "ve", "ness", "ing", "tion",
+    "ar", "ed", "ly", "gon", "sta", "war", "ful", "pre", "ex", "ers",
+    "bo", "zan", "qui", "pel", "tor", "shi", "nu", "vex", "ol", "fin",
+]  # fmt: skip
+
+DEFAULT_VOCAB = 50_000
+# Zipf exponent; about 1 for natural language
+DEFAULT_ZIPF = 1.07
+
+
+def make_vocabulary(size: int, rng: np.random.Generator) -> list[str]:
+    """`size` distinct words, shuffled so frequency does not follow length."""
+    words = []
+    n = len(SYLLABLES)
+    length = 1
+    while len(words) < size:
+        for i in range(n**length):
+            parts = []
+            for _ in range(length):
+                i, r = divmod(i, n)
+                parts.append(SYLLABLES[r])
+            words.append("".join(parts))
+            if len(words) == size:
+                break
+        length += 1
+    rng.shuffle(words)
+    return words
+
+
+def zipf_probabilities(size: int, exponent: float) -> np.ndarray:
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_movies(
+    docs: int,
+    seed: int = 0,
+    vocab_size: int = DEFAULT_VOCAB,
+    zipf: float = DEFAULT_ZIPF,
+) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(make_vocabulary(vocab_size, rng))
+    p = zipf_probabilities(vocab_size, zipf)
+
+    title_lengths = rng.integers(1, 5, docs)
+    sentence_counts = rng.integers(0, 9, docs)
+    sentence_lengths = rng.integers(5, 16, sentence_counts.sum())
+    words = vocabulary[
+        rng.choice(vocab_size, title_lengths.sum() + sentence_lengths.sum(), p=p)
+    ].tolist()
+
+    movies = []
+    pos = 0
+    sentence = 0
+    for i in range(docs):
+        title = " ".join(words[pos : pos + title_lengths[i]]).title()
+        pos += title_lengths[i]
+
+        sentences = []
+        for length in sentence_lengths[sentence : sentence + sentence_counts[i]]:
+            text = " ".join(words[pos : pos + length])
+            sentences.append(text[0].upper() + text[1:] + ".")
+            pos += length
+        sentence += sentence_counts[i]
+
+        movies.append({"id": i + 1, "title": title, "description": " ".join(sentences)})
+    return movies
+
+
+def generate_queries(
+    count: int,
+    seed: int = 0,
+    vocab_size: int = DEFAULT_VOCAB,
+    zipf: float = DEFAULT_ZIPF,
+) -> list[str]:
+    """Two to four word queries from the same vocabulary as the corpus."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(make_vocabulary(vocab_size, rng))
+    p = zipf_probabilities(vocab_size, zipf)
+
+    # a separate stream, so queries do not repeat the corpus' first words
+    rng = np.random.default_rng([seed, 1])
+    lengths = rng.integers(2, 5, count)
+    words = vocabulary[rng.choice(vocab_size, lengths.sum(), p=p)].tolist()
+
+    queries = []
+    pos = 0
+    for length in lengths:
+        queries.append(" ".join(words[pos : pos + length]))
+        pos += length
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Synthetic movies.json generator")
+    parser.add_argument("out", type=str, help="Output path")
+    parser.add_argument("--docs", type=int, default=10_000, help="Number of movies")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--vocab", type=int, default=DEFAULT_VOCAB, help="Vocabulary size"
+    )
+    parser.add_argument(
+        "--zipf", type=float, default=DEFAULT_ZIPF, help="Zipf exponent"
+    )
+    args = parser.parse_args()
+
+    movies = generate_movies(args.docs, args.seed, args.vocab, args.zipf)
+    with open(args.out, "w") as f:
+        json.dump({"movies": movies}, f)
+
+    print(f"Wrote {len(movies)} movies to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Per-query latency of exact semantic search on synthetic embeddings."""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "cli"))
+
+from semantic_search.vectors import cosine_similarity, normalize_rows, top_k_cosine
+
+
+def loop_search(embeddings: np.ndarray, query: np.ndarray, limit: int) -> list:
+    """The per-document loop SemanticSearch.search used before vectorizing."""
+    similarities = []
+    for i, doc_embedding in enumerate(embeddings):
+        similarities.append((i, cosine_similarity(query, doc_embedding)))
+    return sorted(similarities, key=lambda x: x[1], reverse=True)[:limit]
+
+
+def random_embeddings(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    embeddings = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        end = min(n, start + 100_000)
+        embeddings[start:end] = rng.standard_normal((end - start, dim))
+    return embeddings
+
+
+def median_ms(fn, queries: np.ndarray) -> float:
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Semantic search benchmark")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="Corpus sizes to benchmark",
+    )
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    parser.add_argument("--queries", type=int, default=20, help="Queries per size")
+    parser.add_argument("--limit", type=int, default=5, help="Results per query")
+    parser.add_argument(
+        "--loop-max",
+        type=int,
+        default=10_000,
+        help="Largest corpus to also time with the old Python loop",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    print(f"{'docs':>10} {'normalize ms':>13} {'vectorized ms':>14} {'loop ms':>10}")
+    for n in args.sizes:
+        embeddings = random_embeddings(rng, n, args.dim)
+
+        start = time.perf_counter()
+        normalized = normalize_rows(embeddings)
+        normalize_ms = (time.perf_counter() - start) * 1000
+
+        vectorized = median_ms(
+            lambda q: top_k_cosine(normalized, q, args.limit), queries
+        )
+
+        loop = "-"
+        if n <= args.loop_max:
+            loop_queries = queries[: max(1, args.queries // 10)]
+            loop_ms = median_ms(
+                lambda q: loop_search(embeddings, q, args.limit), loop_queries
+            )
+            loop = f"{loop_ms:.1f}"
+
+            expected = [i for i, _ in loop_search(embeddings, queries[0], args.limit)]
+            got = top_k_cosine(normalized, queries[0], args.limit)[0].tolist()
+            if expected != got:
+                raise SystemExit(f"rankings differ at n={n}: {expected} != {got}")
+
+        print(f"{n:>10} {normalize_ms:>13.1f} {vectorized:>14.2f} {loop:>10}")
+
+        del embeddings, normalized
+
+
+if __name__ == "__main__":
+    main()
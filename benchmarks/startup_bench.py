@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Cold-start time of CLI subcommands, with the slowest imports of each.
+
+Every command runs in a fresh interpreter from cli/. Wall time is the best of
+--repeat runs; the import breakdown comes from one extra `python -X
+importtime` run and lists the slowest top-level imports by cumulative time.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CLI_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli"
+)
+
+SAMPLE_TEXT = "A retired hacker is pulled back in. One last job. Nothing goes to plan."
+
+# Commands that work without any built caches.
+LIGHT_COMMANDS = [
+    ["-c", "pass"],
+    ["keyword_search_cli.py", "--help"],
+    ["semantic_search_cli.py", "chunk", SAMPLE_TEXT, "--chunk-size", "5"],
+    ["semantic_search_cli.py", "semantic_chunk", SAMPLE_TEXT],
+    ["hybrid_search_cli.py", "normalize", "1", "2", "3"],
+    ["search_server_cli.py", "ping"],
+]
+
+# Commands that need the index and embeddings caches; answered by the search
+# server instead when one is running.
+SEARCH_COMMANDS = [
+    ["keyword_search_cli.py", "idf", "space"],
+    ["keyword_search_cli.py", "bm25search", "space adventure"],
+    ["semantic_search_cli.py", "search", "space adventure"],
+    ["semantic_search_cli.py", "search_chunked", "space adventure"],
+    ["hybrid_search_cli.py", "rrf-search", "space adventure"],
+]
+
+
+def run(command: list[str], importtime: bool = False) -> tuple[float, str]:
+    args = [sys.executable, *(["-X", "importtime"] if importtime else []), *command]
+    start = time.perf_counter()
+    proc = subprocess.run(args, cwd=CLI_DIR, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise SystemExit(f"{' '.join(command)} failed:\n{proc.stderr}")
+    return elapsed, proc.stderr
+
+
+def slowest_imports(stderr: str, top: int) -> list[tuple[str, int]]:
+    """Top-level imports by cumulative microseconds, slowest first."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # nested imports are indented under the module that triggered them
+        if name.startswith("  "):
+            continue
+        imports.append((name.strip(), int(cumulative)))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:top]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per command")
+    parser.add_argument(
+        "--top", type=int, default=3, help="Slowest imports to list per command"
+    )
+    parser.add_argument(
+        "--search",
+        action="store_true",
+        help="Also time search commands (needs built caches)",
+    )
+    args = parser.parse_args()
+
+    commands = LIGHT_COMMANDS + (SEARCH_COMMANDS if args.search else [])
+    for command in commands:
+        times = [run(command)[0] for _ in range(args.repeat)]
+        _, stderr = run(command, importtime=True)
+
+        label = " ".join(command)
+        if len(label) > 50:
+            label = label[:47] + "..."
+        print(
+            f"{label:<50} best {min(times) * 1000:>7.1f} ms"
+            f"  median {statistics.median(times) * 1000:>7.1f} ms"
+        )
+        for name, cumulative in slowest_imports(stderr, args.top):
+            print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""Hot-path benchmarks over a synthetic corpus, with baseline comparison.
+
+Every operation runs in a fresh interpreter against the same generated
+corpus, so its peak RSS is its own and caches never carry over. Everything
+is written to a temporary HOOPLA_CACHE_DIR; the project's cache/ is left
+alone. Dense operations use random unit vectors in place of the model.
+
+    python benchmarks/suite.py --docs 100000 --out results.json
+    python benchmarks/suite.py --docs 100000 --baseline results.json
+
+With --baseline, any latency, throughput or peak RSS worse than the
+baseline by more than --tolerance is reported and the exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from corpus import DEFAULT_VOCAB, generate_movies, generate_queries
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cli")
+)
+
+EMBEDDING_DIM = 384
+MODEL_NAME = "random-unit"
+
+# metric -> True if larger is better
+METRICS = {
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "throughput": True,
+    "peak_rss_mb": False,
+}
+
+
+class RandomEncoder:
+    """Stands in for SentenceTransformer: seeded random unit vectors."""
+
+    def __init__(self, seed: int, dim: int = EMBEDDING_DIM):
+        self.rng = np.random.default_rng(seed)
+        self.dim = dim
+
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        vectors = self.rng.standard_normal((len(texts), self.dim), dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(fn, items) -> list[float]:
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def uncached(searcher):
+    """`searcher` with its result cache, and any query embedding cache, off:
+    --repeat and repeated queries would otherwise time cache hits."""
+    from result_cache.cache import ResultCache
+
+    searcher.result_cache = ResultCache(size=0)
+    if hasattr(searcher, "query_cache"):
+        searcher.query_cache = None
+    return searcher
+
+
+def bench_tokenize(movies, queries, args):
+    from keyword_search.helpers import get_tokenizer, tokenize_text
+
+    get_tokenizer()
+    texts = [f"{m['title']} {m['description']}" for m in movies]
+    return "docs", (lambda: timed(tokenize_text, texts))
+
+
+def bench_index_build(movies, queries, args):
+    from keyword_search.index import InvertedIndex
+
+    def run():
+        idx = InvertedIndex()
+        start = time.perf_counter()
+        idx.build(movies=movies)
+        return [time.perf_counter() - start]
+
+    return "builds", run
+
+
+def bench_bm25_search(movies, queries, args):
+    from keyword_search.helpers import BM25_B, BM25_K1
+    from keyword_search.index import InvertedIndex
+
+    idx = uncached(InvertedIndex())
+    idx.build(movies=movies)
+    return "queries", (
+        lambda: timed(
+            lambda q: idx.bm25_search(q, args.limit, BM25_K1, BM25_B), queries
+        )
+    )
+
+
+def bench_semantic_chunk(movies, queries, args):
+    from semantic_search.chunked_semantic_search import CHUNK_OVERLAP, CHUNK_SIZE
+    from semantic_search.helpers import semantic_chunk
+
+    descriptions = [m["description"] for m in movies]
+    return "docs", (
+        lambda: timed(
+            lambda d: semantic_chunk(d, CHUNK_SIZE, CHUNK_OVERLAP), descriptions
+        )
+    )
+
+
+def bench_semantic_search(movies, queries, args):
+    from document_store.store import DocumentStore
+    from semantic_search.semantic_search import SemanticSearch
+
+    searcher = uncached(SemanticSearch(MODEL_NAME, model=RandomEncoder(args.seed)))
+    searcher.build_embeddings(DocumentStore.load_or_create(args.corpus))
+    return "queries", (lambda: timed(lambda q: searcher.search(q, args.limit), queries))
+
+
+def bench_search_chunks(movies, queries, args):
+    from document_store.store import DocumentStore
+    from semantic_search.chunked_semantic_search import ChunkedSemanticSearch
+
+    searcher = uncached(
+        ChunkedSemanticSearch(MODEL_NAME, model=RandomEncoder(args.seed))
+    )
+    searcher.build_chunk_embeddings(DocumentStore.load_or_create(args.corpus))
+    return "queries", (
+        lambda: timed(lambda q: searcher.search_chunks(q, args.limit), queries)
+    )
+
+
+# name -> setup(movies, queries, args) returning (unit, run); run() returns
+# one latency per item and is what gets timed
+OPERATIONS = {
+    "tokenize": bench_tokenize,
+    "index_build": bench_index_build,
+    "bm25_search": bench_bm25_search,
+    "semantic_chunk": bench_semantic_chunk,
+    "semantic_search": bench_semantic_search,
+    "search_chunks": bench_search_chunks,
+}
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def run_operation(args) -> dict:
+    from keyword_search.helpers import load_documents
+
+    movies = load_documents(args.corpus)
+    queries = generate_queries(args.queries, args.seed, args.vocab)
+    unit, run = OPERATIONS[args.worker](movies, queries, args)
+    setup_rss = peak_rss_mb()
+
+    latencies = []
+    for _ in range(args.repeat):
+        latencies.extend(run())
+    latencies = np.array(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+
+    # builds process the whole corpus each time
+    items = len(movies) if unit == "builds" else len(latencies)
+    return {
+        "unit": "docs" if unit == "builds" else unit,
+        "count": len(latencies),
+        "seconds": round(float(latencies.sum()), 4),
+        "throughput": round(items / float(latencies.sum()), 2),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "setup_rss_mb": round(setup_rss, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def spawn_operation(name: str, corpus: str, args) -> dict:
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--worker",
+        name,
+        "--corpus",
+        corpus,
+        "--queries",
+        str(args.queries),
+        "--seed",
+        str(args.seed),
+        "--vocab",
+        str(args.vocab),
+        "--limit",
+        str(args.limit),
+        "--repeat",
+        str(args.repeat),
+    ]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = {**os.environ, "HOOPLA_CACHE_DIR": cache_dir}
+        proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"{name} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Descriptions of every metric worse than baseline beyond tolerance."""
+    if baseline["meta"]["docs"] != results["meta"]["docs"]:
+        print(
+            f"warning: baseline has {baseline['meta']['docs']} docs, "
+            f"this run {results['meta']['docs']}",
+            file=sys.stderr,
+        )
+
+    regressions = []
+    for name, current in results["operations"].items():
+        before = baseline["operations"].get(name)
+        if before is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = before[metric], current[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    f"{name} {metric}: {old} -> {new} ({change * 100:+.1f}%)"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hot-path benchmark suite")
+    parser.add_argument("--docs", type=int, default=10_000, help="Corpus size")
+    parser.add_argument(
+        "--queries", type=int, default=1000, help="Queries per search operation"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Corpus and query seed")
+    parser.add_argument(
+        "--vocab", type=int, default=DEFAULT_VOCAB, help="Vocabulary size"
+    )
+    parser.add_argument("--limit", type=int, default=5, help="Results per query")
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Passes over the workload per operation"
+    )
+    parser.add_argument(
+        "--ops",
+        nargs="+",
+        choices=list(OPERATIONS),
+        default=list(OPERATIONS),
+        help="Operations to run",
+    )
+    parser.add_argument("--out", type=str, help="Write results JSON here")
+    parser.add_argument("--baseline", type=str, help="Results JSON to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown tolerated before flagging a regression",
+    )
+    parser.add_argument("--worker", choices=list(OPERATIONS), help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_operation(args)))
+        return
+
+    results = {
+        "meta": {
+            "docs": args.docs,
+            "queries": args.queries,
+            "seed": args.seed,
+            "vocab": args.vocab,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "operations": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "movies.json")
+        with open(corpus, "w") as f:
+            json.dump({"movies": generate_movies(args.docs, args.seed, args.vocab)}, f)
+
+        for name in args.ops:
+            result = spawn_operation(name, corpus, args)
+            results["operations"][name] = result
+            print(
+                f"{name:<16} {result['throughput']:>12.1f} {result['unit']}/s"
+                f"  p50 {result['p50_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms"
+                f"  peak {result['peak_rss_mb']:>7.1f} MB",
+                file=sys.stderr,
+            )
+
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
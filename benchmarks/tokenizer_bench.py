@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Tokens/sec of the original per-call tokenize_text versus Tokenizer, over
+the first --docs movies of data/movies.json."""
+
+import argparse
+import os
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "cli"))
+
+from nltk.stem import PorterStemmer
+
+from keyword_search.helpers import load_movies, load_stopwords
+from keyword_search.tokenizer import Tokenizer
+
+
+def legacy_tokenize_text(text: str) -> list[str]:
+    """tokenize_text as it was before Tokenizer, kept as the baseline."""
+    text = text.lower()
+    text = text.translate(str.maketrans("", "", string.punctuation))
+    tokens = text.split()
+    valid_tokens = []
+    for token in tokens:
+        if token:
+            valid_tokens.append(token)
+    stop_words = load_stopwords()
+    filtered_words = []
+    for word in valid_tokens:
+        if word not in stop_words:
+            filtered_words.append(word)
+    stemmer = PorterStemmer()
+    stemmed_words = []
+    for word in filtered_words:
+        stemmed_words.append(stemmer.stem(word))
+    return stemmed_words
+
+
+def run(name: str, fn, texts: list[str]) -> tuple[list[list[str]], float]:
+    start = time.perf_counter()
+    tokens = fn(texts)
+    elapsed = time.perf_counter() - start
+    count = sum(len(t) for t in tokens)
+    print(f"{name:<24} {count / elapsed:>12,.0f} tokens/sec ({elapsed:.2f}s)")
+    return tokens, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tokenizer microbenchmark")
+    parser.add_argument(
+        "--docs",
+        type=int,
+        default=2000,
+        help="Number of movies of data/movies.json to tokenize",
+    )
+    args = parser.parse_args()
+
+    texts = [f"{m['title']} {m['description']}" for m in load_movies()[: args.docs]]
+
+    before, legacy_time = run(
+        "legacy tokenize_text", lambda ts: [legacy_tokenize_text(t) for t in ts], texts
+    )
+
+    tokenizer = Tokenizer(load_stopwords())
+    cold, _ = run("Tokenizer (cold cache)", tokenizer.tokenize_many, texts)
+    warm, warm_time = run("Tokenizer (warm cache)", tokenizer.tokenize_many, texts)
+
+    if before != cold or before != warm:
+        raise SystemExit("Tokenizer output differs from legacy tokenize_text")
+
+    print(f"speedup (warm): {legacy_time / warm_time:.1f}x")
+    print(f"stem cache: {tokenizer.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
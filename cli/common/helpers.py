@@ -0,0 +1,28 @@
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
+# HOOPLA_CACHE_DIR points everything at another cache, e.g. for benchmarks
+CACHE_DIR = os.environ.get("HOOPLA_CACHE_DIR", os.path.join(PROJECT_ROOT, "cache"))
+
+# Queries read per batch by batch searches.
+BATCH_QUERY_SIZE = 1024
+
+
+def read_query_batches(path: str, size: int):
+    """Yield non-blank lines of `path` ("-" for stdin) in lists of `size`."""
+    f = sys.stdin if path == "-" else open(path, "r")
+    try:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(line.strip())
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        if f is not sys.stdin:
+            f.close()
@@ -0,0 +1,30 @@
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def write_lock(lock_path: str):
+    """Serialize writers across processes, and keep readers out while a
+    writer swaps or removes directories."""
+    with _flock(lock_path, fcntl.LOCK_EX):
+        yield
+
+
+@contextmanager
+def read_lock(lock_path: str):
+    """Let readers open files alongside each other, but never while a writer
+    holds `write_lock`."""
+    with _flock(lock_path, fcntl.LOCK_SH):
+        yield
+
+
+@contextmanager
+def _flock(lock_path: str, operation: int):
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,76 @@
+import json
+import os
+
+from common.helpers import CACHE_DIR
+
+DOCUMENT_STORE_DIR = os.path.join(CACHE_DIR, "documents")
+
+# Recently fetched records kept decoded per store.
+DOCUMENT_CACHE_SIZE = 256
+# Characters read at a time when streaming documents from a JSON file.
+READ_CHUNK_SIZE = 1 << 20
+
+
+def iter_documents(path: str, chunk_size: int = READ_CHUNK_SIZE):
+    """Yield the movies of a file in the movies.json format or a bare list
+    one at a time, reading only `chunk_size` characters at once."""
+    decoder = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf, pos, eof = "", 0, False
+
+        def fill() -> bool:
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            return not eof
+
+        def peek() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if not fill():
+                    raise ValueError(f"unexpected end of {path}")
+
+        def value():
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    result, end = decoder.raw_decode(buf, pos)
+                    # a value cut off at the end of the buffer can still
+                    # parse, e.g. a number, so only trust one followed by more
+                    if end < len(buf) or eof:
+                        pos = end
+                        return result
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(char: str) -> None:
+            nonlocal pos
+            if peek() != char:
+                raise ValueError(f"expected {char!r} in {path}")
+            pos += 1
+
+        if peek() == "{":
+            expect("{")
+            while value() != "movies":
+                expect(":")
+                value()
+                expect(",")
+            expect(":")
+
+        expect("[")
+        if peek() == "]":
+            return
+        while True:
+            yield value()
+            if peek() == "]":
+                return
+            expect(",")
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+from array import array
+from functools import lru_cache
+
+import numpy as np
+
+from common.helpers import DATA_PATH
+from common.locks import read_lock, write_lock
+from tracing.trace import span
+
+from .helpers import DOCUMENT_CACHE_SIZE, DOCUMENT_STORE_DIR, iter_documents
+
+STORE_FORMAT = "hoopla-document-store"
+STORE_VERSION = 1
+
+META_FILE = "meta.json"
+IDS_FILE = "ids.npy"
+ID_ORDER_FILE = "id_order.npy"
+
+
+class DocumentStore:
+    """Documents on disk, addressed by row, stored one column per field.
+
+    A column is a blob of JSON-encoded values plus an offsets array, so
+    fetching the titles of five results reads five short slices and never
+    touches a description. Everything is memory-mapped; a small LRU keeps
+    recently fetched records decoded. "id" is an int64 array, and `row`
+    binary-searches it through a sorted order.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ids: np.ndarray,
+        id_order: np.ndarray,
+        columns: dict[str, tuple[np.ndarray, np.ndarray]],
+        meta: dict,
+        cache_size: int = DOCUMENT_CACHE_SIZE,
+    ) -> None:
+        self.path = path
+        self.ids = ids
+        self.id_order = id_order
+        # field -> (offsets, blob); values of row i are blob[offsets[i]:
+        # offsets[i + 1]], empty where the document has no such field
+        self.columns = columns
+        # sha256 over every record, for caches derived from the documents
+        self.fingerprint = meta["fingerprint"]
+        # the file the store was built from, to notice when it changes
+        self.source = meta.get("source")
+        self.__fetch = lru_cache(maxsize=cache_size)(self.__read)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def fields(self) -> list[str]:
+        return list(self.columns)
+
+    def get(self, row: int, fields=None) -> dict:
+        """The document at `row`, with "id" and only `fields` if given."""
+        # a copy, so callers cannot change the cached record
+        return dict(self.__fetch(int(row), None if fields is None else tuple(fields)))
+
+    def row(self, doc_id: int) -> int | None:
+        if len(self.ids) == 0:
+            return None
+        i = int(np.searchsorted(self.ids, doc_id, sorter=self.id_order))
+        if i < len(self.ids) and self.ids[self.id_order[i]] == doc_id:
+            return int(self.id_order[i])
+        return None
+
+    def rows(self, doc_ids) -> np.ndarray:
+        """Rows of `doc_ids` in the same order; unknown ids are skipped."""
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(self.ids) == 0 or len(doc_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        i = np.searchsorted(self.ids, doc_ids, sorter=self.id_order)
+        rows = np.asarray(self.id_order[np.minimum(i, len(self.ids) - 1)])
+        return rows[self.ids[rows] == doc_ids]
+
+    def by_id(self, doc_id: int, fields=None) -> dict | None:
+        row = self.row(doc_id)
+        return None if row is None else self.get(row, fields)
+
+    def values(self, field: str):
+        """`field` of every document in row order, None where missing."""
+        offsets, blob = self.columns[field]
+        starts, ends = offsets[:-1].tolist(), offsets[1:].tolist()
+        for start, end in zip(starts, ends):
+            yield json.loads(blob[start:end].tobytes()) if end > start else None
+
+    def __read(self, row: int, fields: tuple[str, ...] | None) -> dict:
+        record = {"id": int(self.ids[row])}
+        for field in self.columns if fields is None else fields:
+            column = self.columns.get(field)
+            if column is None:
+                continue
+            offsets, blob = column
+            start, end = offsets[row], offsets[row + 1]
+            if end > start:
+                record[field] = json.loads(blob[start:end].tobytes())
+        return record
+
+    @classmethod
+    def write(cls, documents, path: str, source: dict | None = None) -> None:
+        """Write an iterable of documents, each with an integer "id", to a
+        new store at `path` without holding them all in memory."""
+        os.makedirs(path, exist_ok=True)
+        ids = array("q")
+        # field -> (offsets, open blob file), in order of first appearance
+        columns: dict[str, tuple[array, object]] = {}
+        digest = hashlib.sha256()
+        try:
+            for row, doc in enumerate(documents):
+                ids.append(doc["id"])
+                digest.update(str(doc["id"]).encode() + b"\0")
+                for field, value in doc.items():
+                    if field == "id":
+                        continue
+                    column = columns.get(field)
+                    if column is None:
+                        blob = open(_blob_path(path, len(columns)), "wb")
+                        # documents before this one lack the field
+                        column = columns[field] = (array("q", [0] * (row + 1)), blob)
+                    encoded = json.dumps(value).encode()
+                    column[1].write(encoded)
+                    column[0].append(column[0][-1] + len(encoded))
+                    digest.update(field.encode() + b"\0" + encoded + b"\0")
+                for offsets, _ in columns.values():
+                    if len(offsets) == row + 1:
+                        offsets.append(offsets[-1])
+        finally:
+            for _, blob in columns.values():
+                blob.close()
+
+        ids_arr = np.frombuffer(ids, dtype=np.int64)
+        np.save(os.path.join(path, IDS_FILE), ids_arr)
+        np.save(os.path.join(path, ID_ORDER_FILE), np.argsort(ids_arr, kind="stable"))
+        for i, (offsets, _) in enumerate(columns.values()):
+            np.save(_offsets_path(path, i), np.frombuffer(offsets, dtype=np.int64))
+
+        # meta.json is written last so a partially written store is never
+        # mistaken for a complete one.
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(
+                {
+                    "format": STORE_FORMAT,
+                    "version": STORE_VERSION,
+                    "count": len(ids),
+                    "fields": list(columns),
+                    "fingerprint": digest.hexdigest(),
+                    "source": source,
+                },
+                f,
+                indent=2,
+            )
+
+    @classmethod
+    def open(
+        cls, path: str, cache_size: int = DOCUMENT_CACHE_SIZE
+    ) -> "DocumentStore | None":
+        """The store at `path`, or None if there is none of this version."""
+        meta_path = os.path.join(path, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta.get("format") != STORE_FORMAT or meta.get("version") != STORE_VERSION:
+            return None
+
+        columns = {}
+        for i, field in enumerate(meta["fields"]):
+            blob_path = _blob_path(path, i)
+            # np.memmap cannot map an empty file
+            blob = (
+                np.memmap(blob_path, dtype=np.uint8, mode="r")
+                if os.path.getsize(blob_path)
+                else np.zeros(0, dtype=np.uint8)
+            )
+            columns[field] = (np.load(_offsets_path(path, i), mmap_mode="r"), blob)
+
+        return cls(
+            path,
+            np.load(os.path.join(path, IDS_FILE), mmap_mode="r"),
+            np.load(os.path.join(path, ID_ORDER_FILE), mmap_mode="r"),
+            columns,
+            meta,
+            cache_size,
+        )
+
+    @classmethod
+    def load_or_create(
+        cls, source: str = DATA_PATH, path: str = DOCUMENT_STORE_DIR
+    ) -> "DocumentStore":
+        """The store of the movies file at `source`, rebuilt when the file
+        has changed since the store was written."""
+        stat = os.stat(source)
+        signature = {
+            "path": os.path.abspath(source),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        # Rebuilt next to the old store and swapped in under the write lock.
+        # Loads take its shared side, so they never see a partial store or
+        # the gap between the two renames.
+        lock_path = path + ".lock"
+        with span("documents.load"), read_lock(lock_path):
+            store = cls.open(path)
+        if store is not None and store.source == signature:
+            return store
+
+        with write_lock(lock_path):
+            # another process may have rebuilt it while this one waited
+            store = cls.open(path)
+            if store is not None and store.source == signature:
+                return store
+
+            with span("documents.build"):
+                new_path, old_path = path + ".new", path + ".old"
+                shutil.rmtree(new_path, ignore_errors=True)
+                shutil.rmtree(old_path, ignore_errors=True)
+                cls.write(iter_documents(source), new_path, signature)
+                if os.path.exists(path):
+                    os.replace(path, old_path)
+                os.replace(new_path, path)
+                shutil.rmtree(old_path, ignore_errors=True)
+            return cls.open(path)
+
+
+def _blob_path(path: str, column: int) -> str:
+    return os.path.join(path, f"column{column}.bin")
+
+
+def _offsets_path(path: str, column: int) -> str:
+    return os.path.join(path, f"column{column}.offsets.npy")
@@ -1,3 +1,5 @@
+from search_server.client import query_server
+
 from .helpers import normalize_scores
 
 
@@ -5,3 +7,38 @@ def handler_normalize(scores: list[float]):
     n_scores = normalize_scores(scores)
     for score in n_scores:
         print(f"* {score:.4f}")
+
+
+def handler_weighted_search(query: str, alpha: float, limit: int):
+    results = query_server("weighted", query=query, alpha=alpha, limit=limit)
+    if results is None:
+        from document_store.store import DocumentStore
+        from .hybrid_search import HybridSearch
+
+        hs = HybridSearch(DocumentStore.load_or_create())
+        results = hs.weighted_search(query, alpha, limit)
+
+    for i, r in enumerate(results, start=1):
+        print(f"{i}. {r['title']}")
+        print(f"   Hybrid Score: {r['hybrid_score']:.3f}")
+        print(f"   BM25: {r['bm25_score']:.3f}, Semantic: {r['semantic_score']:.3f}")
+        print(f"   {r['document']}...")
+
+
+def handler_rrf_search(query: str, k: int, limit: int):
+    results = query_server("rrf", query=query, k=k, limit=limit)
+    if results is None:
+        from document_store.store import DocumentStore
+        from .hybrid_search import HybridSearch
+
+        hs = HybridSearch(DocumentStore.load_or_create())
+        results = hs.rrf_search(query, k, limit)
+
+    for i, r in enumerate(results, start=1):
+        print(f"{i}. {r['title']}")
+        print(f"   RRF Score: {r['rrf_score']:.3f}")
+        print(
+            f"   BM25 Rank: {r['bm25_rank'] or '-'}, "
+            f"Semantic Rank: {r['semantic_rank'] or '-'}"
+        )
+        print(f"   {r['document']}...")
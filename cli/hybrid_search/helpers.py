@@ -1,3 +1,10 @@
+DEFAULT_ALPHA = 0.5
+RRF_K = 60
+DEFAULT_SEARCH_LIMIT = 5
+# candidates fetched from each retriever per requested result
+CANDIDATE_MULTIPLIER = 100
+
+
 def normalize_scores(scores: list[float]) -> list[float]:
     if not scores:
         return []
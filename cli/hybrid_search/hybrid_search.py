@@ -1,26 +1,178 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 
-from cli.keyword_search.index import InvertedIndex
-from cli.semantic_search.chunked_semantic_search import ChunkedSemanticSearch
+import numpy as np
+
+from keyword_search.helpers import BM25_B, BM25_K1
+from keyword_search.index import InvertedIndex
+from result_cache.cache import ResultCache
+from semantic_search.chunked_semantic_search import ChunkedSemanticSearch
+from semantic_search.semantic_search import RESULT_FIELDS
+from tracing.trace import count, span, traced
+
+from .helpers import CANDIDATE_MULTIPLIER, normalize_scores
 
 
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(self, documents, model=None):
+        # DocumentStore shared with the semantic searcher
         self.documents = documents
-        self.semantic_search = ChunkedSemanticSearch()
+        # `model`, if given, is reused instead of loading another
+        self.semantic_search = ChunkedSemanticSearch(model=model)
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
         self.idx = InvertedIndex()
-        if not os.path.exists(self.idx.index_path):
+        if not self.idx.exists():
             self.idx.build()
             self.idx.save()
-
-    def _bm25_search(self, query, limit, k1, b):
         self.idx.load()
-        return self.idx.bm25_search(query, limit, k1, b)
+
+        self.result_cache = ResultCache()
+
+    @property
+    def generation(self) -> str:
+        return f"{self.idx.generation}+{self.semantic_search.chunk_generation}"
+
+    def _bm25_search(self, query, limit, k1=BM25_K1, b=BM25_B):
+        # fusion only needs ids; documents are fetched for the final results
+        return self.idx.bm25_search(query, limit, k1, b, fields=())
 
     def weighted_search(self, query, alpha, limit=5):
-        raise NotImplementedError("Weighted hybrid search is not implemented yet.")
+        """Blend min-max normalized BM25 and semantic scores as
+        `alpha * bm25 + (1 - alpha) * semantic`."""
+        return self.result_cache.search(
+            "weighted",
+            self.generation,
+            [query],
+            lambda missing: [self.__weighted_search(missing[0], alpha, limit)],
+            alpha=alpha,
+            limit=limit,
+        )[0]
+
+    def __weighted_search(self, query, alpha, limit):
+        ids, bm25_hits, semantic_hits = self.__candidates(query, limit)
+        scores, bm25_norm, semantic_norm = _weighted_scores(
+            ids, bm25_hits, semantic_hits, alpha
+        )
+
+        return self.__results(
+            ids,
+            scores,
+            limit,
+            "hybrid_score",
+            bm25_score=bm25_norm,
+            semantic_score=semantic_norm,
+        )
 
     def rrf_search(self, query, k, limit=10):
-        raise NotImplementedError("RRF hybrid search is not implemented yet.")
+        """Reciprocal rank fusion: each list adds `1 / (k + rank)`."""
+        return self.result_cache.search(
+            "rrf",
+            self.generation,
+            [query],
+            lambda missing: [self.__rrf_search(missing[0], k, limit)],
+            k=k,
+            limit=limit,
+        )[0]
+
+    def __rrf_search(self, query, k, limit):
+        ids, bm25_hits, semantic_hits = self.__candidates(query, limit)
+        scores, bm25_ranks, semantic_ranks = _rrf_scores(
+            ids, bm25_hits, semantic_hits, k
+        )
+
+        return self.__results(
+            ids,
+            scores,
+            limit,
+            "rrf_score",
+            bm25_rank=bm25_ranks,
+            semantic_rank=semantic_ranks,
+        )
+
+    def __candidates(self, query, limit):
+        """Sorted ids of the union of both retrievers' candidates, plus each
+        retriever's (id, score) hits in its own ranked order."""
+        n = limit * CANDIDATE_MULTIPLIER
+        # one thread per retriever; both spend most of their time in numpy or
+        # the model, which release the GIL. The pool lives only for this
+        # query, so a searcher that is replaced, e.g. by a server reload,
+        # leaves no threads behind.
+        with span("hybrid.retrieve"), ThreadPoolExecutor(2) as executor:
+            bm25 = executor.submit(self._bm25_search, query, n)
+            semantic = executor.submit(self.semantic_search.search_chunks, query, n)
+
+            # zero-score BM25 results only pad the list and match no query term
+            bm25_hits = [
+                (doc["id"], score) for doc, score in bm25.result() if score > 0
+            ]
+            semantic_hits = [(r["id"], r["score"]) for r in semantic.result()]
+
+        ids = np.unique([doc_id for doc_id, _ in bm25_hits + semantic_hits])
+        count("hybrid.candidates", len(ids))
+        return ids, bm25_hits, semantic_hits
+
+    @traced("hybrid.format")
+    def __results(self, ids, scores, limit, score_name, **columns):
+        # descending score, ties by lower document id
+        top = np.lexsort((ids, -scores))[:limit]
+
+        results = []
+        for i in top.tolist():
+            doc = self.documents.by_id(int(ids[i]), RESULT_FIELDS)
+            result = {
+                "id": doc["id"],
+                "title": doc["title"],
+                "document": doc["description"][:100],
+                score_name: float(scores[i]),
+            }
+            for name, values in columns.items():
+                result[name] = values[i].item()
+            results.append(result)
+
+        return results
+
+
+@traced("hybrid.fuse")
+def _weighted_scores(ids, bm25_hits, semantic_hits, alpha):
+    """Blended scores of the candidate `ids`, with each retriever's min-max
+    normalized scores (0 where it missed)."""
+    bm25_scores = _scatter(ids, bm25_hits)
+    semantic_scores = _scatter(ids, semantic_hits)
+
+    bm25_norm = np.zeros(len(ids))
+    semantic_norm = np.zeros(len(ids))
+    bm25_found = ~np.isnan(bm25_scores)
+    semantic_found = ~np.isnan(semantic_scores)
+    bm25_norm[bm25_found] = normalize_scores(bm25_scores[bm25_found].tolist())
+    semantic_norm[semantic_found] = normalize_scores(
+        semantic_scores[semantic_found].tolist()
+    )
+    scores = alpha * bm25_norm + (1 - alpha) * semantic_norm
+    return scores, bm25_norm, semantic_norm
+
+
+@traced("hybrid.fuse")
+def _rrf_scores(ids, bm25_hits, semantic_hits, k):
+    """RRF scores of the candidate `ids`, with each retriever's ranks."""
+    # ranks are 1-based positions in each retriever's list, 0 if missing
+    bm25_ranks = _scatter(ids, _ranked(bm25_hits), 0).astype(np.int64)
+    semantic_ranks = _scatter(ids, _ranked(semantic_hits), 0).astype(np.int64)
+
+    scores = np.zeros(len(ids))
+    for ranks in (bm25_ranks, semantic_ranks):
+        found = ranks > 0
+        scores[found] += 1 / (k + ranks[found])
+    return scores, bm25_ranks, semantic_ranks
+
+
+def _scatter(ids: np.ndarray, hits: list[tuple[int, float]], missing=np.nan):
+    """Hit values aligned with the sorted candidate `ids`."""
+    values = np.full(len(ids), missing, dtype=np.float64)
+    if hits:
+        hit_ids, hit_values = zip(*hits)
+        values[np.searchsorted(ids, hit_ids)] = hit_values
+    return values
+
+
+def _ranked(hits: list[tuple[int, float]]) -> list[tuple[int, int]]:
+    return [(doc_id, rank) for rank, (doc_id, _) in enumerate(hits, start=1)]
@@ -1,6 +1,12 @@
 import argparse
 
-from hybrid_search.commands import handler_normalize
+from hybrid_search.helpers import DEFAULT_ALPHA, DEFAULT_SEARCH_LIMIT, RRF_K
+from hybrid_search.commands import (
+    handler_normalize,
+    handler_weighted_search,
+    handler_rrf_search,
+)
+from tracing.trace import add_profile_arguments, profiled
 
 
 def main() -> None:
@@ -14,11 +20,46 @@ def main() -> None:
         "scores", type=float, nargs="+", help="The target score(s)"
     )
 
+    weighted_parser = subparsers.add_parser(
+        "weighted-search", help="Blend normalized BM25 and semantic scores"
+    )
+    weighted_parser.add_argument("query", type=str, help="Search query")
+    weighted_parser.add_argument(
+        "--alpha",
+        type=float,
+        default=DEFAULT_ALPHA,
+        help="Weight of the BM25 score; the semantic score gets 1 - alpha",
+    )
+    weighted_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Number of results"
+    )
+
+    rrf_parser = subparsers.add_parser(
+        "rrf-search", help="Combine BM25 and semantic rankings with RRF"
+    )
+    rrf_parser.add_argument("query", type=str, help="Search query")
+    rrf_parser.add_argument(
+        "-k", type=int, default=RRF_K, help="RRF constant; higher flattens ranks"
+    )
+    rrf_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Number of results"
+    )
+
+    add_profile_arguments(parser, subparsers)
     args = parser.parse_args()
 
+    with profiled(args.profile, args.profile_stats, command=args.command):
+        run_command(args, parser)
+
+
+def run_command(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
     match args.command:
         case "normalize":
             handler_normalize(args.scores)
+        case "weighted-search":
+            handler_weighted_search(args.query, args.alpha, args.limit)
+        case "rrf-search":
+            handler_rrf_search(args.query, args.k, args.limit)
         case _:
             parser.print_help()
 
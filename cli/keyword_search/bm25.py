@@ -0,0 +1,148 @@
+import heapq
+import math
+from bisect import bisect_left
+from collections import Counter
+
+# Relative slack applied to upper-bound comparisons so that rounding in the
+# bound sums can never prune a document that would have made the top-k.
+PRUNE_EPSILON = 1e-9
+
+
+def bm25_idf(df: int, n: int) -> float:
+    return math.log(((n - df + 0.5) / (df + 0.5) + 1))
+
+
+def bm25_tf(
+    tf: int, doc_length: int, avg_doc_length: float, k1: float, b: float
+) -> float:
+    length_norm = 1 - b + b * (doc_length / avg_doc_length)
+    return (tf * (k1 + 1)) / (tf + k1 * length_norm)
+
+
+def bm25_proximity(
+    near: float,
+    idf_a: float,
+    idf_b: float,
+    doc_length: int,
+    avg_doc_length: float,
+    k1: float,
+    b: float,
+) -> float:
+    """Boost for two query terms occurring close together (BM25TP). `near`
+    sums 1 / d**2 over their occurrences d tokens apart and saturates like a
+    term frequency, weighted by the rarer term's idf."""
+    return min(idf_a, idf_b) * bm25_tf(near, doc_length, avg_doc_length, k1, b)
+
+
+class TermPostings:
+    """Sorted postings of one query term plus its BM25 score upper bound.
+
+    `docs` holds doc ordinals in ascending order and `tfs` the matching term
+    frequencies. Both only need to support `len`, indexing and bisection, so
+    lists and numpy arrays work equally well.
+    """
+
+    def __init__(self, term: str, docs, tfs, idf: float, upper_bound: float) -> None:
+        self.term = term
+        self.docs = docs
+        self.tfs = tfs
+        self.idf = idf
+        self.upper_bound = upper_bound
+
+
+def max_score_top_k(
+    query_tokens: list[str],
+    postings: dict[str, TermPostings],
+    doc_lengths,
+    avg_doc_length: float,
+    limit: int,
+    k1: float,
+    b: float,
+) -> list[tuple[int, float]]:
+    """Document-at-a-time MaxScore over the postings of the query terms.
+
+    Returns up to `limit` (doc ordinal, score) pairs ordered by descending
+    score, ties broken by ascending ordinal. Only documents containing at
+    least one query term are returned.
+    """
+    if limit <= 0:
+        return []
+
+    weights = Counter(query_tokens)
+    lists = [p for p in postings.values() if len(p.docs) > 0]
+    lists.sort(key=lambda p: p.upper_bound * weights[p.term])
+
+    # cumulative[i] bounds the score a document can collect from lists[:i + 1]
+    cumulative = []
+    total = 0.0
+    for p in lists:
+        total += p.upper_bound * weights[p.term]
+        cumulative.append(total)
+
+    pointers = [0] * len(lists)
+    heap: list[tuple[float, int]] = []
+    cutoff = 0.0
+    first_essential = 0
+
+    while True:
+        candidate = None
+        for i in range(first_essential, len(lists)):
+            if pointers[i] < len(lists[i].docs):
+                doc = lists[i].docs[pointers[i]]
+                if candidate is None or doc < candidate:
+                    candidate = doc
+        if candidate is None:
+            break
+
+        doc_length = int(doc_lengths[candidate])
+        contributions: dict[str, float] = {}
+        partial = 0.0
+        for i in range(first_essential, len(lists)):
+            p = lists[i]
+            if pointers[i] < len(p.docs) and p.docs[pointers[i]] == candidate:
+                contribution = p.idf * bm25_tf(
+                    p.tfs[pointers[i]], doc_length, avg_doc_length, k1, b
+                )
+                contributions[p.term] = contribution
+                partial += contribution * weights[p.term]
+                pointers[i] += 1
+
+        pruned = False
+        for i in range(first_essential - 1, -1, -1):
+            if partial + cumulative[i] < cutoff:
+                pruned = True
+                break
+            p = lists[i]
+            j = bisect_left(p.docs, candidate, pointers[i])
+            pointers[i] = j
+            if j < len(p.docs) and p.docs[j] == candidate:
+                contribution = p.idf * bm25_tf(
+                    p.tfs[j], doc_length, avg_doc_length, k1, b
+                )
+                contributions[p.term] = contribution
+                partial += contribution * weights[p.term]
+
+        if pruned:
+            continue
+
+        # Re-add in query order so the score is bit-identical to summing
+        # per query token.
+        score = 0.0
+        for token in query_tokens:
+            score += contributions.get(token, 0.0)
+
+        entry = (score, -int(candidate))
+        if len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+        else:
+            continue
+
+        if len(heap) == limit:
+            cutoff = heap[0][0] * (1 - PRUNE_EPSILON)
+            while first_essential < len(lists) and cumulative[first_essential] < cutoff:
+                first_essential += 1
+
+    ranked = sorted(heap, reverse=True)
+    return [(-neg_doc, score) for score, neg_doc in ranked]
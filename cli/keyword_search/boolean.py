@@ -0,0 +1,303 @@
+"""Boolean queries: AND, OR, NOT and parentheses over index terms.
+
+Operators are upper case, so "and", "or" and "not" in a query are ordinary
+words. NOT binds tighter than AND, and AND tighter than OR; adjacent terms
+are ANDed. Each word is tokenized like documents are. A word or phrase of
+only stopwords matches every document, as if every document contained it,
+so "star the" matches what "star" does and "star NOT the" matches nothing.
+Words in double quotes are a phrase, which needs an index with positions
+(see positions.py).
+
+Matches are found a window of ordinals at a time. An AND reads the postings
+of its rarest operand in the window and checks the others only at those
+candidates: a term bisects its skip table for the blocks that could hold
+them and decodes just those. A phrase is such an AND of its terms, and
+positions are only read for the documents that have all of them. The first
+window is sized to hold about
+`limit` matches at the query's estimated density and each later one doubles,
+so evaluation stops soon after `limit` matches and its cost follows the
+shortest postings list rather than the longest.
+"""
+
+import math
+import re
+
+import numpy as np
+
+from .helpers import POSTINGS_BLOCK_SIZE, tokenize_text
+from .positions import phrase_counts
+from .storage import CompactIndex
+
+OPERATORS = ("AND", "OR", "NOT")
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+# the tree of a word or phrase of only stopwords
+ALL = ("all",)
+
+
+def parse_query(query: str):
+    """Syntax tree of a boolean query. Nodes are ("term", token),
+    ("phrase", [tokens]), ("not", node), ("and" | "or", [nodes]) and ALL,
+    which matches every document."""
+    if query.count('"') % 2:
+        raise ValueError("unbalanced quotes in query")
+    words = re.findall(r'"[^"]*"|[()]|[^\s()"]+', query)
+    tree, pos = _parse_or(words, 0)
+    if pos < len(words):
+        raise ValueError(f"unexpected {words[pos]!r} in query")
+    return tree
+
+
+def phrase_query(phrase: str):
+    """Syntax tree of an exact phrase, ALL if it is only stopwords."""
+    tokens = tokenize_text(phrase)
+    if len(tokens) > 1:
+        return ("phrase", tokens)
+    return ("term", tokens[0]) if tokens else ALL
+
+
+def match_segment(
+    tree, data: CompactIndex, limit: int, dead: set[int] | None = None
+) -> list[int]:
+    """The first `limit` local ordinals of `data` matching `tree`, skipping
+    `dead` ones, in ascending order."""
+    if limit <= 0 or data.num_docs == 0:
+        return []
+
+    node = _bind(tree, data)
+    dead_ordinals = np.fromiter(dead or (), dtype=np.int64)
+    density = max(node.estimate, 1) / data.num_docs
+    window = max(POSTINGS_BLOCK_SIZE, math.ceil(limit / density))
+
+    matches: list[int] = []
+    lo = 0
+    while lo < data.num_docs and len(matches) < limit:
+        hi = min(data.num_docs, lo + window)
+        docs = node.docs(lo, hi)
+        if len(dead_ordinals):
+            docs = docs[~np.isin(docs, dead_ordinals)]
+        matches.extend(docs[: limit - len(matches)].tolist())
+        lo = hi
+        window *= 2
+    return matches
+
+
+def _parse_or(words: list[str], pos: int):
+    operands = []
+    tree, pos = _parse_and(words, pos)
+    operands.append(tree)
+    while pos < len(words) and words[pos] == "OR":
+        tree, pos = _parse_and(words, pos + 1)
+        operands.append(tree)
+    return _combine("or", operands), pos
+
+
+def _parse_and(words: list[str], pos: int):
+    operands = []
+    tree, pos = _parse_unary(words, pos)
+    operands.append(tree)
+    while pos < len(words) and words[pos] not in ("OR", ")"):
+        if words[pos] == "AND":
+            pos += 1
+        tree, pos = _parse_unary(words, pos)
+        operands.append(tree)
+    return _combine("and", operands), pos
+
+
+def _parse_unary(words: list[str], pos: int):
+    if pos >= len(words):
+        raise ValueError("query ends where a term was expected")
+
+    word = words[pos]
+    if word == "NOT":
+        tree, pos = _parse_unary(words, pos + 1)
+        return ("not", tree), pos
+    if word == "(":
+        tree, pos = _parse_or(words, pos + 1)
+        if pos >= len(words) or words[pos] != ")":
+            raise ValueError("unbalanced parentheses in query")
+        return tree, pos + 1
+    if word in OPERATORS or word == ")":
+        raise ValueError(f"unexpected {word!r} in query")
+    if word.startswith('"'):
+        return phrase_query(word[1:-1]), pos + 1
+
+    # punctuation is stripped, not split on ("sci-fi" is "scifi"), so a word
+    # is one term, or none if it is a stopword
+    tokens = tokenize_text(word)
+    return (("term", tokens[0]) if tokens else ALL), pos + 1
+
+
+def _combine(op: str, operands: list):
+    if op == "and":
+        operands = [tree for tree in operands if tree != ALL] or [ALL]
+    elif ALL in operands:
+        return ALL
+    if len(operands) == 1:
+        return operands[0]
+    return (op, operands)
+
+
+# Bound nodes have an `estimate` of their matches and answer `docs(lo, hi)`,
+# their matches in [lo, hi) in ascending order, and `contains(candidates)`,
+# which of the sorted `candidates` they match.
+def _bind(tree, data: CompactIndex):
+    match tree:
+        case ("all",):
+            return _All(data)
+        case ("term", token):
+            return _Term(data, token)
+        case ("phrase", tokens):
+            return _Phrase(data, tokens)
+        case ("not", operand):
+            return _Not(data, _bind(operand, data))
+        case ("and", operands):
+            return _And([_bind(operand, data) for operand in operands])
+        case ("or", operands):
+            return _Or(data, [_bind(operand, data) for operand in operands])
+    raise ValueError(f"not a query node: {tree!r}")
+
+
+class _All:
+    """Every document."""
+
+    def __init__(self, data: CompactIndex) -> None:
+        self.estimate = data.num_docs
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        return np.arange(lo, hi, dtype=np.int64)
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        return np.ones(len(candidates), dtype=bool)
+
+
+class _Term:
+    """Postings of one term, read through its skip table."""
+
+    def __init__(self, data: CompactIndex, token: str) -> None:
+        self.data = data
+        self.term_id = data.terms.find(token)
+        if self.term_id is None:
+            self.last_docs = _EMPTY
+            self.estimate = 0
+            return
+        start = data.term_blocks[self.term_id]
+        end = data.term_blocks[self.term_id + 1]
+        # last ordinal of each of the term's blocks
+        self.last_docs = data.block_last_docs[start:end]
+        self.estimate = int(
+            data.postings_offsets[self.term_id + 1]
+            - data.postings_offsets[self.term_id]
+        )
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        first = int(np.searchsorted(self.last_docs, lo))
+        end = int(np.searchsorted(self.last_docs, hi - 1)) + 1
+        if first >= len(self.last_docs):
+            return _EMPTY
+        docs, _ = self.data.term_postings(self.term_id, first, end)
+        return docs[(docs >= lo) & (docs < hi)].astype(np.int64)
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        blocks = np.searchsorted(self.last_docs, candidates)
+        needed = np.unique(blocks[blocks < len(self.last_docs)])
+        if len(needed) == 0:
+            return np.zeros(len(candidates), dtype=bool)
+
+        docs, _ = self.data.term_blocks_postings(self.term_id, needed)
+        found = np.searchsorted(docs, candidates).clip(max=len(docs) - 1)
+        return docs[found] == candidates
+
+
+class _Phrase:
+    """Documents with the phrase's terms at consecutive positions."""
+
+    def __init__(self, data: CompactIndex, tokens: list[str]) -> None:
+        if data.positions is None:
+            raise ValueError(
+                "phrase queries need positions; rebuild the index with --positions"
+            )
+        self.data = data
+        self.tokens = tokens
+        self.terms = {token: _Term(data, token) for token in tokens}
+        # documents with every term, a superset of the matches
+        self.candidates = _And(list(self.terms.values()))
+        self.estimate = self.candidates.estimate
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        docs = self.candidates.docs(lo, hi)
+        return docs[self.__verify(docs)]
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        found = self.candidates.contains(candidates)
+        hits = np.flatnonzero(found)
+        found[hits] = self.__verify(candidates[hits])
+        return found
+
+    def __verify(self, docs: np.ndarray) -> np.ndarray:
+        if len(docs) == 0:
+            return np.zeros(0, dtype=bool)
+        occurrences = {
+            token: self.data.term_positions(term.term_id, docs)
+            for token, term in self.terms.items()
+        }
+        return phrase_counts([occurrences[token] for token in self.tokens]) > 0
+
+
+class _And:
+    def __init__(self, operands: list) -> None:
+        # the rarest operand drives, the others only check its candidates;
+        # negations match most documents and so come last
+        self.operands = sorted(operands, key=lambda node: node.estimate)
+        self.estimate = self.operands[0].estimate
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        docs = self.operands[0].docs(lo, hi)
+        for operand in self.operands[1:]:
+            if len(docs) == 0:
+                break
+            docs = docs[operand.contains(docs)]
+        return docs
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        found = np.ones(len(candidates), dtype=bool)
+        for operand in self.operands:
+            remaining = np.flatnonzero(found)
+            if len(remaining) == 0:
+                break
+            found[remaining] = operand.contains(candidates[remaining])
+        return found
+
+
+class _Or:
+    def __init__(self, data: CompactIndex, operands: list) -> None:
+        self.operands = sorted(operands, key=lambda node: -node.estimate)
+        self.estimate = min(data.num_docs, sum(op.estimate for op in operands))
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        docs = self.operands[0].docs(lo, hi)
+        for operand in self.operands[1:]:
+            docs = np.union1d(docs, operand.docs(lo, hi))
+        return docs
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        found = np.zeros(len(candidates), dtype=bool)
+        for operand in self.operands:
+            remaining = np.flatnonzero(~found)
+            if len(remaining) == 0:
+                break
+            found[remaining] = operand.contains(candidates[remaining])
+        return found
+
+
+class _Not:
+    def __init__(self, data: CompactIndex, operand) -> None:
+        self.operand = operand
+        self.estimate = data.num_docs - operand.estimate
+
+    def docs(self, lo: int, hi: int) -> np.ndarray:
+        docs = np.arange(lo, hi, dtype=np.int64)
+        return docs[~self.operand.contains(docs)]
+
+    def contains(self, candidates: np.ndarray) -> np.ndarray:
+        return ~self.operand.contains(candidates)
@@ -0,0 +1,369 @@
+"""Block compression of postings lists.
+
+The postings of each term are cut into blocks of POSTINGS_BLOCK_SIZE. In a
+block, each ordinal is stored as its gap from the one before it (less one,
+so adjacent ordinals cost nothing) and each term frequency less one. A
+posting is a bit-packed record of its gap and then its frequency, each at
+the width of the largest such value in the block; a block starts on a byte
+boundary.
+
+Every block has an entry in a skip table: its byte offset, both bit widths
+and its last ordinal. The last ordinal of the previous block is the base its
+gaps count from, so any block decodes on its own, and a reader looking for
+an ordinal can bisect the table and decode a single block. Decoding works on
+whole arrays of blocks at once, reading each value with one unaligned
+64-bit load, shift and mask.
+
+Term positions, when indexed, get a block per postings block: the positions
+of each posting in turn, each stored as its gap from the one before it less
+one, starting over at each posting, at the width of the block's largest. The
+postings block gives the number of positions of each posting, its tf.
+"""
+
+import numpy as np
+
+from .helpers import POSTINGS_BLOCK_SIZE, POSTINGS_ENCODE_BATCH
+
+# the low `width` bits, by width
+_MASKS = (np.uint64(1) << np.arange(33, dtype=np.uint64)) - np.uint64(1)
+
+
+def encode_postings(
+    offsets: np.ndarray, docs: np.ndarray, tfs: np.ndarray
+) -> tuple[np.ndarray, ...]:
+    """Compress the CSR postings of a run of terms; the postings of term `t`
+    are `docs[offsets[t]:offsets[t + 1]]`, ascending, with matching `tfs`.
+
+    Returns the packed bytes and the skip table (block byte offsets, last
+    ordinals, doc and tf bit widths), plus CSR offsets of each term's blocks.
+    Byte offsets start at 0 and have one more entry than there are blocks.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) == 1:
+        return _encode_batch(offsets, docs, tfs)
+
+    # terms are encoded a batch at a time to bound the temporary arrays
+    cuts = np.arange(POSTINGS_ENCODE_BATCH, offsets[-1], POSTINGS_ENCODE_BATCH)
+    bounds = np.unique(np.r_[0, np.searchsorted(offsets, cuts), len(offsets) - 1])
+
+    parts = []
+    for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        start, end = offsets[first], offsets[last]
+        parts.append(
+            _encode_batch(
+                offsets[first : last + 1] - start, docs[start:end], tfs[start:end]
+            )
+        )
+    if len(parts) == 1:
+        return parts[0]
+
+    data, block_offsets, last_docs, doc_bits, tf_bits, term_blocks = zip(*parts)
+    byte_shifts = np.cumsum([0] + [len(d) for d in data[:-1]])
+    block_shifts = np.cumsum([0] + [t[-1] for t in term_blocks[:-1]])
+    return (
+        np.concatenate(data),
+        np.concatenate(
+            [[0]] + [o[1:] + shift for o, shift in zip(block_offsets, byte_shifts)]
+        ),
+        np.concatenate(last_docs),
+        np.concatenate(doc_bits),
+        np.concatenate(tf_bits),
+        np.concatenate(
+            [[0]] + [t[1:] + shift for t, shift in zip(term_blocks, block_shifts)]
+        ),
+    )
+
+
+def _encode_batch(offsets, docs, tfs) -> tuple[np.ndarray, ...]:
+    docs = np.asarray(docs, dtype=np.int64)
+    tfs = np.asarray(tfs, dtype=np.int64)
+    lengths = np.diff(offsets)
+
+    term_blocks = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(-(-lengths // POSTINGS_BLOCK_SIZE), out=term_blocks[1:])
+    num_blocks = int(term_blocks[-1])
+    if num_blocks == 0:
+        empty = np.zeros(0, dtype=np.uint8)
+        return (
+            empty,
+            np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.uint32),
+            empty,
+            empty,
+            term_blocks,
+        )
+
+    block_terms = np.repeat(np.arange(len(lengths)), np.diff(term_blocks))
+    block_ranks = np.arange(num_blocks) - term_blocks[block_terms]
+    block_starts = offsets[block_terms] + block_ranks * POSTINGS_BLOCK_SIZE
+    counts = np.minimum(POSTINGS_BLOCK_SIZE, offsets[block_terms + 1] - block_starts)
+
+    previous = np.empty_like(docs)
+    previous[0] = -1
+    previous[1:] = docs[:-1]
+    previous[offsets[:-1][lengths > 0]] = -1
+    gaps = docs - previous - 1
+    tfs = tfs - 1
+
+    doc_bits = _bit_length(np.maximum.reduceat(gaps, block_starts))
+    tf_bits = _bit_length(np.maximum.reduceat(tfs, block_starts))
+    block_offsets = np.zeros(num_blocks + 1, dtype=np.int64)
+    np.cumsum((counts * (doc_bits + tf_bits) + 7) // 8, out=block_offsets[1:])
+
+    within = np.arange(len(docs)) - np.repeat(block_starts, counts)
+    doc_widths = np.repeat(doc_bits, counts)
+    tf_widths = np.repeat(tf_bits, counts)
+    starts = np.repeat(8 * block_offsets[:-1], counts) + within * (
+        doc_widths + tf_widths
+    )
+    bits = np.zeros(8 * int(block_offsets[-1]), dtype=np.uint8)
+    _scatter(bits, gaps, starts, doc_widths)
+    _scatter(bits, tfs, starts + doc_widths, tf_widths)
+
+    return (
+        np.packbits(bits, bitorder="little"),
+        block_offsets,
+        docs[block_starts + counts - 1].astype(np.uint32),
+        doc_bits.astype(np.uint8),
+        tf_bits.astype(np.uint8),
+        term_blocks,
+    )
+
+
+def decode_blocks(
+    data: np.ndarray,
+    block_offsets: np.ndarray,
+    doc_bits: np.ndarray,
+    tf_bits: np.ndarray,
+    length: int,
+    base: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Ordinals and tfs of `length` postings in consecutive blocks of one
+    term, all full but the last.
+
+    `block_offsets` has one more entry than there are blocks and indexes
+    `data`; `base` is the last ordinal before the first block, or -1 when it
+    is the term's first block.
+    """
+    start, end = int(block_offsets[0]), int(block_offsets[-1])
+    # padded so a word can be read from every byte of the blocks
+    padded = np.zeros(end - start + 8, dtype=np.uint8)
+    padded[: end - start] = data[start:end]
+    words = np.ndarray((end - start + 1,), dtype="<u8", buffer=padded, strides=(1,))
+
+    # block fields of each posting; repeats are cheaper than lookups
+    def per_posting(values):
+        return np.repeat(values, POSTINGS_BLOCK_SIZE)[:length]
+
+    doc_widths = per_posting(doc_bits)
+    within = np.tile(np.arange(POSTINGS_BLOCK_SIZE), len(doc_bits))[:length]
+    starts = per_posting(8 * (block_offsets[:-1] - start)) + within * (
+        doc_widths + per_posting(tf_bits)
+    )
+    gaps = _gather(words, starts, per_posting(_MASKS[doc_bits]))
+    tfs = _gather(words, starts + doc_widths, per_posting(_MASKS[tf_bits]))
+
+    docs = base + np.cumsum(gaps + 1)
+    return docs.astype(np.uint32), (tfs + 1).astype(np.uint32)
+
+
+def decode_scattered(
+    data: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    doc_bits: np.ndarray,
+    tf_bits: np.ndarray,
+    counts: np.ndarray,
+    bases: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Ordinals and tfs of blocks anywhere in `data`, in one pass; block `i`
+    is bytes `starts[i]:ends[i]`, holds `counts[i]` postings and its gaps
+    count from `bases[i]`."""
+    words, packed = _load_words(data, starts, ends)
+
+    firsts = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=firsts[1:])
+    doc_widths = np.repeat(doc_bits.astype(np.int64), counts)
+    within = np.arange(firsts[-1]) - np.repeat(firsts[:-1], counts)
+    bit_starts = np.repeat(8 * packed[:-1], counts) + within * (
+        doc_widths + np.repeat(tf_bits, counts)
+    )
+    gaps = _gather(words, bit_starts, np.repeat(_MASKS[doc_bits], counts))
+    tfs = _gather(words, bit_starts + doc_widths, np.repeat(_MASKS[tf_bits], counts))
+
+    # a running sum over every block, restarted at each block's base
+    sums = np.cumsum(gaps + 1)
+    restarts = np.r_[0, sums][firsts[:-1]]
+    docs = sums + np.repeat(bases - restarts, counts)
+    return docs.astype(np.uint32), (tfs + 1).astype(np.uint32)
+
+
+def encode_positions(
+    offsets: np.ndarray, tfs: np.ndarray, positions: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Compress the positions of CSR postings blocked as by encode_postings;
+    posting `p` has `tfs[p]` ascending positions, next in `positions`.
+
+    Returns the packed bytes, the byte offsets of the position blocks (one
+    more than there are blocks) and their bit widths.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) == 1:
+        return _encode_positions_batch(offsets, tfs, positions)
+
+    # where each term's positions start
+    posting_firsts = np.zeros(len(tfs) + 1, dtype=np.int64)
+    np.cumsum(tfs, out=posting_firsts[1:])
+    firsts = posting_firsts[offsets]
+    del posting_firsts
+
+    # terms are encoded a batch of positions at a time, like postings
+    cuts = np.arange(POSTINGS_ENCODE_BATCH, firsts[-1], POSTINGS_ENCODE_BATCH)
+    bounds = np.unique(np.r_[0, np.searchsorted(firsts, cuts), len(offsets) - 1])
+
+    parts = []
+    for first, last in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        start, end = offsets[first], offsets[last]
+        parts.append(
+            _encode_positions_batch(
+                offsets[first : last + 1] - start,
+                tfs[start:end],
+                positions[firsts[first] : firsts[last]],
+            )
+        )
+    if len(parts) == 1:
+        return parts[0]
+
+    data, block_offsets, bits = zip(*parts)
+    byte_shifts = np.cumsum([0] + [len(d) for d in data[:-1]])
+    return (
+        np.concatenate(data),
+        np.concatenate(
+            [[0]] + [o[1:] + shift for o, shift in zip(block_offsets, byte_shifts)]
+        ),
+        np.concatenate(bits),
+    )
+
+
+def _encode_positions_batch(offsets, tfs, positions) -> tuple[np.ndarray, ...]:
+    tfs = np.asarray(tfs, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    lengths = np.diff(offsets)
+
+    term_blocks = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(-(-lengths // POSTINGS_BLOCK_SIZE), out=term_blocks[1:])
+    block_terms = np.repeat(np.arange(len(lengths)), np.diff(term_blocks))
+    block_ranks = np.arange(len(block_terms)) - term_blocks[block_terms]
+    block_starts = offsets[block_terms] + block_ranks * POSTINGS_BLOCK_SIZE
+    block_ends = np.minimum(
+        block_starts + POSTINGS_BLOCK_SIZE, offsets[block_terms + 1]
+    )
+    if len(block_starts) == 0:
+        empty = np.zeros(0, dtype=np.uint8)
+        return empty, np.zeros(1, dtype=np.int64), empty
+
+    # where the positions of each posting, and so of each block, start
+    firsts = np.zeros(len(tfs) + 1, dtype=np.int64)
+    np.cumsum(tfs, out=firsts[1:])
+    run_starts = firsts[block_starts]
+
+    previous = np.empty_like(positions)
+    previous[1:] = positions[:-1]
+    previous[firsts[:-1]] = -1
+    gaps = positions - previous - 1
+    bits = _bit_length(np.maximum.reduceat(gaps, run_starts))
+
+    data, sizes = _pack(gaps, firsts[block_ends] - run_starts, bits)
+    block_offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=block_offsets[1:])
+    return data, block_offsets, bits.astype(np.uint8)
+
+
+def decode_positions(
+    data: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    bits: np.ndarray,
+    counts: np.ndarray,
+    tfs: np.ndarray,
+) -> np.ndarray:
+    """Positions of the postings with `tfs`, `counts[i]` of which make up
+    the position block at bytes `starts[i]:ends[i]` of `data`, at `bits[i]`
+    bits each; the positions of each posting follow the one before's."""
+    tfs = np.asarray(tfs, dtype=np.int64)
+    words, packed = _load_words(data, starts, ends)
+
+    firsts = np.zeros(len(tfs) + 1, dtype=np.int64)
+    np.cumsum(tfs, out=firsts[1:])
+    # positions in each block
+    block_firsts = firsts[np.r_[0, np.cumsum(counts)]]
+    run_counts = np.diff(block_firsts)
+
+    widths = np.repeat(bits.astype(np.int64), run_counts)
+    within = np.arange(firsts[-1]) - np.repeat(block_firsts[:-1], run_counts)
+    gaps = _gather(
+        words,
+        np.repeat(8 * packed[:-1], run_counts) + within * widths,
+        np.repeat(_MASKS[bits], run_counts),
+    )
+
+    # a running sum over every posting, restarted at each
+    sums = np.cumsum(gaps + 1)
+    restarts = np.r_[0, sums][firsts[:-1]]
+    return sums - np.repeat(restarts, tfs) - 1
+
+
+def _load_words(data, starts, ends) -> tuple[np.ndarray, np.ndarray]:
+    """64-bit words at every byte of the ranges `starts[i]:ends[i]` of
+    `data` laid side by side, as in decode_blocks, and the offset of each
+    range there (one more than there are ranges)."""
+    sizes = ends - starts
+    packed = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=packed[1:])
+    padded = np.zeros(int(packed[-1]) + 8, dtype=np.uint8)
+    padded[: packed[-1]] = data[
+        np.repeat(starts - packed[:-1], sizes) + np.arange(packed[-1])
+    ]
+    words = np.ndarray((int(packed[-1]) + 1,), dtype="<u8", buffer=padded, strides=(1,))
+    return words, packed
+
+
+def _pack(values, counts, widths) -> tuple[np.ndarray, np.ndarray]:
+    """Bit-pack runs of `counts[i]` values at `widths[i]` bits each, every
+    run from a byte boundary; returns the bytes and each run's size."""
+    sizes = (counts * widths + 7) // 8
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    run_widths = np.repeat(widths, counts)
+    within = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+    bits = np.zeros(8 * int(offsets[-1]), dtype=np.uint8)
+    if len(values):
+        _scatter(
+            bits,
+            values,
+            np.repeat(8 * offsets[:-1], counts) + within * run_widths,
+            run_widths,
+        )
+    return np.packbits(bits, bitorder="little"), sizes
+
+
+def _bit_length(values: np.ndarray) -> np.ndarray:
+    # frexp gives v = m * 2**e with 0.5 <= m < 1, so e is the bit length;
+    # exact for the values here, which are below 2**53
+    return np.frexp(values.astype(np.float64))[1].astype(np.int64)
+
+
+def _scatter(bits, values, starts, widths) -> None:
+    """Write each of `values` into `bits` at `widths` bits from `starts`."""
+    for k in range(int(widths.max())):
+        has = widths > k
+        bits[starts[has] + k] = (values[has] >> k) & 1
+
+
+def _gather(words, starts, masks) -> np.ndarray:
+    """The inverse of _scatter, given `masks` of each value's low bits;
+    `words[i]` is the 64-bit word starting at byte `i`, which holds any value
+    of up to 32 bits starting in that byte."""
+    # take() is much faster than indexing on the unaligned words
+    values = words.take(starts >> 3) >> (starts & 7).astype(np.uint64)
+    return (values & masks).astype(np.int64)
@@ -1,20 +1,92 @@
+import json
 import math
+import os
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING
+
+from common.helpers import BATCH_QUERY_SIZE, read_query_batches
+from search_server.client import query_server
+from tracing.trace import emit
+
+# The index (and through it numpy) is imported inside the commands that use
+# it, so a query answered by the search server starts without loading it.
+if TYPE_CHECKING:
+    from .index import InvertedIndex
+from .helpers import (
+    AUTO_MERGE_SEGMENTS,
+    BM25_K1,
+    BM25_B,
+    DEFAULT_SEARCH_LIMIT,
+    load_documents,
+    tokenize_text,
+)
+
+
+def build_command(
+    workers: int = 1, memory_limit: int | None = None, positions: bool = False
+) -> None:
+    from .index import InvertedIndex
 
-from .index import InvertedIndex
-from .helpers import BM25_K1, BM25_B, DEFAULT_SEARCH_LIMIT, tokenize_text
-
-
-def build_command() -> None:
     print("Building inverted index...")
 
     idx = InvertedIndex()
-    idx.build()
-    idx.save()
+    if memory_limit is None:
+        idx.build(workers, positions=positions)
+        idx.save()
+    else:
+        idx.build_external(memory_limit, positions=positions)
 
     print("Inverted index built successfully.")
 
 
+def add_command(path: str) -> None:
+    from .index import InvertedIndex
+
+    movies = load_documents(path)
+
+    idx = InvertedIndex()
+    idx.add_documents(movies)
+
+    print(f"Added {len(movies)} documents.")
+    _maybe_merge(idx)
+
+
+def update_command(path: str) -> None:
+    from .index import InvertedIndex
+
+    movies = load_documents(path)
+
+    idx = InvertedIndex()
+    idx.update_documents(movies)
+
+    print(f"Updated {len(movies)} documents.")
+    _maybe_merge(idx)
+
+
+def delete_command(doc_ids: list[int]) -> None:
+    from .index import InvertedIndex
+
+    idx = InvertedIndex()
+    idx.delete_documents(doc_ids)
+
+    print(f"Deleted {len(doc_ids)} documents.")
+    _maybe_merge(idx)
+
+
+def merge_command() -> None:
+    from .index import InvertedIndex
+
+    idx = InvertedIndex()
+    idx.merge()
+
+    print(f"Merged index into 1 segment ({idx.num_docs} documents).")
+
+
 def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT):
+    from .index import InvertedIndex
+
     print("Searching for: " + query)
 
     idx = InvertedIndex()
@@ -27,7 +99,7 @@ def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT):
             if doc_id in seen:
                 continue
             seen.add(doc_id)
-            doc = idx.docmap[doc_id]
+            doc = idx.document_by_id(doc_id)
             if not doc:
                 continue
             results.append(doc)
@@ -38,7 +110,29 @@ def search_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT):
     _print_results(results)
 
 
+def boolean_command(query: str, limit: int = DEFAULT_SEARCH_LIMIT) -> None:
+    from .index import InvertedIndex
+
+    print("Searching for: " + query)
+
+    idx = InvertedIndex()
+    idx.load()
+    _print_results(idx.boolean_search(query, limit, fields=("title",)))
+
+
+def phrase_command(phrase: str, limit: int = DEFAULT_SEARCH_LIMIT) -> None:
+    from .index import InvertedIndex
+
+    print("Searching for: " + phrase)
+
+    idx = InvertedIndex()
+    idx.load()
+    _print_results(idx.phrase_search(phrase, limit, fields=("title",)))
+
+
 def tf_command(doc_id: int, term: str):
+    from .index import InvertedIndex
+
     idx = InvertedIndex()
     idx.load()
 
@@ -46,6 +140,8 @@ def tf_command(doc_id: int, term: str):
 
 
 def idf_command(term: str):
+    from .index import InvertedIndex
+
     idx = InvertedIndex()
     idx.load()
 
@@ -55,12 +151,14 @@ def idf_command(term: str):
 
     ids = idx.get_documents(term_tokens[0])
 
-    idf = math.log((len(idx.docmap) + 1) / (len(ids) + 1))
+    idf = math.log((idx.num_docs + 1) / (len(ids) + 1))
 
     print(f"Inverse document frequency of '{term}': {idf:.2f}")
 
 
 def tfidf_command(doc_id: int, term: str):
+    from .index import InvertedIndex
+
     idx = InvertedIndex()
     idx.load()
 
@@ -72,7 +170,7 @@ def tfidf_command(doc_id: int, term: str):
 
     ids = idx.get_documents(term_tokens[0])
 
-    idf = math.log((len(idx.docmap) + 1) / (len(ids) + 1))
+    idf = math.log((idx.num_docs + 1) / (len(ids) + 1))
 
     tfidf = tf * idf
 
@@ -80,6 +178,8 @@ def tfidf_command(doc_id: int, term: str):
 
 
 def bmf25idf_command(term: str):
+    from .index import InvertedIndex
+
     idx = InvertedIndex()
     idx.load()
 
@@ -89,6 +189,8 @@ def bmf25idf_command(term: str):
 
 
 def bm25tf_command(doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_B):
+    from .index import InvertedIndex
+
     idx = InvertedIndex()
     idx.load()
 
@@ -97,16 +199,69 @@ def bm25tf_command(doc_id: int, term: str, k1: float = BM25_K1, b: float = BM25_
     print(f"BM25 TF score of '{term}' in document '{doc_id}': {bm25_tf:.2f}")
 
 
-def bm25_command(query: str, limit: int, k1: float, b: float):
-    idx = InvertedIndex()
-    idx.load()
+def bm25_command(query: str, limit: int, k1: float, b: float, proximity: bool = False):
+    results = query_server(
+        "bm25", query=query, limit=limit, k1=k1, b=b, proximity=proximity
+    )
+    if results is None:
+        from .index import InvertedIndex
 
-    results = idx.bm25_search(query, limit, k1, b)
+        idx = InvertedIndex()
+        idx.load()
+        results = idx.bm25_search(query, limit, k1, b, proximity=proximity)
 
     for i, res in enumerate(results, 1):
         print(f"{i}. ({res[0]['id']}) {res[0]['title']} - Score: {res[1]:.2f}")
 
 
+def batch_search_command(path: str, limit: int, k1: float, b: float) -> None:
+    from .index import InvertedIndex
+
+    idx = InvertedIndex()
+    idx.load()
+
+    count = 0
+    start = time.perf_counter()
+    for queries in read_query_batches(path, BATCH_QUERY_SIZE):
+        for query, results in zip(
+            queries, idx.bm25_search_batch(queries, limit, k1, b)
+        ):
+            results = [
+                {"id": doc["id"], "title": doc["title"], "score": score}
+                for doc, score in results
+            ]
+            print(json.dumps({"query": query, "results": results}))
+        sys.stdout.flush()
+        emit(command="batch-search", queries=len(queries))
+        count += len(queries)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Searched {count} queries in {elapsed:.2f}s "
+        f"({count / elapsed:.1f} queries/sec)",
+        file=sys.stderr,
+    )
+
+
 def _print_results(results: list[dict]) -> None:
     for i, res in enumerate(results, 1):
         print(f"{i}. ({res['id']}) {res['title']}")
+
+
+def _maybe_merge(idx: "InvertedIndex") -> None:
+    if len(idx.segments) < AUTO_MERGE_SEGMENTS:
+        return
+
+    # Compaction runs in a detached process so the write returns right away;
+    # the index write lock keeps it from racing other writers.
+    cli = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "keyword_search_cli.py",
+    )
+    subprocess.Popen(
+        [sys.executable, cli, "merge"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    print(f"{len(idx.segments)} segments, merging in the background.")
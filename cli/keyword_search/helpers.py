@@ -1,20 +1,47 @@
+import argparse
 import json
 import os
 import string
 
-from nltk.stem import PorterStemmer
+from common.helpers import DATA_PATH, PROJECT_ROOT
+from tracing.trace import span
+
+from .tokenizer import Tokenizer
 
 DEFAULT_SEARCH_LIMIT = 5
 
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
 STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
 
-CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
-
 BM25_K1 = 1.5
 BM25_B = 0.75
 
+# Segment count at which add/update/delete start a background merge.
+AUTO_MERGE_SEGMENTS = 8
+
+# Estimated memory of one buffered posting and one buffered term in a
+# bounded-memory build; a run goes to disk once the estimate reaches the limit.
+SPIMI_POSTING_BYTES = 12
+SPIMI_TERM_BYTES = 300
+# Same, for one buffered position when positions are indexed.
+SPIMI_POSITION_BYTES = 4
+# Runs read at once by one merge pass; more runs are merged in several passes
+# so the build stays well under the open file limit.
+SPIMI_MERGE_FAN_IN = 64
+
+# Postings per compressed block; each block is one skip table entry.
+POSTINGS_BLOCK_SIZE = 128
+# Postings compressed at a time, which bounds the temporary arrays.
+POSTINGS_ENCODE_BATCH = 1 << 16
+# Recently read terms kept decoded per index.
+POSTINGS_CACHE_SIZE = 256
+
+# Query terms at most this many tokens apart count as near each other.
+PROXIMITY_WINDOW = 5
+# BM25 results rescored for proximity, per result asked for.
+PROXIMITY_RERANK_FACTOR = 4
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
 
 def load_movies() -> list[dict]:
     with open(DATA_PATH, "r") as f:
@@ -22,6 +49,29 @@ def load_movies() -> list[dict]:
     return data["movies"]
 
 
+def load_documents(path: str) -> list[dict]:
+    """Load movies from a file in the movies.json format or a bare list."""
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return data["movies"]
+    return data
+
+
+def parse_size(size: str) -> int:
+    """argparse type for a positive size like "512M", "2G" or "1048576", in
+    bytes."""
+    text = size.strip().upper().removesuffix("B")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    try:
+        number = int(float(text[: len(text) - len(unit)]) * SIZE_UNITS[unit])
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError(f"invalid size: {size!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {size!r}")
+    return number
+
+
 def load_stopwords() -> list[str]:
     with open(STOPWORDS_PATH, "r") as f:
         return f.read().splitlines()
@@ -33,20 +83,16 @@ def preprocess_text(text: str) -> str:
     return text
 
 
+_tokenizer: Tokenizer | None = None
+
+
+def get_tokenizer() -> Tokenizer:
+    global _tokenizer
+    if _tokenizer is None:
+        with span("tokenizer.load"):
+            _tokenizer = Tokenizer(load_stopwords())
+    return _tokenizer
+
+
 def tokenize_text(text: str) -> list[str]:
-    text = preprocess_text(text)
-    tokens = text.split()
-    valid_tokens = []
-    for token in tokens:
-        if token:
-            valid_tokens.append(token)
-    stop_words = load_stopwords()
-    filtered_words = []
-    for word in valid_tokens:
-        if word not in stop_words:
-            filtered_words.append(word)
-    stemmer = PorterStemmer()
-    stemmed_words = []
-    for word in filtered_words:
-        stemmed_words.append(stemmer.stem(word))
-    return stemmed_words
+    return get_tokenizer().tokenize(text)
@@ -1,114 +1,715 @@
 import os
 import pickle
-import math
-from collections import defaultdict, Counter
+import shutil
+from bisect import bisect_right
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-from .helpers import CACHE_DIR, load_movies, tokenize_text
+import numpy as np
+
+from common.helpers import CACHE_DIR, DATA_PATH
+from common.locks import read_lock, write_lock
+from document_store.helpers import iter_documents
+from result_cache.cache import ResultCache
+from tracing.trace import count, span, traced
+
+from .bm25 import (
+    TermPostings,
+    bm25_idf,
+    bm25_proximity,
+    bm25_tf,
+    max_score_top_k,
+)
+from .boolean import match_segment, parse_query, phrase_query
+from .helpers import (
+    BM25_B,
+    BM25_K1,
+    PROXIMITY_RERANK_FACTOR,
+    PROXIMITY_WINDOW,
+    get_tokenizer,
+    load_movies,
+    tokenize_text,
+)
+from .positions import proximity_sums
+from .segments import (
+    Segment,
+    SegmentArray,
+    read_manifest,
+    resolve_tombstones,
+    write_manifest,
+)
+from .spimi import build_external
+from .storage import CompactIndex
+
+# Shards per worker; more, smaller shards even out uneven document sizes.
+SHARDS_PER_WORKER = 4
 
 
 class InvertedIndex:
     def __init__(self) -> None:
-        self.index = defaultdict(set)
-        self.docmap: dict[int, dict] = {}
-        self.term_frequencies: dict[int, Counter] = {}
-        self.doc_lengths: dict[int, int] = {}
-
-        self.index_path = os.path.join(CACHE_DIR, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
-        self.tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
-
-    def build(self) -> None:
-        movies = load_movies()
-        for m in movies:
-            doc_id = m["id"]
-            doc_description = f"{m['title']} {m['description']}"
-            self.docmap[doc_id] = m
-            self.__add_document(doc_id, doc_description)
+        # segments[0] is the base index, later ones hold incremental changes
+        self.segments: list[Segment] = []
+        self.doc_ids = None
+        self.doc_lengths = None
+        self.result_cache = ResultCache()
+
+        self.index_dir = os.path.join(CACHE_DIR, "index")
+        self.segments_dir = os.path.join(self.index_dir, "segments")
+        self.lock_path = os.path.join(CACHE_DIR, "index.lock")
+
+        # Pickled caches written by earlier versions, migrated on load.
+        self.legacy_index_path = os.path.join(CACHE_DIR, "index.pkl")
+        self.legacy_docmap_path = os.path.join(CACHE_DIR, "docmap.pkl")
+        self.legacy_tf_path = os.path.join(CACHE_DIR, "term_frequencies.pkl")
+        self.legacy_doc_lengths_path = os.path.join(CACHE_DIR, "doc_lengths.pkl")
+
+    @property
+    def num_docs(self) -> int:
+        return sum(segment.num_live for segment in self.segments)
+
+    @property
+    def avg_doc_length(self) -> float:
+        if len(self.segments) == 1 and not self.segments[0].dead:
+            return self.segments[0].data.avg_doc_length
+
+        n = self.num_docs
+        if not n:
+            return 0
+        return sum(segment.live_total_length() for segment in self.segments) / n
+
+    @property
+    def generation(self) -> str:
+        """Changes whenever the indexed documents may have changed: builds,
+        segment writes and compacting merges stamp a new one."""
+        return "+".join(segment.data.generation for segment in self.segments)
+
+    @property
+    def has_positions(self) -> bool:
+        """Whether term positions are indexed, which phrase queries and
+        proximity scoring need; segments follow the base index."""
+        return all(segment.data.positions is not None for segment in self.segments)
+
+    def exists(self) -> bool:
+        with read_lock(self.lock_path):
+            return self.__exists()
+
+    def build(
+        self,
+        workers: int = 1,
+        movies: list[dict] | None = None,
+        positions: bool = False,
+    ) -> None:
+        if movies is None:
+            movies = load_movies()
+        data = _index_movies(movies, workers, positions)
+        self.segments = [Segment(self.index_dir, data, [], movies)]
+        self.__refresh()
+
+    def build_external(
+        self, memory_limit: int, path: str = DATA_PATH, positions: bool = False
+    ) -> None:
+        """Build and save the index straight from the movies file at `path`,
+        buffering about `memory_limit` bytes of postings at a time."""
+        with write_lock(self.lock_path):
+            new_dir = self.__new_index_dir()
+            build_external(iter_documents(path), new_dir, memory_limit, positions)
+            self.__replace_index(new_dir)
+            self.__load()
 
     def save(self) -> None:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-        with open(self.tf_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+        with write_lock(self.lock_path):
+            self.__write_compacted()
 
     def load(self) -> None:
-        with open(self.index_path, "rb") as f:
-            self.index = pickle.load(f)
-        with open(self.docmap_path, "rb") as f:
-            self.docmap = pickle.load(f)
-        with open(self.tf_path, "rb") as f:
-            self.term_frequencies = pickle.load(f)
-        with open(self.doc_lengths_path, "rb") as f:
-            self.doc_lengths = pickle.load(f)
+        # Writers hold the lock while they swap in a new index or remove
+        # merged segments, so readers take its shared side and never open
+        # files that are about to disappear. Migrating writes, so it takes
+        # the lock exclusively.
+        if not self.__exists() and os.path.exists(self.legacy_index_path):
+            with write_lock(self.lock_path):
+                self.__load()
+            return
+        with read_lock(self.lock_path):
+            self.__load()
+
+    @traced("index.load")
+    def __load(self) -> None:
+        if not self.__exists() and os.path.exists(self.legacy_index_path):
+            self.__migrate_legacy()
+            return
+
+        manifest = read_manifest(self.index_dir)
+        self.segments = [Segment.open(self.index_dir)]
+        for name in manifest["segments"]:
+            self.segments.append(Segment.open(os.path.join(self.segments_dir, name)))
+        self.__refresh()
+
+    def add_documents(self, movies: list[dict]) -> None:
+        with write_lock(self.lock_path):
+            self.__load()
+            self.__check_unique(movies)
+            for m in movies:
+                if self.__locate(m["id"]) is not None:
+                    raise ValueError(f"document {m['id']} already exists")
+            self.__write_segment(movies, [])
+
+    def update_documents(self, movies: list[dict]) -> None:
+        with write_lock(self.lock_path):
+            self.__load()
+            self.__check_unique(movies)
+            for m in movies:
+                if self.__locate(m["id"]) is None:
+                    raise ValueError(f"document {m['id']} doesn't exist")
+            self.__write_segment(movies, [m["id"] for m in movies])
+
+    def delete_documents(self, doc_ids: list[int]) -> None:
+        with write_lock(self.lock_path):
+            self.__load()
+            for doc_id in doc_ids:
+                if self.__locate(doc_id) is None:
+                    raise ValueError(f"document {doc_id} doesn't exist")
+            self.__write_segment([], sorted(set(doc_ids)))
+
+    def merge(self) -> None:
+        """Fold all segments and tombstones back into a single base index."""
+        with write_lock(self.lock_path):
+            self.__load()
+            if len(self.segments) > 1:
+                self.__write_compacted()
+
+    def get_postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        """Live postings of `term` as (global ordinals, tfs), ascending."""
+        if len(self.segments) == 1:
+            return self.segments[0].live_postings(term)
+
+        all_docs, all_tfs = [], []
+        for segment in self.segments:
+            docs, tfs = segment.live_postings(term)
+            all_docs.append(docs.astype(np.int64) + segment.offset)
+            all_tfs.append(tfs)
+        return np.concatenate(all_docs), np.concatenate(all_tfs)
+
+    def live_ordinals(self):
+        for segment in self.segments:
+            for local in range(segment.data.num_docs):
+                if local not in segment.dead:
+                    yield segment.offset + local
+
+    def document(self, ordinal: int, fields=None) -> dict:
+        """The document at global `ordinal`, with "id" and only `fields` if
+        given; read from its segment's document store."""
+        segment = self.__segment_of(ordinal)
+        return segment.document(ordinal - segment.offset, fields)
+
+    def document_by_id(self, doc_id: int, fields=None) -> dict | None:
+        ordinal = self.__locate(doc_id)
+        return None if ordinal is None else self.document(ordinal, fields)
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index.get(term, set())
-        return sorted(list(doc_ids))
+        doc_ids = []
+        for segment in self.segments:
+            docs, _ = segment.live_postings(term)
+            doc_ids.extend(segment.data.doc_ids[docs].tolist())
+        return sorted(doc_ids)
+
+    def boolean_search(self, query: str, limit: int, fields=None) -> list[dict]:
+        """The first `limit` live documents matching a boolean query, in
+        index order; the syntax is described in boolean.py.
+
+        Documents carry "id" plus `fields`, or every field by default.
+        """
+        count("boolean.queries")
+        return self.__match(parse_query(query), limit, fields)
+
+    def phrase_search(self, phrase: str, limit: int, fields=None) -> list[dict]:
+        """The first `limit` live documents containing `phrase`, in index
+        order; needs positions."""
+        count("phrase.queries")
+        return self.__match(phrase_query(phrase), limit, fields)
+
+    def __match(self, tree, limit: int, fields) -> list[dict]:
+        ordinals = self.__matching_ordinals(tree, limit)
+        with span("boolean.format"):
+            return [self.document(ordinal, fields) for ordinal in ordinals]
+
+    @traced("boolean.match")
+    def __matching_ordinals(self, tree, limit: int) -> list[int]:
+        ordinals = []
+        for segment in self.segments:
+            if len(ordinals) >= limit:
+                break
+            local = match_segment(
+                tree, segment.data, limit - len(ordinals), segment.dead
+            )
+            ordinals.extend(segment.offset + i for i in local)
+        return ordinals
 
     def get_tf(self, doc_id: int, term: str) -> int:
-        counter = self.term_frequencies.get(doc_id, None)
-        if not counter:
+        ordinal = self.__locate(doc_id)
+        if ordinal is None:
             raise Exception("doc_id doesn't exist")
 
         term_tokens = tokenize_text(term)
         if len(term_tokens) != 1:
             raise Exception("invalid token")
 
-        return counter[term_tokens[0]]
+        segment = self.__segment_of(ordinal)
+        local = ordinal - segment.offset
+        docs, tfs = segment.data.postings(term_tokens[0])
+        i = int(docs.searchsorted(local))
+        if i < len(docs) and docs[i] == local:
+            return int(tfs[i])
+        return 0
 
     def get_bm25_idf(self, term: str) -> float:
         term_tokens = tokenize_text(term)
         if len(term_tokens) != 1:
             raise Exception("invalid term")
 
-        df = len(self.index[term_tokens[0]])
-        n = len(self.docmap)
+        docs, _ = self.get_postings(term_tokens[0])
 
-        return math.log(((n - df + 0.5) / (df + 0.5) + 1))
+        return bm25_idf(len(docs), self.num_docs)
 
     def get_bm25_tf(self, doc_id: int, term: str, k1: float, b: float) -> float:
-        if doc_id not in self.doc_lengths:
+        ordinal = self.__locate(doc_id)
+        if ordinal is None:
             raise Exception("doc_id doesn't exist")
 
         tf = self.get_tf(doc_id, term)
 
-        length_norm = (
-            1 - b + b * (self.doc_lengths[doc_id] / self.__get_avg_doc_length())
+        return bm25_tf(tf, int(self.doc_lengths[ordinal]), self.avg_doc_length, k1, b)
+
+    def bm25_search(
+        self,
+        query: str,
+        limit: int,
+        k1: float,
+        b: float,
+        fields=None,
+        proximity: bool = False,
+    ) -> list[tuple]:
+        return self.bm25_search_batch([query], limit, k1, b, fields, proximity)[0]
+
+    def bm25_search_batch(
+        self,
+        queries: list[str],
+        limit: int,
+        k1: float,
+        b: float,
+        fields=None,
+        proximity: bool = False,
+    ) -> list[list[tuple]]:
+        """BM25 (document, score) results for each query; postings of terms
+        shared between queries are read and decoded once for the whole batch.
+
+        With `proximity`, documents where adjacent query terms occur near
+        each other score higher; that needs positions.
+
+        Documents carry "id" plus `fields`, or every field by default.
+        Repeated requests are answered from the result cache.
+        """
+        return self.result_cache.search(
+            "bm25",
+            self.generation,
+            queries,
+            lambda missing: self.__bm25_search_batch(
+                missing, limit, k1, b, fields, proximity
+            ),
+            limit=limit,
+            k1=k1,
+            b=b,
+            fields=fields,
+            proximity=proximity,
         )
-        bm25_tf = (tf * (k1 + 1)) / (tf + k1 * length_norm)
 
-        return bm25_tf
+    def __bm25_search_batch(
+        self, queries: list[str], limit: int, k1: float, b: float, fields, proximity
+    ) -> list[list[tuple]]:
+        if proximity:
+            tops = self.__proximity_top_k(queries, limit, k1, b)
+        else:
+            tops = self.__bm25_top_k(queries, limit, k1, b)
+        return self.__format_tops(tops, limit, fields)
 
-    def bm25_search(self, query: str, limit: int, k1: float, b: float) -> list[tuple]:
-        query_tokens = tokenize_text(query)
-        scores: dict[int, float] = defaultdict(float)
-        for tk in query_tokens:
-            idf = self.get_bm25_idf(tk)
-            for doc_id in self.docmap:
-                tf = self.get_bm25_tf(doc_id, tk, k1, b)
-                scores[doc_id] += tf * idf
+    @traced("bm25.format")
+    def __format_tops(self, tops, limit: int, fields) -> list[list[tuple]]:
+        results = []
+        for top in tops:
+            if top is None:
+                results.append([])
+                continue
 
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+            # Documents without any query term score 0 and fill the remaining
+            # slots in index order.
+            if len(top) < limit:
+                ranked = {i for i, _ in top}
+                for i in self.live_ordinals():
+                    if len(top) >= limit:
+                        break
+                    if i not in ranked:
+                        top.append((i, 0.0))
 
-        return [(self.docmap[scores[0]], scores[1]) for scores in sorted_scores]
+            results.append([(self.document(i, fields), score) for i, score in top])
 
-    def __get_avg_doc_length(self) -> float:
-        if not self.doc_lengths:
-            return 0
+        return results
+
+    def bm25_candidates(
+        self, query: str, limit: int, k1: float = BM25_K1, b: float = BM25_B
+    ) -> list[int]:
+        """Ids of the top `limit` documents that match at least one query
+        term, best first; a cheap first stage for cascade searches."""
+        [top] = self.__bm25_top_k([query], limit, k1, b)
+        return [int(self.doc_ids[i]) for i, _ in top or []]
+
+    def __bm25_top_k(
+        self, queries: list[str], limit: int, k1: float, b: float
+    ) -> list[list[tuple[int, float]] | None]:
+        """(ordinal, score) top-k of each query, None if it has no tokens."""
+        count("bm25.queries", len(queries))
+        with span("bm25.tokenize"):
+            tokenized = get_tokenizer().tokenize_many(queries)
+
+        postings = self.__term_postings(set().union(*tokenized), k1, b)
+        count("bm25.terms", len(postings))
+        return self.__max_score_tops(tokenized, postings, limit, k1, b)
+
+    @traced("bm25.postings")
+    def __term_postings(
+        self, terms: set[str], k1: float, b: float
+    ) -> dict[str, TermPostings]:
+        n = self.num_docs
+        avg_doc_length = self.avg_doc_length
+
+        postings = {}
+        for tk in terms:
+            docs, tfs = self.get_postings(tk)
+            if len(docs) == 0:
+                continue
+            count("bm25.postings_read", len(docs))
+            idf = bm25_idf(len(docs), n)
+            max_tf, min_length = self.__term_bounds(tk)
+            upper_bound = idf * bm25_tf(max_tf, min_length, avg_doc_length, k1, b)
+            postings[tk] = TermPostings(
+                tk, docs.tolist(), tfs.tolist(), idf, upper_bound
+            )
+        return postings
+
+    # max-score keeps a running top-k, so scoring and top-k are one stage
+    @traced("bm25.score")
+    def __max_score_tops(
+        self,
+        tokenized: list[list[str]],
+        postings: dict[str, TermPostings],
+        limit: int,
+        k1: float,
+        b: float,
+    ) -> list[list[tuple[int, float]] | None]:
+        avg_doc_length = self.avg_doc_length
+        tops = []
+        for query_tokens in tokenized:
+            if not query_tokens:
+                tops.append(None)
+                continue
+
+            query_postings = {
+                tk: postings[tk] for tk in set(query_tokens) if tk in postings
+            }
+            tops.append(
+                max_score_top_k(
+                    query_tokens,
+                    query_postings,
+                    self.doc_lengths,
+                    avg_doc_length,
+                    limit,
+                    k1,
+                    b,
+                )
+            )
+        return tops
+
+    def __proximity_top_k(
+        self, queries: list[str], limit: int, k1: float, b: float
+    ) -> list[list[tuple[int, float]] | None]:
+        """Like __bm25_top_k, with a proximity boost for each pair of
+        adjacent query terms (BM25TP); only a pool of the best BM25 results
+        is rescored, so positions are read for few documents."""
+        if not self.has_positions:
+            raise ValueError(
+                "proximity scoring needs positions; rebuild the index with --positions"
+            )
+
+        tops = self.__bm25_top_k(queries, limit * PROXIMITY_RERANK_FACTOR, k1, b)
+        tokenized = get_tokenizer().tokenize_many(queries)
+        with span("bm25.proximity"):
+            return [
+                None if top is None else self.__rerank(tokens, top, limit, k1, b)
+                for tokens, top in zip(tokenized, tops)
+            ]
+
+    def __rerank(
+        self,
+        query_tokens: list[str],
+        top: list[tuple[int, float]],
+        limit: int,
+        k1: float,
+        b: float,
+    ) -> list[tuple[int, float]]:
+        pairs = [(a, c) for a, c in zip(query_tokens, query_tokens[1:]) if a != c]
+        if not pairs:
+            return top[:limit]
+
+        ordinals = np.array([i for i, _ in top], dtype=np.int64)
+        order = np.argsort(ordinals)
+        sums = {pair: np.zeros(len(top)) for pair in pairs}
+        for segment in self.segments:
+            # candidates in this segment, ascending
+            local = ordinals[order] - segment.offset
+            inside = (local >= 0) & (local < segment.data.num_docs)
+            if not inside.any():
+                continue
+            occurrences = {}
+            for token in {token for pair in pairs for token in pair}:
+                term_id = segment.data.terms.find(token)
+                if term_id is not None:
+                    occurrences[token] = segment.data.term_positions(
+                        term_id, local[inside]
+                    )
+            for pair in pairs:
+                if pair[0] in occurrences and pair[1] in occurrences:
+                    sums[pair][order[inside]] = proximity_sums(
+                        occurrences[pair[0]], occurrences[pair[1]], PROXIMITY_WINDOW
+                    )
+
+        n = self.num_docs
+        idfs = {
+            token: bm25_idf(len(self.get_postings(token)[0]), n)
+            for pair in pairs
+            for token in pair
+        }
+        avg_doc_length = self.avg_doc_length
+        rescored = []
+        for k, (i, score) in enumerate(top):
+            doc_length = int(self.doc_lengths[i])
+            for a, c in pairs:
+                if sums[a, c][k] > 0:
+                    score += bm25_proximity(
+                        float(sums[a, c][k]),
+                        idfs[a],
+                        idfs[c],
+                        doc_length,
+                        avg_doc_length,
+                        k1,
+                        b,
+                    )
+            rescored.append((i, score))
+        rescored.sort(key=lambda entry: (-entry[1], entry[0]))
+        return rescored[:limit]
+
+    def __refresh(self) -> None:
+        resolve_tombstones(self.segments)
+        if len(self.segments) == 1:
+            self.doc_ids = self.segments[0].data.doc_ids
+            self.doc_lengths = self.segments[0].data.doc_lengths
+        else:
+            self.doc_ids = SegmentArray(self.segments, "doc_ids")
+            self.doc_lengths = SegmentArray(self.segments, "doc_lengths")
+
+    def __segment_of(self, ordinal: int) -> Segment:
+        offsets = [segment.offset for segment in self.segments]
+        return self.segments[bisect_right(offsets, ordinal) - 1]
+
+    def __locate(self, doc_id: int) -> int | None:
+        for segment in reversed(self.segments):
+            ordinal = segment.live_ordinal(doc_id)
+            if ordinal is not None:
+                return segment.offset + ordinal
+        return None
+
+    def __term_bounds(self, term: str) -> tuple[int, int]:
+        bounds = [segment.data.term_bounds(term) for segment in self.segments]
+        bounds = [bound for bound in bounds if bound is not None]
+        return max(tf for tf, _ in bounds), min(length for _, length in bounds)
+
+    def __check_unique(self, movies: list[dict]) -> None:
+        ids = [m["id"] for m in movies]
+        if len(ids) != len(set(ids)):
+            raise ValueError("duplicate document ids")
+
+    def __write_segment(self, movies: list[dict], deletes: list[int]) -> None:
+        manifest = read_manifest(self.index_dir)
+        name = f"seg-{manifest['next_id']:06d}"
+        segment = Segment(
+            os.path.join(self.segments_dir, name),
+            _index_movies(movies, positions=self.has_positions),
+            deletes,
+            movies,
+        )
+        segment.save()
+
+        manifest["segments"].append(name)
+        manifest["next_id"] += 1
+        write_manifest(self.index_dir, manifest)
+
+        self.__load()
+
+    def __write_compacted(self) -> None:
+        if len(self.segments) == 1 and not self.segments[0].dead:
+            data = self.segments[0].data
+        else:
+            data = self.__compact()
+
+        new_dir = self.__new_index_dir()
+        compacted = Segment(new_dir, data)
+        # documents are copied from the old stores while the new one is saved
+        compacted.save(self.__live_documents())
+        self.__replace_index(new_dir)
+
+        compacted.path = self.index_dir
+        self.segments = [compacted]
+        self.__refresh()
+
+    def __exists(self) -> bool:
+        return os.path.exists(os.path.join(self.index_dir, "meta.json"))
+
+    # The new index is built next to the old one and the directories are
+    # swapped. Callers hold the write lock, so readers, which load under its
+    # shared side, see either the old index or the new one, never the gap
+    # between the two renames.
+    def __new_index_dir(self) -> str:
+        new_dir = self.index_dir + ".new"
+        shutil.rmtree(new_dir, ignore_errors=True)
+        os.makedirs(new_dir)
+        return new_dir
+
+    def __replace_index(self, new_dir: str) -> None:
+        old_dir = self.index_dir + ".old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.index_dir):
+            os.replace(self.index_dir, old_dir)
+        os.replace(new_dir, self.index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def __compact(self) -> CompactIndex:
+        doc_ids, doc_lengths = [], []
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        positions: dict[str, list[int]] | None = {} if self.has_positions else None
+        for segment in self.segments:
+            data = segment.data
+            live = np.ones(data.num_docs, dtype=bool)
+            live[list(segment.dead)] = False
+            new_ordinals = np.cumsum(live) - 1 + len(doc_ids)
+
+            for local in np.flatnonzero(live).tolist():
+                doc_ids.append(int(data.doc_ids[local]))
+                doc_lengths.append(int(data.doc_lengths[local]))
+
+            for term_id in range(data.num_terms):
+                docs, tfs = data.term_postings(term_id)
+                keep = live[docs]
+                if not keep.any():
+                    continue
+                merged = postings.setdefault(data.terms[term_id], ([], []))
+                merged[0].extend(new_ordinals[docs[keep]].tolist())
+                merged[1].extend(tfs[keep].tolist())
+                if positions is not None:
+                    _, term_positions = data.term_positions(term_id, docs[keep])
+                    positions.setdefault(data.terms[term_id], []).extend(
+                        term_positions.tolist()
+                    )
+
+        return CompactIndex.from_postings(doc_ids, doc_lengths, postings, positions)
+
+    def __live_documents(self):
+        for segment in self.segments:
+            for local, doc in enumerate(segment.iter_documents()):
+                if segment.is_live(local):
+                    yield doc
+
+    def __migrate_legacy(self) -> None:
+        with open(self.legacy_docmap_path, "rb") as f:
+            docmap = pickle.load(f)
+        with open(self.legacy_tf_path, "rb") as f:
+            term_frequencies = pickle.load(f)
+        with open(self.legacy_doc_lengths_path, "rb") as f:
+            legacy_doc_lengths = pickle.load(f)
+
+        doc_ids, doc_lengths = [], []
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for ordinal, doc_id in enumerate(docmap):
+            doc_ids.append(doc_id)
+            doc_lengths.append(legacy_doc_lengths[doc_id])
+            for token, tf in term_frequencies[doc_id].items():
+                docs, tfs = postings.setdefault(token, ([], []))
+                docs.append(ordinal)
+                tfs.append(tf)
+
+        data = CompactIndex.from_postings(doc_ids, doc_lengths, postings)
+        self.segments = [Segment(self.index_dir, data, [], list(docmap.values()))]
+        self.__write_compacted()
+
+
+def _index_movies(
+    movies: list[dict], workers: int = 1, positions: bool = False
+) -> CompactIndex:
+    doc_ids = [m["id"] for m in movies]
+    texts = [f"{m['title']} {m['description']}" for m in movies]
+
+    if workers <= 1 or len(texts) < 2:
+        doc_lengths, postings, term_positions = _index_shard((0, texts, positions))
+    else:
+        doc_lengths, postings = [], {}
+        term_positions = {} if positions else None
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map() yields shard results in submission order, so the merge
+            # is deterministic and postings stay sorted.
+            for shard_lengths, shard_postings, shard_positions in executor.map(
+                _index_shard,
+                _split_shards(texts, workers * SHARDS_PER_WORKER, positions),
+            ):
+                doc_lengths.extend(shard_lengths)
+                for term, (docs, tfs) in shard_postings.items():
+                    merged = postings.setdefault(term, ([], []))
+                    merged[0].extend(docs)
+                    merged[1].extend(tfs)
+                for term, where in (shard_positions or {}).items():
+                    term_positions.setdefault(term, []).extend(where)
+
+    return CompactIndex.from_postings(doc_ids, doc_lengths, postings, term_positions)
+
+
+def _split_shards(
+    texts: list[str], count: int, positions: bool = False
+) -> list[tuple[int, list[str], bool]]:
+    size = max(1, -(-len(texts) // count))
+    return [
+        (start, texts[start : start + size], positions)
+        for start in range(0, len(texts), size)
+    ]
 
-        avg = sum(self.doc_lengths.values()) / len(self.doc_lengths)
 
-        return avg
+def _index_shard(
+    shard: tuple[int, list[str], bool],
+) -> tuple[
+    list[int], dict[str, tuple[list[int], list[int]]], dict[str, list[int]] | None
+]:
+    """Tokenize and count one contiguous run of documents, and with
+    positions, list where each term occurs in them.
 
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = tokenize_text(text)
-        self.term_frequencies[doc_id] = Counter(tokens)
-        self.doc_lengths[doc_id] = len(tokens)
-        for token in set(tokens):
-            self.index[token].add(doc_id)
+    Runs in worker processes, so it only takes and returns plain data.
+    """
+    start, texts, with_positions = shard
+    doc_lengths = []
+    postings: dict[str, tuple[list[int], list[int]]] = {}
+    positions: dict[str, list[int]] | None = {} if with_positions else None
+    for ordinal, tokens in enumerate(get_tokenizer().tokenize_many(texts), start):
+        doc_lengths.append(len(tokens))
+        for token, tf in Counter(tokens).items():
+            docs, tfs = postings.setdefault(token, ([], []))
+            docs.append(ordinal)
+            tfs.append(tf)
+        if positions is not None:
+            # documents come in order, so each term's positions are grouped
+            # by document like its postings
+            for position, token in enumerate(tokens):
+                positions.setdefault(token, []).append(position)
+    return doc_lengths, postings, positions
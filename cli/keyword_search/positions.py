@@ -0,0 +1,122 @@
+"""Term positions, an optional layer of an index.
+
+A position counts the tokens of a document before it, after stopwords are
+dropped, the same tokens doc lengths count; so a phrase matches words that
+are adjacent once stopwords are gone, and "lord of the rings" matches
+"lord rings". Positions are compressed a block per postings block, as laid
+out in codec.py, so the positions of a few documents are read by decoding
+only the blocks that hold them.
+
+Matching works on keys that pack a candidate's index above a position, so
+the occurrences of all candidates are compared with one set operation.
+"""
+
+import os
+
+import numpy as np
+
+from .codec import decode_positions, encode_positions
+
+# packed position blocks, raw bytes
+POSITIONS_FILE = "positions.bin"
+POSITION_ARRAY_FILES = ("position_offsets", "position_bits")
+
+# bits below a candidate's index in a key
+_KEY_SHIFT = 32
+
+
+class PositionIndex:
+    """Positions of every posting of an index; position block `b` holds the
+    positions of postings block `b`, at bytes `block_offsets[b]:
+    block_offsets[b + 1]` of `data`, `block_bits[b]` bits each."""
+
+    def __init__(
+        self, data: np.ndarray, block_offsets: np.ndarray, block_bits: np.ndarray
+    ) -> None:
+        self.data = data
+        self.block_offsets = block_offsets
+        self.block_bits = block_bits
+
+    def read(self, blocks: np.ndarray, counts: np.ndarray, tfs: np.ndarray):
+        """Positions of the postings with `tfs`, `counts[i]` of which fill
+        the postings block `blocks[i]`."""
+        return decode_positions(
+            self.data,
+            self.block_offsets[blocks],
+            self.block_offsets[blocks + 1],
+            self.block_bits[blocks],
+            counts,
+            tfs,
+        )
+
+    def save(self, path: str) -> None:
+        np.save(os.path.join(path, "position_offsets.npy"), self.block_offsets)
+        np.save(os.path.join(path, "position_bits.npy"), self.block_bits)
+        with open(os.path.join(path, POSITIONS_FILE), "wb") as f:
+            f.write(np.asarray(self.data).tobytes())
+
+    @classmethod
+    def open(cls, path: str) -> "PositionIndex | None":
+        """The positions of the index at `path`, None if it has none."""
+        positions_path = os.path.join(path, POSITIONS_FILE)
+        if not os.path.exists(positions_path):
+            return None
+
+        arrays = {
+            name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+            for name in POSITION_ARRAY_FILES
+        }
+        # np.memmap cannot map an empty file
+        data = (
+            np.asarray(np.memmap(positions_path, dtype=np.uint8, mode="r"))
+            if os.path.getsize(positions_path)
+            else np.zeros(0, dtype=np.uint8)
+        )
+        return cls(data, arrays["position_offsets"], arrays["position_bits"])
+
+    @classmethod
+    def from_postings(
+        cls, offsets: np.ndarray, tfs: np.ndarray, positions: np.ndarray
+    ) -> "PositionIndex":
+        """Compress `positions`, the `tfs[p]` positions of each posting `p`
+        in turn, of the CSR postings with `offsets`."""
+        return cls(*encode_positions(offsets, tfs, positions))
+
+
+def phrase_counts(occurrences: list[tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+    """How often a phrase occurs in each candidate, given (tfs, positions)
+    of the candidates for each of its tokens in order."""
+    num_candidates = len(occurrences[0][0])
+    keys = _keys(*occurrences[0])
+    for offset, (tfs, positions) in enumerate(occurrences[1:], 1):
+        if len(keys) == 0:
+            break
+        # a phrase starting at p has its token i at p + i
+        keys = np.intersect1d(keys, _keys(tfs, positions - offset), assume_unique=True)
+    return np.bincount(keys >> _KEY_SHIFT, minlength=num_candidates)
+
+
+def proximity_sums(
+    first: tuple[np.ndarray, np.ndarray],
+    second: tuple[np.ndarray, np.ndarray],
+    window: int,
+) -> np.ndarray:
+    """For each candidate, the sum of 1 / d**2 over pairs of occurrences of
+    two terms d <= `window` tokens apart, given (tfs, positions) of the
+    candidates for each term."""
+    first_keys, second_keys = _keys(*first), _keys(*second)
+    sums = np.zeros(len(first[0]))
+    for distance in range(1, window + 1):
+        for shift in (distance, -distance):
+            near = np.intersect1d(first_keys + shift, second_keys, assume_unique=True)
+            sums += np.bincount(near >> _KEY_SHIFT, minlength=len(sums)) / (
+                distance * distance
+            )
+    return sums
+
+
+def _keys(tfs: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    # shifted positions below 0 or past the end borrow from the candidate
+    # bits, and land on positions no candidate has
+    candidates = np.repeat(np.arange(len(tfs), dtype=np.int64), tfs)
+    return (candidates << _KEY_SHIFT) + positions
@@ -0,0 +1,170 @@
+import json
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from document_store.store import DocumentStore
+
+from .storage import CompactIndex
+
+MANIFEST_FILE = "segments.json"
+DOCUMENTS_DIR = "documents"
+DELETES_FILE = "deletes.json"
+
+
+class Segment:
+    """One immutable piece of the index plus the documents it indexes.
+
+    A segment written by `add`/`update`/`delete` also carries the ids it
+    removes from earlier segments. Those tombstones are resolved on load
+    into `dead`, the local ordinals of this segment hidden by later ones.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        data: CompactIndex,
+        deletes: list[int] | None = None,
+        documents=None,
+    ) -> None:
+        self.path = path
+        self.data = data
+        self.deletes = deletes or []
+        self.dead: set[int] = set()
+        # global ordinal of this segment's first document
+        self.offset = 0
+        # list of the documents in ordinal order until the segment is saved;
+        # saved segments read them from their store, opened along with the
+        # index files
+        self._documents = documents
+        self._store = None
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    @property
+    def store(self) -> DocumentStore:
+        if self._store is None:
+            raise FileNotFoundError(
+                f"no document store in {self.path}; rebuild the index"
+            )
+        return self._store
+
+    def document(self, ordinal: int, fields=None) -> dict:
+        """The document at local `ordinal`, with "id" and only `fields` if
+        given."""
+        if self._documents is None:
+            return self.store.get(ordinal, fields)
+
+        doc = self._documents[ordinal]
+        if fields is None:
+            return doc
+        return {"id": doc["id"], **{f: doc[f] for f in fields if f in doc}}
+
+    def iter_documents(self):
+        if self._documents is not None:
+            yield from self._documents
+            return
+        for ordinal in range(len(self.store)):
+            yield self.store.get(ordinal)
+
+    @property
+    def num_live(self) -> int:
+        return self.data.num_docs - len(self.dead)
+
+    def is_live(self, ordinal: int) -> bool:
+        return ordinal not in self.dead
+
+    def live_ordinal(self, doc_id: int) -> int | None:
+        ordinal = self.data.ordinal(doc_id)
+        if ordinal is None or ordinal in self.dead:
+            return None
+        return ordinal
+
+    def live_total_length(self) -> int:
+        total = int(self.data.doc_lengths.sum())
+        for ordinal in self.dead:
+            total -= int(self.data.doc_lengths[ordinal])
+        return total
+
+    def live_postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        docs, tfs = self.data.postings(term)
+        if self.dead and len(docs):
+            keep = ~np.isin(docs, np.fromiter(self.dead, dtype=docs.dtype))
+            docs, tfs = docs[keep], tfs[keep]
+        return docs, tfs
+
+    def save(self, documents=None) -> None:
+        """Write the segment to its path. `documents`, if given, replaces the
+        segment's own and is read once, in ordinal order."""
+        self.data.save(self.path)
+        if documents is None:
+            documents = self.iter_documents()
+        DocumentStore.write(documents, os.path.join(self.path, DOCUMENTS_DIR))
+        with open(os.path.join(self.path, DELETES_FILE), "w") as f:
+            json.dump(self.deletes, f)
+        self._documents = None
+        self.__open_documents()
+
+    def __open_documents(self) -> None:
+        # Opened right away rather than on first use: the store is memory-
+        # mapped, so it stays readable after a merge removes this segment.
+        self._store = DocumentStore.open(os.path.join(self.path, DOCUMENTS_DIR))
+
+    @classmethod
+    def open(cls, path: str) -> "Segment":
+        deletes = []
+        deletes_path = os.path.join(path, DELETES_FILE)
+        if os.path.exists(deletes_path):
+            with open(deletes_path, "r") as f:
+                deletes = json.load(f)
+        segment = cls(path, CompactIndex.open(path), deletes)
+        segment.__open_documents()
+        return segment
+
+
+class SegmentArray:
+    """Read-only view of one per-document array across all segments,
+    indexed by global ordinal."""
+
+    def __init__(self, segments: list[Segment], attr: str) -> None:
+        self.segments = segments
+        self.offsets = [s.offset for s in segments]
+        self.arrays = [getattr(s.data, attr) for s in segments]
+
+    def __getitem__(self, ordinal: int):
+        i = bisect_right(self.offsets, ordinal) - 1
+        return self.arrays[i][ordinal - self.offsets[i]]
+
+
+def resolve_tombstones(segments: list[Segment]) -> None:
+    """Apply each segment's deletes to the segments before it and assign
+    global ordinal offsets."""
+    offset = 0
+    for i, segment in enumerate(segments):
+        segment.offset = offset
+        offset += segment.data.num_docs
+        for doc_id in segment.deletes:
+            for earlier in segments[:i]:
+                ordinal = earlier.data.ordinal(doc_id)
+                if ordinal is not None:
+                    earlier.dead.add(ordinal)
+
+
+def read_manifest(index_dir: str) -> dict:
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {"segments": [], "next_id": 1}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_manifest(index_dir: str, manifest: dict) -> None:
+    # Write then rename so readers never see a half-written manifest.
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,307 @@
+"""Bounded-memory index construction (single-pass in-memory indexing).
+
+Documents stream in one at a time. Their postings collect in memory until
+the estimated size reaches the memory limit, then go to disk as a run
+sorted by term. A k-way merge of the runs finally compresses the postings
+and writes them sequentially, so the postings of the whole corpus are never
+in memory at once. Per-document arrays (id and length, 12 bytes a document)
+and the term dictionary are still kept in memory. Term positions, when
+indexed, travel with the postings through runs and merge alike.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import shutil
+import struct
+from array import array
+from collections import Counter
+from operator import itemgetter
+
+import numpy as np
+
+from document_store.store import DocumentStore
+from result_cache.cache import new_generation
+from tracing.trace import count, span, traced
+
+from .codec import encode_positions, encode_postings
+from .helpers import (
+    POSTINGS_ENCODE_BATCH,
+    SPIMI_MERGE_FAN_IN,
+    SPIMI_POSITION_BYTES,
+    SPIMI_POSTING_BYTES,
+    SPIMI_TERM_BYTES,
+    get_tokenizer,
+)
+from .positions import POSITIONS_FILE
+from .segments import DELETES_FILE, DOCUMENTS_DIR
+from .storage import POSTINGS_FILE, write_meta
+
+RUNS_DIR = "runs"
+# UTF-8 term length, number of postings and number of positions, before each
+# run record
+RECORD_HEADER = struct.Struct("<III")
+
+
+def build_external(
+    documents, path: str, memory_limit: int, positions: bool = False
+) -> None:
+    """Index an iterable of movies into a new index directory at `path`,
+    in the same format `Segment.save` writes, with term positions if
+    `positions`."""
+    runs_dir = os.path.join(path, RUNS_DIR)
+    os.makedirs(runs_dir)
+
+    tokenizer = get_tokenizer()
+    doc_ids = array("q")
+    doc_lengths = array("i")
+    # term -> (ordinals, tfs, positions)
+    postings: dict[str, tuple[array, array, array]] = {}
+    buffered = 0
+    num_postings = 0
+    runs = []
+
+    def indexed():
+        # documents go to the store as they are indexed, so the corpus is
+        # read once and never held in memory
+        nonlocal postings, buffered, num_postings
+        for ordinal, doc in enumerate(documents):
+            yield doc
+
+            tokens = tokenizer.tokenize(f"{doc['title']} {doc['description']}")
+            doc_ids.append(doc["id"])
+            doc_lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = (array("I"), array("I"), array("I"))
+                    buffered += SPIMI_TERM_BYTES
+                entry[0].append(ordinal)
+                entry[1].append(tf)
+                buffered += SPIMI_POSTING_BYTES
+                num_postings += 1
+            if positions:
+                for position, token in enumerate(tokens):
+                    postings[token][2].append(position)
+                buffered += SPIMI_POSITION_BYTES * len(tokens)
+
+            if buffered >= memory_limit:
+                runs.append(_write_run(runs_dir, len(runs), postings))
+                postings, buffered = {}, 0
+
+    DocumentStore.write(indexed(), os.path.join(path, DOCUMENTS_DIR))
+
+    if postings:
+        runs.append(_write_run(runs_dir, len(runs), postings))
+    del postings
+
+    doc_ids_arr = np.frombuffer(doc_ids, dtype=np.int64)
+    doc_lengths_arr = np.frombuffer(doc_lengths, dtype=np.int32)
+    runs = _reduce_runs(runs, runs_dir)
+    num_terms = _merge_runs(runs, path, doc_lengths_arr, positions)
+    shutil.rmtree(runs_dir)
+
+    np.save(os.path.join(path, "doc_ids.npy"), doc_ids_arr)
+    np.save(os.path.join(path, "doc_lengths.npy"), doc_lengths_arr)
+    np.save(
+        os.path.join(path, "doc_id_order.npy"),
+        np.argsort(doc_ids_arr, kind="stable"),
+    )
+    with open(os.path.join(path, DELETES_FILE), "w") as f:
+        json.dump([], f)
+
+    avg_doc_length = sum(doc_lengths) / len(doc_lengths) if len(doc_lengths) else 0
+    write_meta(
+        path, len(doc_ids), num_terms, num_postings, avg_doc_length, new_generation()
+    )
+
+
+def _write_run(runs_dir: str, number: int, postings: dict) -> str:
+    path = os.path.join(runs_dir, f"run-{number:06d}.bin")
+    with span("spimi.flush"), open(path, "wb") as f:
+        # str order is code point order, which is also UTF-8 byte order
+        for term in sorted(postings):
+            _write_record(f, term.encode("utf-8"), *postings[term])
+    count("spimi.runs")
+    return path
+
+
+def _write_record(f, term: bytes, docs, tfs, positions) -> None:
+    f.write(RECORD_HEADER.pack(len(term), len(docs), len(positions)))
+    f.write(term)
+    f.write(docs.tobytes())
+    f.write(tfs.tobytes())
+    f.write(positions.tobytes())
+
+
+def _read_run(path: str):
+    """Yield (term bytes, ordinals, tfs, positions) records of a run in term
+    order."""
+    with open(path, "rb") as f:
+        while header := f.read(RECORD_HEADER.size):
+            term_length, n, m = RECORD_HEADER.unpack(header)
+            term = f.read(term_length)
+            docs = np.frombuffer(f.read(4 * n), dtype=np.uint32)
+            tfs = np.frombuffer(f.read(4 * n), dtype=np.uint32)
+            positions = np.frombuffer(f.read(4 * m), dtype=np.uint32)
+            yield term, docs, tfs, positions
+
+
+def _merged_records(runs: list[str]):
+    """Yield (term bytes, ordinals, tfs, positions) of the runs merged, one
+    record per term in term order."""
+    # runs cover ascending ordinal ranges and merge() keeps equal terms in
+    # run order, so concatenated postings stay sorted by ordinal
+    records = heapq.merge(*(_read_run(run) for run in runs), key=itemgetter(0))
+    for term, group in itertools.groupby(records, key=itemgetter(0)):
+        parts = list(group)
+        yield (
+            term,
+            np.concatenate([part[1] for part in parts]),
+            np.concatenate([part[2] for part in parts]),
+            np.concatenate([part[3] for part in parts]),
+        )
+
+
+@traced("spimi.premerge")
+def _reduce_runs(runs: list[str], runs_dir: str) -> list[str]:
+    """Merge consecutive runs SPIMI_MERGE_FAN_IN at a time into larger runs
+    until no more than that many are left; returns the runs, still in
+    ordinal order."""
+    passes = 0
+    while len(runs) > SPIMI_MERGE_FAN_IN:
+        passes += 1
+        merged = []
+        for start in range(0, len(runs), SPIMI_MERGE_FAN_IN):
+            group = runs[start : start + SPIMI_MERGE_FAN_IN]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            path = os.path.join(runs_dir, f"merged-{passes:02d}-{len(merged):06d}.bin")
+            with open(path, "wb") as f:
+                for record in _merged_records(group):
+                    _write_record(f, *record)
+            for run in group:
+                os.remove(run)
+            merged.append(path)
+        runs = merged
+    count("spimi.merge_passes", passes)
+    return runs
+
+
+def _merge_runs(
+    runs: list[str], path: str, doc_lengths: np.ndarray, positions: bool = False
+) -> int:
+    """Merge runs into the term and postings arrays, and the positions if
+    `positions`, of the index at `path`; returns the number of terms."""
+    term_bytes = bytearray()
+    term_offsets = array("q", [0])
+    postings_offsets = array("q", [0])
+    max_tfs = array("I")
+    min_lengths = array("I")
+    skip_table = _SkipTableWriter(path, positions)
+
+    pending, pending_postings = [], 0
+    with span("spimi.merge"), skip_table:
+        for term, docs, tfs, where in _merged_records(runs):
+            pending.append((docs, tfs, where))
+
+            term_bytes += term
+            term_offsets.append(len(term_bytes))
+            postings_offsets.append(postings_offsets[-1] + len(docs))
+            max_tfs.append(int(tfs.max()))
+            min_lengths.append(int(doc_lengths[docs].min()))
+
+            pending_postings += len(docs)
+            # terms are compressed together, since most have few postings
+            if pending_postings >= POSTINGS_ENCODE_BATCH:
+                skip_table.write(pending)
+                pending, pending_postings = [], 0
+        skip_table.write(pending)
+
+    for name, values, dtype in [
+        ("term_bytes", term_bytes, np.uint8),
+        ("term_offsets", term_offsets, np.int64),
+        ("postings_offsets", postings_offsets, np.int64),
+        ("term_max_tfs", max_tfs, np.uint32),
+        ("term_min_lengths", min_lengths, np.uint32),
+    ]:
+        np.save(os.path.join(path, f"{name}.npy"), np.frombuffer(values, dtype=dtype))
+    return len(max_tfs)
+
+
+class _SkipTableWriter:
+    """Compresses postings a run of terms at a time, appending the packed
+    blocks to the postings file and keeping their skip table to save; and
+    likewise their positions, if `positions`."""
+
+    def __init__(self, path: str, positions: bool = False) -> None:
+        self.path = path
+        self.file = open(os.path.join(path, POSTINGS_FILE), "wb")
+        self.written = 0
+        self.term_blocks = [np.zeros(1, dtype=np.int64)]
+        self.block_offsets = [np.zeros(1, dtype=np.int64)]
+        self.last_docs, self.doc_bits, self.tf_bits = [], [], []
+        self.positions_file = None
+        if positions:
+            self.positions_file = open(os.path.join(path, POSITIONS_FILE), "wb")
+        self.positions_written = 0
+        self.position_offsets = [np.zeros(1, dtype=np.int64)]
+        self.position_bits = []
+
+    def write(self, postings: list[tuple[np.ndarray, np.ndarray, np.ndarray]]) -> None:
+        if not postings:
+            return
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        np.cumsum([len(docs) for docs, _, _ in postings], out=offsets[1:])
+        tfs = np.concatenate([tfs for _, tfs, _ in postings])
+        data, block_offsets, last_docs, doc_bits, tf_bits, term_blocks = (
+            encode_postings(
+                offsets, np.concatenate([docs for docs, _, _ in postings]), tfs
+            )
+        )
+        self.file.write(data.tobytes())
+
+        self.block_offsets.append(block_offsets[1:] + self.written)
+        self.term_blocks.append(term_blocks[1:] + self.term_blocks[-1][-1])
+        self.last_docs.append(last_docs)
+        self.doc_bits.append(doc_bits)
+        self.tf_bits.append(tf_bits)
+        self.written += len(data)
+
+        if self.positions_file is not None:
+            data, block_offsets, bits = encode_positions(
+                offsets, tfs, np.concatenate([where for _, _, where in postings])
+            )
+            self.positions_file.write(data.tobytes())
+            self.position_offsets.append(block_offsets[1:] + self.positions_written)
+            self.position_bits.append(bits)
+            self.positions_written += len(data)
+
+    def __enter__(self) -> "_SkipTableWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.file.close()
+        if self.positions_file is not None:
+            self.positions_file.close()
+        if exc_type is not None:
+            return
+        tables = [
+            ("term_blocks", self.term_blocks, np.int64),
+            ("block_offsets", self.block_offsets, np.int64),
+            ("block_last_docs", self.last_docs, np.uint32),
+            ("block_doc_bits", self.doc_bits, np.uint8),
+            ("block_tf_bits", self.tf_bits, np.uint8),
+        ]
+        if self.positions_file is not None:
+            tables += [
+                ("position_offsets", self.position_offsets, np.int64),
+                ("position_bits", self.position_bits, np.uint8),
+            ]
+        for name, parts, dtype in tables:
+            np.save(
+                os.path.join(self.path, f"{name}.npy"),
+                np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype),
+            )
@@ -0,0 +1,413 @@
+import itertools
+import json
+import os
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+
+from result_cache.cache import new_generation
+
+from .codec import decode_blocks, decode_scattered, encode_postings
+from .helpers import POSTINGS_BLOCK_SIZE, POSTINGS_CACHE_SIZE
+from .positions import PositionIndex
+
+INDEX_FORMAT = "hoopla-inverted-index"
+INDEX_VERSION = 1
+
+META_FILE = "meta.json"
+# packed postings blocks, raw bytes
+POSTINGS_FILE = "postings.bin"
+ARRAY_FILES = (
+    "doc_ids",
+    "doc_lengths",
+    "doc_id_order",
+    "term_offsets",
+    "term_bytes",
+    "postings_offsets",
+    "term_blocks",
+    "block_offsets",
+    "block_last_docs",
+    "block_doc_bits",
+    "block_tf_bits",
+    "term_max_tfs",
+    "term_min_lengths",
+)
+
+
+class TermDictionary:
+    """Sorted terms stored as one UTF-8 blob plus an offsets array.
+
+    Supports `len`, indexing and bisection, so a lookup only decodes the
+    O(log n) terms visited by the binary search.
+    """
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray) -> None:
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def find(self, term: str) -> int | None:
+        i = bisect_left(self, term)
+        if i < len(self) and self[i] == term:
+            return i
+        return None
+
+    @classmethod
+    def from_terms(cls, terms: list[str]) -> "TermDictionary":
+        encoded = [t.encode("utf-8") for t in terms]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, blob)
+
+
+class CompactIndex:
+    """Array-backed inverted index with block-compressed postings.
+
+    Documents are addressed by ordinal (their position in the corpus).
+    Term `t` has `postings_offsets[t + 1] - postings_offsets[t]` postings,
+    sorted by ordinal and packed into the blocks `term_blocks[t]:
+    term_blocks[t + 1]` of `postings_data`, as laid out in codec.py.
+    Indexes built with positions also have `positions`, else it is None.
+    """
+
+    def __init__(
+        self,
+        doc_ids: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_id_order: np.ndarray,
+        terms: TermDictionary,
+        postings_offsets: np.ndarray,
+        term_blocks: np.ndarray,
+        block_offsets: np.ndarray,
+        block_last_docs: np.ndarray,
+        block_doc_bits: np.ndarray,
+        block_tf_bits: np.ndarray,
+        postings_data: np.ndarray,
+        term_max_tfs: np.ndarray,
+        term_min_lengths: np.ndarray,
+        avg_doc_length: float,
+        generation: str | None = None,
+        cache_size: int = POSTINGS_CACHE_SIZE,
+        positions: PositionIndex | None = None,
+    ) -> None:
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.doc_id_order = doc_id_order
+        self.terms = terms
+        self.postings_offsets = postings_offsets
+        self.term_blocks = term_blocks
+        # skip table, one entry per block
+        self.block_offsets = block_offsets
+        self.block_last_docs = block_last_docs
+        self.block_doc_bits = block_doc_bits
+        self.block_tf_bits = block_tf_bits
+        self.postings_data = postings_data
+        self.term_max_tfs = term_max_tfs
+        self.term_min_lengths = term_min_lengths
+        self.avg_doc_length = avg_doc_length
+        # stamped when the index is built, which is when none is given
+        self.generation = generation or new_generation()
+        self.positions = positions
+        self.__decoded = lru_cache(maxsize=cache_size)(self.__decode)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+
+    @property
+    def num_terms(self) -> int:
+        return len(self.terms)
+
+    def ordinal(self, doc_id: int) -> int | None:
+        lo, hi = 0, self.num_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.doc_ids[self.doc_id_order[mid]] < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_docs and self.doc_ids[self.doc_id_order[lo]] == doc_id:
+            return int(self.doc_id_order[lo])
+        return None
+
+    @property
+    def num_postings(self) -> int:
+        return int(self.postings_offsets[-1])
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        term_id = self.terms.find(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+        return self.__decoded(term_id)
+
+    def term_postings(
+        self, term_id: int, first: int = 0, end: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ordinals and tfs in blocks `first:end` of the term's blocks, all
+        of them by default."""
+        start = int(self.term_blocks[term_id])
+        num_blocks = int(self.term_blocks[term_id + 1]) - start
+        end = num_blocks if end is None else min(end, num_blocks)
+        if first >= end:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+
+        # every block but the term's last is full
+        total = int(self.postings_offsets[term_id + 1] - self.postings_offsets[term_id])
+        length = min(total, end * POSTINGS_BLOCK_SIZE) - first * POSTINGS_BLOCK_SIZE
+        base = int(self.block_last_docs[start + first - 1]) if first > 0 else -1
+        return decode_blocks(
+            self.postings_data,
+            self.block_offsets[start + first : start + end + 1],
+            self.block_doc_bits[start + first : start + end],
+            self.block_tf_bits[start + first : start + end],
+            length,
+            base,
+        )
+
+    def term_blocks_postings(
+        self, term_id: int, blocks: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Ordinals and tfs in the ascending `blocks` of the term's blocks,
+        which need not be consecutive."""
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if len(blocks) == 0:
+            return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+
+        start = int(self.term_blocks[term_id])
+        total = int(self.postings_offsets[term_id + 1] - self.postings_offsets[term_id])
+        selected = start + blocks
+        return decode_scattered(
+            self.postings_data,
+            self.block_offsets[selected],
+            self.block_offsets[selected + 1],
+            self.block_doc_bits[selected],
+            self.block_tf_bits[selected],
+            np.minimum(POSTINGS_BLOCK_SIZE, total - blocks * POSTINGS_BLOCK_SIZE),
+            np.where(
+                blocks > 0, self.block_last_docs[selected - 1].astype(np.int64), -1
+            ),
+        )
+
+    def term_positions(
+        self, term_id: int, ordinals: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """The term's tf in each of the ascending `ordinals`, 0 where it does
+        not occur, and its positions in them one ordinal after another.
+
+        Only the blocks that could hold `ordinals` are decoded.
+        """
+        if self.positions is None:
+            raise ValueError("the index has no positions; rebuild it with --positions")
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        start = int(self.term_blocks[term_id])
+        last_docs = self.block_last_docs[start : self.term_blocks[term_id + 1]]
+        blocks = np.searchsorted(last_docs, ordinals)
+        blocks = np.unique(blocks[blocks < len(last_docs)])
+        if len(blocks) == 0:
+            return np.zeros(len(ordinals), dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        docs, tfs = self.term_blocks_postings(term_id, blocks)
+        total = int(self.postings_offsets[term_id + 1] - self.postings_offsets[term_id])
+        counts = np.minimum(POSTINGS_BLOCK_SIZE, total - blocks * POSTINGS_BLOCK_SIZE)
+        tfs = tfs.astype(np.int64)
+        positions = self.positions.read(start + blocks, counts, tfs)
+
+        found = np.searchsorted(docs, ordinals).clip(max=len(docs) - 1)
+        present = docs[found] == ordinals
+        found_tfs = np.where(present, tfs[found], 0)
+        # the positions of each found posting, in the order of `ordinals`
+        firsts = np.cumsum(tfs) - tfs
+        wanted = np.repeat(
+            firsts[found] - (np.cumsum(found_tfs) - found_tfs), found_tfs
+        )
+        return found_tfs, positions[wanted + np.arange(len(wanted))]
+
+    def __decode(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        docs, tfs = self.term_postings(term_id)
+        # read-only, since the same arrays are handed out on every hit
+        docs.flags.writeable = False
+        tfs.flags.writeable = False
+        return docs, tfs
+
+    def term_bounds(self, term: str) -> tuple[int, int] | None:
+        term_id = self.terms.find(term)
+        if term_id is None:
+            return None
+        return int(self.term_max_tfs[term_id]), int(self.term_min_lengths[term_id])
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        arrays = {
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "doc_id_order": self.doc_id_order,
+            "term_offsets": self.terms.offsets,
+            "term_bytes": self.terms.blob,
+            "postings_offsets": self.postings_offsets,
+            "term_blocks": self.term_blocks,
+            "block_offsets": self.block_offsets,
+            "block_last_docs": self.block_last_docs,
+            "block_doc_bits": self.block_doc_bits,
+            "block_tf_bits": self.block_tf_bits,
+            "term_max_tfs": self.term_max_tfs,
+            "term_min_lengths": self.term_min_lengths,
+        }
+        for name in ARRAY_FILES:
+            np.save(os.path.join(path, f"{name}.npy"), arrays[name])
+        with open(os.path.join(path, POSTINGS_FILE), "wb") as f:
+            f.write(np.asarray(self.postings_data).tobytes())
+        if self.positions is not None:
+            self.positions.save(path)
+
+        # meta.json is written last so a partially written index is never
+        # mistaken for a complete one.
+        write_meta(
+            path,
+            self.num_docs,
+            self.num_terms,
+            self.num_postings,
+            self.avg_doc_length,
+            self.generation,
+        )
+
+    @classmethod
+    def open(cls, path: str) -> "CompactIndex":
+        with open(os.path.join(path, META_FILE), "r") as f:
+            meta = json.load(f)
+
+        if meta.get("format") != INDEX_FORMAT:
+            raise ValueError(f"not an inverted index: {path}")
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(
+                f"unsupported index version {meta.get('version')}, "
+                f"expected {INDEX_VERSION}; rebuild the index"
+            )
+
+        # plain ndarray views of the maps, since every slice of an np.memmap
+        # pays for its subclass hooks
+        arrays = {
+            name: np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+            for name in ARRAY_FILES
+        }
+        postings_path = os.path.join(path, POSTINGS_FILE)
+        # np.memmap cannot map an empty file
+        postings_data = (
+            np.asarray(np.memmap(postings_path, dtype=np.uint8, mode="r"))
+            if os.path.getsize(postings_path)
+            else np.zeros(0, dtype=np.uint8)
+        )
+
+        return cls(
+            doc_ids=arrays["doc_ids"],
+            doc_lengths=arrays["doc_lengths"],
+            doc_id_order=arrays["doc_id_order"],
+            terms=TermDictionary(arrays["term_offsets"], arrays["term_bytes"]),
+            postings_offsets=arrays["postings_offsets"],
+            term_blocks=arrays["term_blocks"],
+            block_offsets=arrays["block_offsets"],
+            block_last_docs=arrays["block_last_docs"],
+            block_doc_bits=arrays["block_doc_bits"],
+            block_tf_bits=arrays["block_tf_bits"],
+            postings_data=postings_data,
+            term_max_tfs=arrays["term_max_tfs"],
+            term_min_lengths=arrays["term_min_lengths"],
+            avg_doc_length=meta["avg_doc_length"],
+            generation=meta["generation"],
+            positions=PositionIndex.open(path),
+        )
+
+    @classmethod
+    def from_postings(
+        cls,
+        doc_ids: list[int],
+        doc_lengths: list[int],
+        postings: dict[str, tuple[list[int], list[int]]],
+        positions: dict[str, list[int]] | None = None,
+    ) -> "CompactIndex":
+        """Build from `term -> (doc ordinals, tfs)` with ascending ordinals,
+        and optionally `term -> positions`, the ascending positions in each
+        of the term's documents in turn."""
+        doc_ids_arr = np.asarray(doc_ids, dtype=np.int64)
+        doc_lengths_arr = np.asarray(doc_lengths, dtype=np.int32)
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(postings[t][0]) for t in terms], out=offsets[1:])
+
+        docs = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint32)
+        max_tfs = np.zeros(len(terms), dtype=np.uint32)
+        min_lengths = np.zeros(len(terms), dtype=np.uint32)
+        for i, term in enumerate(terms):
+            start, end = offsets[i], offsets[i + 1]
+            docs[start:end], tfs[start:end] = postings[term]
+            max_tfs[i] = tfs[start:end].max()
+            min_lengths[i] = doc_lengths_arr[docs[start:end]].min()
+
+        avg_doc_length = sum(doc_lengths) / len(doc_lengths) if len(doc_lengths) else 0
+        data, block_offsets, last_docs, doc_bits, tf_bits, term_blocks = (
+            encode_postings(offsets, docs, tfs)
+        )
+
+        return cls(
+            doc_ids=doc_ids_arr,
+            doc_lengths=doc_lengths_arr,
+            doc_id_order=np.argsort(doc_ids_arr, kind="stable"),
+            terms=TermDictionary.from_terms(terms),
+            postings_offsets=offsets,
+            term_blocks=term_blocks,
+            block_offsets=block_offsets,
+            block_last_docs=last_docs,
+            block_doc_bits=doc_bits,
+            block_tf_bits=tf_bits,
+            postings_data=data,
+            term_max_tfs=max_tfs,
+            term_min_lengths=min_lengths,
+            avg_doc_length=avg_doc_length,
+            positions=(
+                None
+                if positions is None
+                else PositionIndex.from_postings(
+                    offsets,
+                    tfs,
+                    np.fromiter(
+                        itertools.chain.from_iterable(positions[t] for t in terms),
+                        dtype=np.uint32,
+                        count=int(tfs.sum(dtype=np.int64)),
+                    ),
+                )
+            ),
+        )
+
+
+def write_meta(
+    path: str,
+    num_docs: int,
+    num_terms: int,
+    num_postings: int,
+    avg_doc_length: float,
+    generation: str,
+) -> None:
+    """Write meta.json, which marks the index at `path` as complete."""
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(
+            {
+                "format": INDEX_FORMAT,
+                "version": INDEX_VERSION,
+                "num_docs": num_docs,
+                "num_terms": num_terms,
+                "num_postings": num_postings,
+                "avg_doc_length": avg_doc_length,
+                "generation": generation,
+            },
+            f,
+            indent=2,
+        )
@@ -0,0 +1,36 @@
+import string
+from functools import lru_cache
+from typing import Iterable
+
+# Large enough to hold the working vocabulary of a movie corpus; stems of
+# rare words are cheap to recompute when they fall out.
+STEM_CACHE_SIZE = 100_000
+
+
+class Tokenizer:
+    """Lowercase, strip punctuation, drop stopwords and Porter-stem.
+
+    Stopwords and the stemmer are set up once per instance and stems are
+    memoized in a bounded LRU, so reuse one instance across calls.
+    """
+
+    def __init__(self, stopwords: Iterable[str], cache_size: int = STEM_CACHE_SIZE):
+        # nltk is slow to import; only pay for it once text is tokenized
+        from nltk.stem import PorterStemmer
+
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=cache_size)(self.stemmer.stem)
+        self.punctuation_table = str.maketrans("", "", string.punctuation)
+
+    def tokenize(self, text: str) -> list[str]:
+        stopwords = self.stopwords
+        stem = self.stem
+        words = text.lower().translate(self.punctuation_table).split()
+        return [stem(word) for word in words if word not in stopwords]
+
+    def tokenize_many(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.tokenize(text) for text in texts]
+
+    def cache_info(self):
+        return self.stem.cache_info()
@@ -1,17 +1,25 @@
 #!/usr/bin/env python3
 import argparse
 
-from keyword_search.helpers import BM25_K1, BM25_B, DEFAULT_SEARCH_LIMIT
+from keyword_search.helpers import BM25_K1, BM25_B, DEFAULT_SEARCH_LIMIT, parse_size
 from keyword_search.commands import (
     build_command,
+    add_command,
+    update_command,
+    delete_command,
+    merge_command,
     search_command,
+    boolean_command,
+    phrase_command,
     tf_command,
     idf_command,
     tfidf_command,
     bmf25idf_command,
     bm25tf_command,
     bm25_command,
+    batch_search_command,
 )
+from tracing.trace import add_profile_arguments, profiled
 
 
 def main() -> None:
@@ -21,7 +29,56 @@ def main() -> None:
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
 
+    boolean_parser = subparsers.add_parser(
+        "boolean", help="Search movies with AND, OR, NOT and parentheses"
+    )
+    boolean_parser.add_argument(
+        "query",
+        type=str,
+        help='Boolean query, e.g. "space AND (war OR wars)"; quote phrases',
+    )
+    boolean_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Results limit"
+    )
+
+    phrase_parser = subparsers.add_parser(
+        "phrase", help="Search movies for an exact phrase (needs --positions)"
+    )
+    phrase_parser.add_argument("phrase", type=str, help="Phrase, e.g. star wars")
+    phrase_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Results limit"
+    )
+
     build_parser = subparsers.add_parser("build", help="Build docmap and index")
+    build_parser.add_argument(
+        "--workers", type=int, default=1, help="Number of worker processes"
+    )
+    build_parser.add_argument(
+        "--memory-limit",
+        type=parse_size,
+        help="Stream the corpus and spill postings to disk past this size, "
+        "e.g. 256M (single process)",
+    )
+    build_parser.add_argument(
+        "--positions",
+        action="store_true",
+        help="Also index term positions, for phrase search and proximity scoring",
+    )
+
+    add_parser = subparsers.add_parser("add", help="Add documents to the index")
+    add_parser.add_argument("path", type=str, help="JSON file with movies to add")
+
+    update_parser = subparsers.add_parser(
+        "update", help="Replace existing documents in the index"
+    )
+    update_parser.add_argument("path", type=str, help="JSON file with updated movies")
+
+    delete_parser = subparsers.add_parser(
+        "delete", help="Delete documents from the index"
+    )
+    delete_parser.add_argument("ids", type=int, nargs="+", help="Document IDs")
+
+    subparsers.add_parser("merge", help="Merge index segments into one")
 
     tf_parser = subparsers.add_parser("tf", help="Get term frequency from document")
     tf_parser.add_argument("id", type=int, help="Document ID")
@@ -62,14 +119,53 @@ def main() -> None:
     bm25search_parser.add_argument(
         "b", type=float, nargs="?", default=BM25_B, help="B tuning parameter"
     )
+    bm25search_parser.add_argument(
+        "--proximity",
+        action="store_true",
+        help="Boost query terms found near each other (needs --positions)",
+    )
 
+    batch_search_parser = subparsers.add_parser(
+        "batch-search", help="BM25 search for many queries, one per line"
+    )
+    batch_search_parser.add_argument(
+        "path", nargs="?", default="-", help="File of queries, or - for stdin"
+    )
+    batch_search_parser.add_argument(
+        "--limit", type=int, default=DEFAULT_SEARCH_LIMIT, help="Results per query"
+    )
+    batch_search_parser.add_argument(
+        "--k1", type=float, default=BM25_K1, help="K1 tuning parameter"
+    )
+    batch_search_parser.add_argument(
+        "--b", type=float, default=BM25_B, help="B tuning parameter"
+    )
+
+    add_profile_arguments(parser, subparsers)
     args = parser.parse_args()
 
+    with profiled(args.profile, args.profile_stats, command=args.command):
+        run_command(args, parser)
+
+
+def run_command(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
     match args.command:
         case "search":
             search_command(args.query)
+        case "boolean":
+            boolean_command(args.query, args.limit)
+        case "phrase":
+            phrase_command(args.phrase, args.limit)
         case "build":
-            build_command()
+            build_command(args.workers, args.memory_limit, args.positions)
+        case "add":
+            add_command(args.path)
+        case "update":
+            update_command(args.path)
+        case "delete":
+            delete_command(args.ids)
+        case "merge":
+            merge_command()
         case "tf":
             tf_command(args.id, args.term)
         case "idf":
@@ -81,7 +177,9 @@ def main() -> None:
         case "bm25tf":
             bm25tf_command(args.id, args.term, args.k1, args.b)
         case "bm25search":
-            bm25_command(args.query, args.limit, args.k1, args.b)
+            bm25_command(args.query, args.limit, args.k1, args.b, args.proximity)
+        case "batch-search":
+            batch_search_command(args.path, args.limit, args.k1, args.b)
         case _:
             parser.print_help()
 
@@ -0,0 +1,107 @@
+import copy
+import threading
+import uuid
+from collections import OrderedDict
+
+from tracing.trace import count
+
+from .helpers import RESULT_CACHE_SIZE
+
+
+def new_generation() -> str:
+    """A fresh id to stamp into an index or embeddings cache when it is
+    built, so results computed from an earlier build are never reused."""
+    return uuid.uuid4().hex
+
+
+class ResultCache:
+    """Ranked results of recent searches.
+
+    Entries are keyed on the search mode, the generation of the index or
+    embeddings that produced them, the whitespace-normalized query and the
+    remaining request parameters. A rebuild changes the generation, so its
+    searches miss; the first search under a new generation also drops the
+    mode's older entries. Results are copied in and out, so callers may
+    change what they get.
+    """
+
+    def __init__(self, size: int = RESULT_CACHE_SIZE) -> None:
+        self.size = size
+        self.entries: OrderedDict[tuple, object] = OrderedDict()
+        # mode -> latest generation seen
+        self.generations: dict[str, str] = {}
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        # the server searches from several threads
+        self.lock = threading.Lock()
+
+    def search(self, mode: str, generation: str, queries: list[str], compute, **params):
+        """Results for each of `queries`; `compute(queries)` runs once on
+        the queries not cached and returns their results in order."""
+        keys = [_key(mode, generation, query, params) for query in queries]
+        results = [None] * len(queries)
+        missing = []
+        with self.lock:
+            self.__check_generation(mode, generation)
+            for i, key in enumerate(keys):
+                cached = self.entries.get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    self.entries.move_to_end(key)
+                    results[i] = copy.deepcopy(cached)
+            self.hits[mode] = self.hits.get(mode, 0) + len(queries) - len(missing)
+            self.misses[mode] = self.misses.get(mode, 0) + len(missing)
+
+        count(f"result_cache.{mode}.hits", len(queries) - len(missing))
+        count(f"result_cache.{mode}.misses", len(missing))
+        if not missing:
+            return results
+
+        computed = compute([queries[i] for i in missing])
+        with self.lock:
+            for i, result in zip(missing, computed):
+                results[i] = result
+                if self.size > 0:
+                    self.entries[keys[i]] = copy.deepcopy(result)
+                    self.entries.move_to_end(keys[i])
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return results
+
+    def stats(self) -> dict:
+        """Hits, misses and hit rate per mode."""
+        with self.lock:
+            stats = {}
+            for mode in sorted(self.hits.keys() | self.misses.keys()):
+                hits, misses = self.hits.get(mode, 0), self.misses.get(mode, 0)
+                stats[mode] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                }
+            return stats
+
+    def __check_generation(self, mode: str, generation: str) -> None:
+        if self.generations.get(mode, generation) != generation:
+            for key in [key for key in self.entries if key[0] == mode]:
+                del self.entries[key]
+        self.generations[mode] = generation
+
+
+def _key(mode: str, generation: str, query: str, params: dict) -> tuple:
+    return (
+        mode,
+        generation,
+        " ".join(query.split()),
+        tuple(sorted((name, _hashable(value)) for name, value in params.items())),
+    )
+
+
+def _hashable(value):
+    # numpy arrays and scalars, e.g. candidate ids
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(v) for v in value)
+    return value
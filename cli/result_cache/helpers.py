@@ -0,0 +1,2 @@
+# Ranked result lists kept per searcher, least recently used dropped first.
+RESULT_CACHE_SIZE = 1024
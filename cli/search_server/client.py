@@ -0,0 +1,36 @@
+import json
+import socket
+
+from tracing.trace import enabled
+
+from .helpers import SOCKET_PATH
+
+
+def query_server(op: str, **params):
+    """Run one request on the search server.
+
+    Returns None when no server is listening, so callers can fall back to
+    searching in-process. Errors raised by the server are re-raised here.
+    Profiled commands always search in-process, where the stages are timed.
+    """
+    if enabled():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps({"op": op, **params}).encode() + b"\n")
+        stream.flush()
+        line = stream.readline()
+
+    if not line:
+        raise Exception("search server closed the connection")
+    response = json.loads(line)
+    if not response["ok"]:
+        raise Exception(response["error"])
+    return response["results"]
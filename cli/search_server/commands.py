@@ -0,0 +1,57 @@
+from .client import query_server
+from .helpers import DEFAULT_WORKERS
+
+
+def serve_command(workers: int = DEFAULT_WORKERS) -> None:
+    # imported here so the client commands stay cheap to start
+    import asyncio
+
+    from .server import SearchServer
+
+    print("Loading index, model and embeddings...")
+    asyncio.run(SearchServer(workers=workers).serve())
+
+    print("Search server stopped.")
+
+
+def reload_command() -> None:
+    if query_server("reload") is None:
+        print("No search server is running.")
+        return
+
+    print("Search server reloaded.")
+
+
+def stats_command() -> None:
+    stats = query_server("stats")
+    if stats is None:
+        print("No search server is running.")
+        return
+
+    query_cache = stats["query_cache"]
+    if query_cache is None:
+        print("Query cache: disabled")
+    else:
+        print(
+            f"Query cache: {query_cache['entries']} in memory, "
+            f"{query_cache['disk_entries']} on disk"
+        )
+        print(
+            f"  {query_cache['hits']} hits, {query_cache['disk_hits']} disk hits, "
+            f"{query_cache['misses']} misses ({query_cache['hit_rate']:.1%} hit rate)"
+        )
+
+    print("Result cache:")
+    for mode, counts in stats["result_cache"].items():
+        print(
+            f"  {mode}: {counts['hits']} hits, {counts['misses']} misses "
+            f"({counts['hit_rate']:.1%} hit rate)"
+        )
+
+
+def ping_command() -> None:
+    if query_server("ping") is None:
+        print("No search server is running.")
+        return
+
+    print("Search server is running.")
@@ -0,0 +1,7 @@
+import os
+
+from common.helpers import CACHE_DIR
+
+SOCKET_PATH = os.path.join(CACHE_DIR, "search.sock")
+# Threads for CPU-bound query work; numpy and the model release the GIL.
+DEFAULT_WORKERS = os.cpu_count() or 1
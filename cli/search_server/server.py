@@ -0,0 +1,202 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from document_store.store import META_FILE as STORE_META_FILE
+from document_store.store import DocumentStore
+from hybrid_search.hybrid_search import HybridSearch
+from keyword_search.helpers import BM25_B, BM25_K1
+from keyword_search.segments import MANIFEST_FILE
+from keyword_search.storage import META_FILE as INDEX_META_FILE
+from semantic_search.helpers import DEFAULT_SEARCH_LIMIT
+
+from .helpers import DEFAULT_WORKERS, SOCKET_PATH
+
+
+class SearchServer:
+    """Keeps the index, model and embeddings resident and answers JSON-lines
+    requests over a Unix socket.
+
+    Each request is one JSON object with an "op" and its parameters; each
+    response is `{"ok": true, "results": ...}` or `{"ok": false, "error": ...}`.
+    Query work runs on a thread pool so one slow request does not stall
+    other connections.
+
+    Before each search the server checks whether another process rebuilt the
+    documents, index or embeddings since it loaded them, and reloads if so.
+    The reload also drops cached results, because they belong to the old
+    searchers.
+    """
+
+    def __init__(self, socket_path: str = SOCKET_PATH, workers: int = DEFAULT_WORKERS):
+        self.socket_path = socket_path
+        self.executor = ThreadPoolExecutor(workers)
+        self.hybrid = None
+        # _stamp() of each of __source_paths() as of the last load
+        self.stamps = None
+        self.load_lock = threading.Lock()
+
+    def load(self) -> None:
+        with self.load_lock:
+            self.__load()
+
+    def __load(self) -> None:
+        # Stamped before reading, so a rebuild that lands during the load is
+        # seen by the next request. The first load has no searchers to ask
+        # for their paths yet.
+        stamps = self.__stamps() if self.hybrid else None
+        # the model does not change with the data, so a reload keeps it
+        model = self.hybrid.semantic_search.model if self.hybrid else None
+
+        documents = DocumentStore.load_or_create()
+        hybrid = HybridSearch(documents, model)
+        # the chunked searcher is also a SemanticSearch, so one model and one
+        # set of resident vectors serves all three semantic modes
+        hybrid.semantic_search.load_or_create_embeddings(documents)
+        hybrid.semantic_search.load_model()
+        self.hybrid = hybrid
+        self.stamps = stamps or self.__stamps()
+
+    def __reload_if_changed(self) -> None:
+        # a few stat calls, cheap next to any search
+        if self.__stamps() == self.stamps:
+            return
+        with self.load_lock:
+            if self.__stamps() != self.stamps:
+                self.__load()
+
+    def __stamps(self) -> list:
+        return [_stamp(path) for path in self.__source_paths()]
+
+    def __source_paths(self) -> list[str]:
+        # every rebuild writes one of these last or renames it into place
+        hybrid = self.hybrid
+        return [
+            os.path.join(hybrid.documents.path, STORE_META_FILE),
+            os.path.join(hybrid.idx.index_dir, INDEX_META_FILE),
+            os.path.join(hybrid.idx.index_dir, MANIFEST_FILE),
+            hybrid.semantic_search.embedding_meta_path,
+            hybrid.semantic_search.chunk_metadata_path,
+        ]
+
+    def handle(self, request: dict):
+        limit = request.get("limit", DEFAULT_SEARCH_LIMIT)
+        match request.get("op"):
+            case "ping":
+                return "pong"
+            case "reload":
+                self.load()
+                return "reloaded"
+            case "stats":
+                query_cache = self.hybrid.semantic_search.query_cache
+                return {
+                    "query_cache": query_cache.stats() if query_cache else None,
+                    # each searcher caches its own modes
+                    "result_cache": {
+                        **self.hybrid.idx.result_cache.stats(),
+                        **self.hybrid.semantic_search.result_cache.stats(),
+                        **self.hybrid.result_cache.stats(),
+                    },
+                }
+
+        self.__reload_if_changed()
+        match request.get("op"):
+            case "bm25":
+                return self.hybrid.idx.bm25_search(
+                    request["query"],
+                    limit,
+                    request.get("k1", BM25_K1),
+                    request.get("b", BM25_B),
+                    proximity=request.get("proximity", False),
+                )
+            case "search":
+                return self.hybrid.semantic_search.search(
+                    request["query"], limit, candidate_ids=self.__cascade(request)
+                )
+            case "search_chunks":
+                return self.hybrid.semantic_search.search_chunks(
+                    request["query"], limit, candidate_ids=self.__cascade(request)
+                )
+            case "weighted":
+                return self.hybrid.weighted_search(
+                    request["query"], request["alpha"], limit
+                )
+            case "rrf":
+                return self.hybrid.rrf_search(request["query"], request["k"], limit)
+            case op:
+                raise ValueError(f"unknown op {op!r}")
+
+    def __cascade(self, request: dict) -> list[int] | None:
+        if not request.get("cascade"):
+            return None
+        # with no lexical match at all, fall back to scanning every embedding
+        candidates = self.hybrid.idx.bm25_candidates(
+            request["query"], request["cascade"]
+        )
+        return candidates or None
+
+    async def serve(self) -> None:
+        self.__claim_socket()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.load)
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        server = await asyncio.start_unix_server(self.__client, path=self.socket_path)
+        print(f"Serving on {self.socket_path}")
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            # asyncio already unlinks the socket on close since Python 3.13
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.executor.shutdown(cancel_futures=True)
+
+    async def __client(self, reader, writer) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    results = await loop.run_in_executor(
+                        self.executor, self.handle, request
+                    )
+                    response = {"ok": True, "results": results}
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def __claim_socket(self) -> None:
+        if not os.path.exists(self.socket_path):
+            return
+
+        # a socket file left behind by a server that died is safe to replace
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.socket_path)
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+                return
+        raise Exception(f"a search server is already running on {self.socket_path}")
+
+
+def _stamp(path: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # rebuilds rename new files into place, which changes the inode even
+    # within the mtime's resolution
+    return stat.st_ino, stat.st_mtime_ns
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import argparse
+
+from search_server.helpers import DEFAULT_WORKERS
+from search_server.commands import (
+    serve_command,
+    reload_command,
+    ping_command,
+    stats_command,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Server CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="Keep indexes and models loaded and answer queries"
+    )
+    serve_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Threads used for query work",
+    )
+
+    subparsers.add_parser("reload", help="Make a running server reload its caches")
+    subparsers.add_parser("ping", help="Check whether a server is running")
+    subparsers.add_parser("stats", help="Show a running server's cache statistics")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "serve":
+            serve_command(args.workers)
+        case "reload":
+            reload_command()
+        case "ping":
+            ping_command()
+        case "stats":
+            stats_command()
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+
+import numpy as np
+
+from result_cache.cache import new_generation
+
+from .helpers import DEFAULT_NPROBE
+from .vectors import top_k_indices
+
+KMEANS_ITERATIONS = 10
+# k-means trains on at most this many points per centroid
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_BATCH_SIZE = 65_536
+
+
+class IVFIndex:
+    """Inverted-file index with a spherical k-means coarse quantizer.
+
+    Rows of the normalized matrix are bucketed by nearest centroid; a query
+    only scores the rows of its `nprobe` closest buckets. Raising `nprobe`
+    trades latency for recall, and `nprobe >= nlist` is exact search.
+    """
+
+    def __init__(
+        self,
+        normalized: np.ndarray,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_rows: np.ndarray,
+        embeddings_generation: str | None,
+        generation: str,
+    ) -> None:
+        self.normalized = normalized
+        self.centroids = centroids
+        # rows of list i are list_rows[list_offsets[i]:list_offsets[i + 1]]
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        # generation of the embeddings the lists were built from
+        self.embeddings_generation = embeddings_generation
+        # stamped when the lists are built, so cached results of another
+        # build are not reused
+        self.generation = generation
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    def candidates(self, query: np.ndarray, nprobe: int | None = None) -> np.ndarray:
+        if nprobe is None:
+            nprobe = DEFAULT_NPROBE
+        elif nprobe < 1:
+            raise ValueError(f"nprobe must be at least 1, got {nprobe}")
+        probes = top_k_indices(self.centroids @ query, min(nprobe, self.nlist))
+        return np.concatenate(
+            [
+                self.list_rows[self.list_offsets[p] : self.list_offsets[p + 1]]
+                for p in probes
+            ]
+        )
+
+    def search(
+        self, query: np.ndarray, k: int, nprobe: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        rows = np.sort(self.candidates(query, nprobe))
+        scores = self.normalized[rows] @ query
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+    def save(self, path: str) -> None:
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_rows=self.list_rows,
+            embeddings_generation=np.array(self.embeddings_generation or ""),
+            generation=np.array(self.generation),
+        )
+
+    @classmethod
+    def load(
+        cls, path: str, normalized: np.ndarray, embeddings_generation: str
+    ) -> "IVFIndex | None":
+        """Load a saved index, or None if it was built for other vectors,
+        i.e. another generation of the embeddings."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if str(data["embeddings_generation"]) != embeddings_generation:
+                return None
+            index = cls(
+                normalized,
+                data["centroids"],
+                data["list_offsets"],
+                data["list_rows"],
+                embeddings_generation,
+                str(data["generation"]),
+            )
+        if len(index.list_rows) != len(normalized):
+            return None
+        return index
+
+    @classmethod
+    def build(
+        cls,
+        normalized: np.ndarray,
+        nlist: int | None = None,
+        iterations: int = KMEANS_ITERATIONS,
+        seed: int = 0,
+        embeddings_generation: str | None = None,
+    ) -> "IVFIndex":
+        n = len(normalized)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(seed)
+        sample_size = min(n, nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = normalized[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _assign(sample, centroids)
+            order = np.argsort(assignments, kind="stable")
+            clusters, starts = np.unique(assignments[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            # empty clusters keep their previous centroid
+            centroids[clusters] = sums / norms
+
+        assignments = _assign(normalized, centroids)
+        list_rows = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+
+        return cls(
+            normalized,
+            centroids,
+            list_offsets,
+            list_rows,
+            embeddings_generation,
+            new_generation(),
+        )
+
+
+def result_cache_params(index: IVFIndex | None, nprobe: int | None) -> dict:
+    """How a search used `index`, for result cache keys: which build of the
+    lists it probed, and how many; all None for exact search."""
+    if index is None:
+        return {"ann": None, "nprobe": None}
+    return {"ann": index.generation, "nprobe": nprobe or DEFAULT_NPROBE}
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = vectors[start : start + ASSIGN_BATCH_SIZE]
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
@@ -1,107 +1,281 @@
 import os
-import json
 import numpy as np
 
-from .semantic_search import SemanticSearch
-from .helpers import cosine_similarity, semantic_chunk, CACHE_DIR, SCORE_PRECISION
+from common.helpers import CACHE_DIR
+from result_cache.cache import new_generation
+from tracing.trace import count, span, traced
+
+from .ann import IVFIndex, result_cache_params
+from .quantization import RESCORE_FACTOR, QuantizedMatrix, rescore
+from .semantic_search import RESULT_FIELDS, SemanticSearch
+from .helpers import (
+    semantic_chunk,
+    QUANTIZATION_KINDS,
+)
+from .vectors import group_max, normalize_rows, normalize_vector, top_k_indices
+
+CHUNK_SIZE = 4
+CHUNK_OVERLAP = 1
+# chunk embeddings depend on how text was chunked
+CHUNK_NAMESPACE = f"semantic_chunk:size={CHUNK_SIZE}:overlap={CHUNK_OVERLAP}"
 
 
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        super().__init__(model_name)
+    def __init__(self, model_name="all-MiniLM-L6-v2", quantization=None, model=None):
+        super().__init__(model_name, quantization, model)
         self.chunk_embeddings = None
-        self.chunk_metadata = None
+        self.normalized_chunk_embeddings = None
+        self.quantized_chunk_embeddings = None
+        # parallel arrays, one entry per chunk, sorted by movie_idx
+        self.chunk_movie_idx = None
+        self.chunk_idx = None
+        # document store fingerprint and chunking the chunks were built from
+        self.chunk_fingerprint = None
+        # stamped when chunk embeddings are built; keys the result cache
+        self.chunk_generation = None
+        # chunk rows [movie_starts[i], movie_ends[i]) belong to movie
+        # chunk_movies[i]; only movies with chunks are listed
+        self.chunk_movies = None
+        self.movie_starts = None
+        self.movie_ends = None
+        self.chunk_ann_index = None
 
         self.chunk_embeddings_path = os.path.join(CACHE_DIR, "chunk_embeddings.npy")
-        self.chunk_metadata_path = os.path.join(CACHE_DIR, "chunk_metadata.json")
+        self.chunk_metadata_path = os.path.join(CACHE_DIR, "chunk_metadata.npz")
+        self.chunk_ann_index_path = os.path.join(CACHE_DIR, "chunk_embeddings.ivf.npz")
+        self.quantized_chunk_paths = {
+            kind: os.path.join(CACHE_DIR, f"chunk_embeddings.{kind}.npz")
+            for kind in QUANTIZATION_KINDS
+        }
+
+    def search_chunks(self, query: str, limit: int, nprobe=None, candidate_ids=None):
+        """Top movies by their best-matching chunk.
 
-    def search_chunks(self, query: str, limit: int):
-        if self.chunk_embeddings is None or self.chunk_metadata is None:
+        With `candidate_ids`, only the chunks of those movies are scored.
+        """
+        if self.chunk_embeddings is None or self.chunk_movie_idx is None:
             raise ValueError("run load_or_create_chunk_embeddings first")
 
-        if not self.documents or not self.document_map:
+        if self.documents is None or len(self.documents) == 0:
             raise ValueError("run load_or_create_chunk_embeddings first")
 
+        return self.result_cache.search(
+            "chunks",
+            self.chunk_generation,
+            [query],
+            lambda missing: [
+                self.__search_chunks(missing[0], limit, nprobe, candidate_ids)
+            ],
+            limit=limit,
+            quantization=self.quantization,
+            candidate_ids=candidate_ids,
+            **result_cache_params(self.chunk_ann_index, nprobe),
+        )[0]
+
+    def __search_chunks(self, query, limit, nprobe, candidate_ids):
+        count("chunks.queries")
         query_embedding = self.generate_embedding(query)
-        chunk_scores = []
-        for i, chunk in enumerate(self.chunk_embeddings):
-            score = cosine_similarity(query_embedding, chunk)
-            chunk_scores.append(
-                {
-                    "chunk_idx": self.chunk_metadata[i]["chunk_idx"],
-                    "movie_idx": self.chunk_metadata[i]["movie_idx"],
-                    "score": score,
-                }
-            )
+        if limit <= 0 or len(self.movie_starts) == 0:
+            return []
+
+        query_embedding = normalize_vector(query_embedding)
+        movies, movie_scores = self.__movie_scores(
+            query_embedding, limit, nprobe, candidate_ids
+        )
+        with span("top_k"):
+            top = top_k_indices(movie_scores, limit)
+        return self.__chunk_results(movies[top], movie_scores[top])
 
-        idx_scores = {}
-        for chunk in chunk_scores:
-            idx_scores[chunk["movie_idx"]] = max(
-                idx_scores.get(chunk["movie_idx"], 0), chunk["score"]
+    @traced("chunks.score")
+    def __movie_scores(self, query_embedding, limit, nprobe, candidate_ids):
+        if candidate_ids is not None:
+            rows = self.candidate_rows(candidate_ids)
+            groups = np.searchsorted(self.chunk_movies, rows)
+            groups = groups[groups < len(self.chunk_movies)]
+            # candidates without chunks land on a neighbouring movie's group
+            groups = np.unique(groups[np.isin(self.chunk_movies[groups], rows)])
+            movies, movie_scores = self.__score_movies(query_embedding, groups)
+        elif self.chunk_ann_index is not None:
+            rows = self.chunk_ann_index.candidates(query_embedding, nprobe)
+            chunk_scores = self.normalized_chunk_embeddings[rows] @ query_embedding
+            movies, movie_scores = group_max(self.chunk_movie_idx[rows], chunk_scores)
+        elif self.quantized_chunk_embeddings is not None:
+            movies, movie_scores = self.__search_quantized_chunks(
+                query_embedding, limit
             )
+        else:
+            chunk_scores = self.normalized_chunk_embeddings @ query_embedding
+            movies = self.chunk_movies
+            movie_scores = np.maximum.reduceat(chunk_scores, self.movie_starts)
 
-        sorted_idx_scores = sorted(
-            idx_scores.items(), key=lambda x: x[1], reverse=True
-        )[:limit]
+        # best chunk per movie; scores start at 0 so negatives clip to 0
+        return movies, np.maximum(movie_scores, 0)
 
+    @traced("chunks.format")
+    def __chunk_results(self, movies, scores):
         results = []
-        for i, score in sorted_idx_scores:
-            doc = self.documents[i]
+        for i, score in zip(movies.tolist(), scores.tolist()):
+            doc = self.documents.get(i, RESULT_FIELDS)
             results.append(
                 {
                     "id": doc["id"],
                     "title": doc["title"],
                     "document": doc["description"][:100],
-                    "score": round(score, SCORE_PRECISION),
+                    "score": score,
                 }
             )
 
         return results
 
-    def build_chunk_embeddings(self, documents):
+    def build_chunk_embeddings(self, documents, workers: int = 1):
         self.documents = documents
-        self.document_map = {d["id"]: d for d in documents}
 
         chunks = []
-        metadata = []
-        for i, doc in enumerate(documents):
-            if not doc["description"]:
+        movie_idx = []
+        chunk_idx = []
+        for i, description in enumerate(documents.values("description")):
+            if not description:
                 continue
 
-            chunked = semantic_chunk(doc["description"], 4, 1)
-            chunk_count = len(chunked)
+            chunked = semantic_chunk(description, CHUNK_SIZE, CHUNK_OVERLAP)
             for j, c in enumerate(chunked):
                 chunks.append(c)
-                data = {"movie_idx": i, "chunk_idx": j, "total_chunks": chunk_count}
-                metadata.append(data)
+                movie_idx.append(i)
+                chunk_idx.append(j)
 
-        self.chunk_embeddings = self.model.encode(chunks, show_progress_bar=True)
-        self.chunk_metadata = metadata
+        self.chunk_embeddings = self.embedding_store.encode(
+            chunks, CHUNK_NAMESPACE, workers
+        )
+        self.chunk_fingerprint = _chunk_fingerprint(documents)
+        self.chunk_generation = new_generation()
+        self.__set_chunk_metadata(
+            np.asarray(movie_idx, dtype=np.int32), np.asarray(chunk_idx, dtype=np.int32)
+        )
 
         np.save(self.chunk_embeddings_path, self.chunk_embeddings)
-        with open(self.chunk_metadata_path, "w") as f:
-            json.dump(
-                {
-                    "chunks": self.chunk_metadata,
-                    "total_chunks": len(self.chunk_embeddings),
-                },
-                f,
-                indent=2,
-            )
+        self.__save_chunk_metadata()
+        # indexes derived from the old vectors would be stale
+        self.chunk_ann_index = None
+        for path in [self.chunk_ann_index_path, *self.quantized_chunk_paths.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.__prepare_chunk_embeddings()
 
         return self.chunk_embeddings
 
-    def load_or_create_chunk_embeddings(self, documents):
+    def load_or_create_chunk_embeddings(self, documents, workers: int = 1):
         self.documents = documents
-        self.document_map = {d["id"]: d for d in documents}
+        if self.__load_chunk_embeddings(documents):
+            return self.chunk_embeddings
+        return self.build_chunk_embeddings(documents, workers)
 
-        if os.path.exists(self.chunk_embeddings_path) and os.path.exists(
-            self.chunk_metadata_path
+    @traced("chunks.load")
+    def __load_chunk_embeddings(self, documents) -> bool:
+        """Load the cached chunk embeddings if they match `documents`."""
+        if not (
+            os.path.exists(self.chunk_embeddings_path)
+            and os.path.exists(self.chunk_metadata_path)
         ):
-            self.chunk_embeddings = np.load(self.chunk_embeddings_path)
-            with open(self.chunk_metadata_path, "r") as f:
-                self.chunk_metadata = json.load(f)["chunks"]
+            return False
 
-            return self.chunk_embeddings
+        mmap_mode = "r" if self.quantization else None
+        self.chunk_embeddings = np.load(self.chunk_embeddings_path, mmap_mode=mmap_mode)
+        self.__load_chunk_metadata()
+        if self.chunk_fingerprint != _chunk_fingerprint(documents):
+            return False
+        self.__prepare_chunk_embeddings()
+        return True
+
+    def load_or_create_chunk_ann_index(self):
+        if self.normalized_chunk_embeddings is None:
+            raise ValueError(
+                "run load_or_create_chunk_embeddings first, without quantization"
+            )
+
+        self.chunk_ann_index = IVFIndex.load(
+            self.chunk_ann_index_path,
+            self.normalized_chunk_embeddings,
+            self.chunk_generation,
+        )
+        if self.chunk_ann_index is None:
+            self.chunk_ann_index = IVFIndex.build(
+                self.normalized_chunk_embeddings,
+                embeddings_generation=self.chunk_generation,
+            )
+            self.chunk_ann_index.save(self.chunk_ann_index_path)
+
+        return self.chunk_ann_index
+
+    def __set_chunk_metadata(self, movie_idx: np.ndarray, chunk_idx: np.ndarray):
+        order = np.lexsort((chunk_idx, movie_idx))
+        if not np.array_equal(order, np.arange(len(order))):
+            self.chunk_embeddings = self.chunk_embeddings[order]
+            movie_idx, chunk_idx = movie_idx[order], chunk_idx[order]
+
+        self.chunk_movie_idx = movie_idx
+        self.chunk_idx = chunk_idx
+        # a movie's rows start where movie_idx changes; none without chunks
+        self.movie_starts = np.flatnonzero(np.diff(movie_idx, prepend=-1))
+        self.movie_ends = np.r_[self.movie_starts[1:], len(movie_idx)][
+            : len(self.movie_starts)
+        ]
+        self.chunk_movies = movie_idx[self.movie_starts]
+
+    def __prepare_chunk_embeddings(self):
+        if self.quantization is None:
+            self.normalized_chunk_embeddings = normalize_rows(self.chunk_embeddings)
+            return
+
+        path = self.quantized_chunk_paths[self.quantization]
+        self.quantized_chunk_embeddings = QuantizedMatrix.load(
+            path, len(self.chunk_embeddings)
+        )
+        if self.quantized_chunk_embeddings is None:
+            self.quantized_chunk_embeddings = QuantizedMatrix.from_embeddings(
+                self.chunk_embeddings, self.quantization
+            )
+            self.quantized_chunk_embeddings.save(path)
+
+    def __search_quantized_chunks(self, query_embedding, limit):
+        # approximate best chunk per movie, then exact scores for every chunk
+        # of the most promising movies
+        approx = self.quantized_chunk_embeddings.scores(query_embedding)
+        approx_movie_scores = np.maximum.reduceat(approx, self.movie_starts)
+        with span("top_k"):
+            groups = np.sort(top_k_indices(approx_movie_scores, limit * RESCORE_FACTOR))
+        return self.__score_movies(query_embedding, groups)
+
+    def __score_movies(self, query_embedding, groups):
+        """Exact best-chunk score of the movies at positions `groups` of
+        chunk_movies, reading only their chunk rows."""
+        if len(groups) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        starts, ends = self.movie_starts[groups], self.movie_ends[groups]
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+        if self.normalized_chunk_embeddings is not None:
+            scores = self.normalized_chunk_embeddings[rows] @ query_embedding
         else:
-            return self.build_chunk_embeddings(documents)
+            scores = rescore(self.chunk_embeddings, rows, query_embedding)
+
+        offsets = np.r_[0, np.cumsum(ends - starts)[:-1]]
+        return self.chunk_movies[groups], np.maximum.reduceat(scores, offsets)
+
+    def __save_chunk_metadata(self):
+        np.savez(
+            self.chunk_metadata_path,
+            movie_idx=self.chunk_movie_idx,
+            chunk_idx=self.chunk_idx,
+            fingerprint=np.array(self.chunk_fingerprint),
+            generation=np.array(self.chunk_generation),
+        )
+
+    def __load_chunk_metadata(self):
+        with np.load(self.chunk_metadata_path) as metadata:
+            self.__set_chunk_metadata(metadata["movie_idx"], metadata["chunk_idx"])
+            self.chunk_fingerprint = str(metadata["fingerprint"])
+            self.chunk_generation = str(metadata["generation"])
+
+
+def _chunk_fingerprint(documents) -> str:
+    return f"{documents.fingerprint}:{CHUNK_NAMESPACE}"
@@ -1,26 +1,66 @@
-from .semantic_search import SemanticSearch
-from .chunked_semantic_search import ChunkedSemanticSearch
-from .helpers import load_movies, MODEL_NAME, semantic_chunk, chunk
-
-
-def handler_search_chunks(query: str, limit: int):
-    css = ChunkedSemanticSearch(MODEL_NAME)
-    documents = load_movies()
-    css.load_or_create_chunk_embeddings(documents)
-
-    results = css.search_chunks(query, limit)
+import json
+import sys
+import time
+
+from common.helpers import BATCH_QUERY_SIZE, read_query_batches
+from search_server.client import query_server
+from tracing.trace import emit
+
+# The searchers and the document store (and through them numpy) are
+# imported inside the handlers that use them, so text-only commands start
+# without loading them.
+from .helpers import (
+    MODEL_NAME,
+    QUERY_CACHE_DIR,
+    QUERY_CACHE_DISK_SIZE,
+    SCORE_PRECISION,
+    semantic_chunk,
+    chunk,
+)
+
+
+def handler_search_chunks(
+    query: str,
+    limit: int,
+    ann: bool = False,
+    nprobe=None,
+    quantization=None,
+    cascade: int | None = None,
+):
+    # the search server only holds exact, full-precision vectors
+    results = None
+    if not ann and quantization is None:
+        results = query_server(
+            "search_chunks", query=query, limit=limit, cascade=cascade
+        )
+    if results is None:
+        from document_store.store import DocumentStore
+        from .chunked_semantic_search import ChunkedSemanticSearch
+
+        css = ChunkedSemanticSearch(MODEL_NAME, quantization)
+        documents = DocumentStore.load_or_create()
+        css.load_or_create_chunk_embeddings(documents)
+        if ann:
+            css.load_or_create_chunk_ann_index()
+        candidate_ids = _cascade_candidates(query, cascade) if cascade else None
+        results = css.search_chunks(query, limit, nprobe, candidate_ids)
 
     print(f"Query: {query}")
     print("Results:")
     for i, result in enumerate(results, start=1):
-        print(f"\n{i}. {result['title']} (score: {result['score']:.4f})")
+        # scores stay exact for fusion; rounding is only for display
+        score = round(result["score"], SCORE_PRECISION)
+        print(f"\n{i}. {result['title']} (score: {score:.4f})")
         print(f"   {result['document']}...")
 
 
-def handler_embed_chunks():
+def handler_embed_chunks(workers: int = 1):
+    from document_store.store import DocumentStore
+    from .chunked_semantic_search import ChunkedSemanticSearch
+
     css = ChunkedSemanticSearch(MODEL_NAME)
-    documents = load_movies()
-    embeddings = css.load_or_create_chunk_embeddings(documents)
+    documents = DocumentStore.load_or_create()
+    embeddings = css.load_or_create_chunk_embeddings(documents, workers)
 
     print(f"Generated {len(embeddings)} chunked embeddings")
 
@@ -42,6 +82,8 @@ def handler_chunk(text: str, size: int, overlap: int):
 
 
 def handler_verify_model():
+    from .semantic_search import SemanticSearch
+
     ss = SemanticSearch(MODEL_NAME)
 
     print(f"Model loaded: {ss.model}")
@@ -49,6 +91,8 @@ def handler_verify_model():
 
 
 def handler_embed_text(text: str):
+    from .semantic_search import SemanticSearch
+
     ss = SemanticSearch(MODEL_NAME)
 
     embedding = ss.generate_embedding(text)
@@ -58,12 +102,15 @@ def handler_embed_text(text: str):
     print(f"Dimensions: {embedding.shape[0]}")
 
 
-def handler_verify_embeddings():
+def handler_verify_embeddings(workers: int = 1):
+    from document_store.store import DocumentStore
+    from .semantic_search import SemanticSearch
+
     ss = SemanticSearch(MODEL_NAME)
 
-    documents = load_movies()
+    documents = DocumentStore.load_or_create()
 
-    embeddings = ss.load_or_create_embeddings(documents)
+    embeddings = ss.load_or_create_embeddings(documents, workers)
 
     print(f"Nubmer of docs: {len(documents)}")
     print(
@@ -72,6 +119,8 @@ def handler_verify_embeddings():
 
 
 def handler_embed_query(query: str):
+    from .semantic_search import SemanticSearch
+
     ss = SemanticSearch(MODEL_NAME)
 
     embedding = ss.generate_embedding(query)
@@ -81,14 +130,88 @@ def handler_embed_query(query: str):
     print(f"Shape: {embedding.shape}")
 
 
-def handler_search(query: str, limit: int):
-    ss = SemanticSearch(MODEL_NAME)
-    documents = load_movies()
-    ss.load_or_create_embeddings(documents)
-
-    results = ss.search(query, limit)
+def handler_search(
+    query: str,
+    limit: int,
+    ann: bool = False,
+    nprobe=None,
+    quantization=None,
+    cascade: int | None = None,
+):
+    # the search server only holds exact, full-precision vectors
+    results = None
+    if not ann and quantization is None:
+        results = query_server("search", query=query, limit=limit, cascade=cascade)
+    if results is None:
+        from document_store.store import DocumentStore
+        from .semantic_search import SemanticSearch
+
+        ss = SemanticSearch(MODEL_NAME, quantization)
+        documents = DocumentStore.load_or_create()
+        ss.load_or_create_embeddings(documents)
+        if ann:
+            ss.load_or_create_ann_index()
+        candidate_ids = _cascade_candidates(query, cascade) if cascade else None
+        results = ss.search(query, limit, nprobe, candidate_ids)
 
     for i, r in enumerate(results, start=1):
         print(f"{i}. {r['title']} (score: {r['score']:.4f})")
         print(f"   {r['description'][:100]} ...")
         print()
+
+
+def handler_batch_search(
+    path: str, limit: int, ann: bool = False, nprobe=None, quantization=None
+):
+    from document_store.store import DocumentStore
+    from .semantic_search import SemanticSearch
+
+    ss = SemanticSearch(MODEL_NAME, quantization)
+    documents = DocumentStore.load_or_create()
+    ss.load_or_create_embeddings(documents)
+    if ann:
+        ss.load_or_create_ann_index()
+
+    count = 0
+    start = time.perf_counter()
+    for queries in read_query_batches(path, BATCH_QUERY_SIZE):
+        for query, results in zip(queries, ss.search_batch(queries, limit, nprobe)):
+            print(json.dumps({"query": query, "results": results}))
+        sys.stdout.flush()
+        emit(command="batch-search", queries=len(queries))
+        count += len(queries)
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"Searched {count} queries in {elapsed:.2f}s "
+        f"({count / elapsed:.1f} queries/sec)",
+        file=sys.stderr,
+    )
+
+
+def handler_warm_queries(path: str, disk_size: int = QUERY_CACHE_DISK_SIZE):
+    from .query_cache import QueryEmbeddingCache
+    from .semantic_search import SemanticSearch
+
+    ss = SemanticSearch(MODEL_NAME)
+    ss.query_cache = QueryEmbeddingCache(
+        MODEL_NAME, directory=QUERY_CACHE_DIR, disk_size=disk_size
+    )
+    for queries in read_query_batches(path, BATCH_QUERY_SIZE):
+        ss.embed_queries(queries)
+
+    stats = ss.query_cache.stats()
+    cached = stats["hits"] + stats["disk_hits"]
+    print(
+        f"Warmed query cache with {cached + stats['misses']} queries: "
+        f"{cached} already cached, {stats['misses']} encoded"
+    )
+
+
+def _cascade_candidates(query: str, n: int) -> list[int] | None:
+    from keyword_search.index import InvertedIndex
+
+    idx = InvertedIndex()
+    idx.load()
+    # with no lexical match at all, fall back to scanning every embedding
+    return idx.bm25_candidates(query, n) or None
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+import numpy as np
+
+from common.helpers import CACHE_DIR
+
+from .encoding import encode_checkpointed, load_checkpoint
+
+EMBEDDING_STORE_DIR = os.path.join(CACHE_DIR, "embeddings")
+
+KEYS_FILE = "keys.bin"
+VECTORS_FILE = "vectors.bin"
+META_FILE = "meta.json"
+KEY_DTYPE = np.dtype("S64")
+# rows copied into the store at a time
+APPEND_BLOCK_ROWS = 16_384
+
+
+def text_keys(texts: list[str], namespace: str = "") -> np.ndarray:
+    """sha256 hex digests of `namespace` + text, one per text.
+
+    The namespace carries anything besides the text that the caller wants
+    folded into the key, e.g. the chunking parameters that produced it.
+    """
+    prefix = namespace.encode() + b"\0"
+    return np.array(
+        [hashlib.sha256(prefix + text.encode()).hexdigest() for text in texts],
+        dtype=KEY_DTYPE,
+    )
+
+
+class EmbeddingStore:
+    """Content-addressed embeddings for one model.
+
+    Vectors are keyed by `text_keys`, so re-encoding a corpus only runs the
+    model on texts it has not seen before. An interrupted encode leaves a
+    checkpoint whose finished vectors are added on the next one. Entries are
+    never evicted; delete the model's directory to start over.
+
+    Keys and vectors are append-only files of fixed-size rows, and
+    meta.json holds how many rows are stored. New entries are appended and
+    the count is raised last, so adding texts writes only their rows, and
+    rows past the count, left by an interrupted append, are never read.
+    """
+
+    def __init__(self, encode, model_name: str, directory: str = EMBEDDING_STORE_DIR):
+        # encode(texts) -> one embedding row per text
+        self.encode_texts = encode
+        self.model_name = model_name
+        self.directory = os.path.join(directory, re.sub(r"[^\w.-]", "_", model_name))
+        self.keys_path = os.path.join(self.directory, KEYS_FILE)
+        self.vectors_path = os.path.join(self.directory, VECTORS_FILE)
+        self.meta_path = os.path.join(self.directory, META_FILE)
+        self.checkpoint_dir = os.path.join(self.directory, "pending")
+        # row count, dim and dtype of the stored vectors; None while empty
+        self.meta = None
+        self.vectors = None
+        self.rows = None
+
+    def encode(
+        self, texts: list[str], namespace: str = "", workers: int = 1
+    ) -> np.ndarray:
+        """Embeddings for `texts`, running the model only on unseen ones, on
+        `workers` threads."""
+        self.__load()
+        self.__resume()
+        keys = text_keys(texts, namespace)
+
+        missing = {}
+        for key, text in zip(keys.tolist(), texts):
+            if key not in self.rows and key not in missing:
+                missing[key] = text
+
+        if missing:
+            missing_keys = np.array(list(missing.keys()), dtype=KEY_DTYPE)
+            vectors = encode_checkpointed(
+                missing_keys,
+                list(missing.values()),
+                self.encode_texts,
+                self.checkpoint_dir,
+                workers,
+            )
+            self.__append(missing_keys, vectors)
+            shutil.rmtree(self.checkpoint_dir)
+
+        if self.vectors is None:
+            # nothing stored and nothing asked for, so no dimension either
+            return np.zeros((0, 0), dtype=np.float32)
+        rows = np.fromiter((self.rows[key] for key in keys.tolist()), dtype=np.int64)
+        return self.vectors[rows]
+
+    def __load(self):
+        if self.rows is not None:
+            return
+
+        self.rows = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as f:
+                self.meta = json.load(f)
+            keys = self.__map()
+            self.rows = {key: i for i, key in enumerate(keys.tolist())}
+
+    def __map(self) -> np.ndarray:
+        """Map the first `count` rows of the files, the ones meta.json
+        covers; returns the keys."""
+        count, dim = self.meta["count"], self.meta["dim"]
+        # plain ndarray views, as np.memmap slices pay for subclass hooks
+        self.vectors = np.asarray(
+            np.memmap(
+                self.vectors_path,
+                dtype=self.meta["dtype"],
+                mode="r",
+                shape=(count, dim),
+            )
+        )
+        return np.asarray(
+            np.memmap(self.keys_path, dtype=KEY_DTYPE, mode="r", shape=(count,))
+        )
+
+    def __resume(self):
+        """Keep the vectors an interrupted encode finished."""
+        checkpoint = load_checkpoint(self.checkpoint_dir)
+        if checkpoint is not None:
+            keys, vectors, rows = checkpoint
+            new = np.fromiter((key not in self.rows for key in keys.tolist()), bool)
+            if new.any():
+                self.__append(keys[new], vectors, rows[new])
+                print(
+                    f"Resumed {int(new.sum())} embeddings of an interrupted build",
+                    file=sys.stderr,
+                )
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
+    def __append(self, keys: np.ndarray, vectors: np.ndarray, rows=None):
+        """Add rows for `keys`: the ascending `rows` of `vectors`, or all of
+        them. `vectors` may be memory-mapped, and is copied a block at a
+        time."""
+        if self.meta is None:
+            self.meta = {
+                "count": 0,
+                "dim": vectors.shape[1],
+                "dtype": vectors.dtype.str,
+            }
+        start = self.meta["count"]
+        dtype = np.dtype(self.meta["dtype"])
+
+        os.makedirs(self.directory, exist_ok=True)
+        with (
+            open(self.vectors_path, "ab") as vectors_file,
+            open(self.keys_path, "ab") as keys_file,
+        ):
+            # drop rows an interrupted append wrote past the count
+            vectors_file.truncate(start * dtype.itemsize * self.meta["dim"])
+            keys_file.truncate(start * KEY_DTYPE.itemsize)
+            for i in range(0, len(keys), APPEND_BLOCK_ROWS):
+                if rows is None:
+                    block = vectors[i : i + APPEND_BLOCK_ROWS]
+                else:
+                    block = vectors[rows[i : i + APPEND_BLOCK_ROWS]]
+                vectors_file.write(np.ascontiguousarray(block, dtype=dtype).tobytes())
+            keys_file.write(np.asarray(keys, dtype=KEY_DTYPE).tobytes())
+
+        # the count goes last, so a crash before it leaves the store as it was
+        self.meta["count"] = start + len(keys)
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+        for i, key in enumerate(keys.tolist(), start):
+            self.rows[key] = i
+        self.__map()
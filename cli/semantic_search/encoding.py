@@ -0,0 +1,145 @@
+"""Checkpointed batch encoding for large embedding builds.
+
+Texts are encoded longest first in fixed-size batches, so each batch holds
+texts of similar length and pads little, and a batch too long for memory
+fails at the start of a build rather than an hour into it. Batches can run
+on several threads sharing the one model; it spends its time in native code
+that releases the GIL. Each batch's rows go straight to their places in a
+preallocated memory-mapped array, in input order, and the number of finished
+texts is checkpointed as it grows, so an interrupted build keeps its work.
+"""
+
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tracing.trace import count, span
+
+from .helpers import (
+    ENCODE_BATCH_SIZE,
+    ENCODE_BATCHES_IN_FLIGHT,
+    ENCODE_CHECKPOINT_TEXTS,
+)
+
+KEYS_FILE = "keys.npy"
+VECTORS_FILE = "vectors.npy"
+# texts in the order they are encoded; the first `done` of them are finished
+ORDER_FILE = "order.npy"
+PROGRESS_FILE = "progress.json"
+
+
+def encode_checkpointed(
+    keys: np.ndarray,
+    texts: list[str],
+    encode,
+    directory: str,
+    workers: int = 1,
+) -> np.ndarray:
+    """Embeddings of `texts`, one row each in input order, checkpointed
+    under `directory`; a read-only memory map of the rows written there.
+
+    `encode(texts)` is called from `workers` threads at once. `keys`
+    identify the texts, so a later run can take the finished rows from
+    `load_checkpoint`.
+    """
+    order = np.argsort([-len(text) for text in texts], kind="stable")
+    batches = [
+        order[i : i + ENCODE_BATCH_SIZE]
+        for i in range(0, len(order), ENCODE_BATCH_SIZE)
+    ]
+
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, KEYS_FILE), keys)
+    np.save(os.path.join(directory, ORDER_FILE), order)
+    _write_progress(directory, 0)
+
+    vectors = None
+    done = checkpointed = 0
+    start = time.perf_counter()
+    with span("semantic.embed"):
+        for rows, embedded in zip(
+            batches, _encode_batches(texts, batches, encode, workers)
+        ):
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(directory, VECTORS_FILE),
+                    mode="w+",
+                    dtype=embedded.dtype,
+                    shape=(len(texts), embedded.shape[1]),
+                )
+            vectors[rows] = embedded
+            done += len(rows)
+            count("semantic.embedded", len(rows))
+
+            if done - checkpointed >= ENCODE_CHECKPOINT_TEXTS:
+                # rows before the progress count, so it never runs ahead
+                vectors.flush()
+                _write_progress(directory, done)
+                checkpointed = done
+                print(f"Encoded {done}/{len(texts)} texts", file=sys.stderr)
+
+    if vectors is None:
+        raise ValueError("no texts to encode")
+    vectors.flush()
+    _write_progress(directory, done)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Encoded {done} texts in {elapsed:.2f}s ({done / elapsed:.1f} texts/sec)",
+        file=sys.stderr,
+    )
+
+    return np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r")
+
+
+def load_checkpoint(
+    directory: str,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray] | None:
+    """Keys of the texts an interrupted `encode_checkpointed` finished, the
+    memory-mapped vectors and the ascending rows of those texts in them; or
+    None if there is no checkpoint."""
+    progress_path = os.path.join(directory, PROGRESS_FILE)
+    vectors_path = os.path.join(directory, VECTORS_FILE)
+    order_path = os.path.join(directory, ORDER_FILE)
+    if not all(os.path.exists(p) for p in (progress_path, vectors_path, order_path)):
+        return None
+    with open(progress_path, "r") as f:
+        done = json.load(f)["done"]
+    keys = np.load(os.path.join(directory, KEYS_FILE))
+    rows = np.sort(np.load(order_path)[:done])
+    vectors = np.load(vectors_path, mmap_mode="r")
+    return keys[rows], vectors, rows
+
+
+def _encode_batches(texts, batches, encode, workers: int):
+    """Embeddings of each batch of text indices, in batch order."""
+    batches = iter(batches)
+    # the first batch runs alone, so a model loaded on first use loads once
+    for rows in itertools.islice(batches, 1):
+        yield encode([texts[i] for i in rows])
+    if workers <= 1:
+        for rows in batches:
+            yield encode([texts[i] for i in rows])
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for rows in batches:
+            pending.append(executor.submit(encode, [texts[i] for i in rows]))
+            if len(pending) >= workers * ENCODE_BATCHES_IN_FLIGHT:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _write_progress(directory: str, done: int) -> None:
+    path = os.path.join(directory, PROGRESS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"done": done}, f)
+    os.replace(tmp_path, path)
@@ -1,32 +1,43 @@
+import argparse
 import os
-import json
 import re
-import numpy as np
 
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
-CACHE_DIR = os.path.join(PROJECT_ROOT, "cache")
+from common.helpers import CACHE_DIR
 
 DEFAULT_SEARCH_LIMIT = 5
 SCORE_PRECISION = 3
 MODEL_NAME = "all-MiniLM-L6-v2"
-
-
-def load_movies() -> list[dict]:
-    with open(DATA_PATH, "r") as f:
-        data = json.load(f)
-    return data["movies"]
-
-
-def cosine_similarity(vec1, vec2) -> float:
-    dot_product = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-
-    return dot_product / (norm1 * norm2)
+# queries scored per matrix product; bounds the scores matrix at this many rows
+QUERY_BLOCK_SIZE = 64
+# BM25 candidates re-ranked by a cascade search when no count is given
+DEFAULT_CASCADE_CANDIDATES = 100
+# IVF lists scanned per query by approximate search
+DEFAULT_NPROBE = 8
+QUANTIZATION_KINDS = ("int8", "float16")
+# texts per encode call (one worker task); the model sub-batches internally
+ENCODE_BATCH_SIZE = 256
+# encode calls queued per worker process, to keep workers busy without
+# pickling the whole corpus into the pool at once
+ENCODE_BATCHES_IN_FLIGHT = 2
+# an interrupted build loses at most this many texts of work
+ENCODE_CHECKPOINT_TEXTS = 10_000
+# query embeddings kept decoded in memory, most recently used first
+QUERY_CACHE_SIZE = 4096
+# query embeddings kept on disk across runs, oldest overwritten first; set
+# QUERY_CACHE_DIR to None to keep them in memory only
+QUERY_CACHE_DISK_SIZE = 65536
+QUERY_CACHE_DIR = os.path.join(CACHE_DIR, "query_embeddings")
+
+
+def positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1, e.g. --nprobe."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
 
 
 def semantic_chunk(text: str, size: int, overlap: int) -> list[str]:
@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+
+from .helpers import QUANTIZATION_KINDS
+from .vectors import normalize_rows, top_k_indices
+
+# first-pass candidates kept per requested result for exact rescoring
+RESCORE_FACTOR = 10
+BLOCK_ROWS = 16_384
+
+
+class QuantizedMatrix:
+    """Compressed copy of L2-normalized embeddings for a cheap first pass.
+
+    `int8` stores per-dimension scalar-quantized codes, with row values
+    approximated as `offset + scale * code`; `float16` just halves the
+    precision. Scores are approximate and meant to be rescored.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        codes: np.ndarray,
+        scale: np.ndarray | None = None,
+        offset: np.ndarray | None = None,
+    ) -> None:
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate dot products of every row with a normalized query."""
+        if self.kind == "int8":
+            weights = (self.scale * query).astype(np.float32)
+            bias = np.float32(self.offset @ query)
+        else:
+            weights, bias = query.astype(np.float32), np.float32(0)
+
+        # cast block by block so BLAS never sees a full float32 copy
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_ROWS):
+            block = self.codes[start : start + BLOCK_ROWS].astype(np.float32)
+            scores[start : start + len(block)] = block @ weights + bias
+        return scores
+
+    def save(self, path: str) -> None:
+        arrays = {"codes": self.codes}
+        if self.kind == "int8":
+            arrays.update(scale=self.scale, offset=self.offset)
+        np.savez(path, kind=self.kind, **arrays)
+
+    @classmethod
+    def load(cls, path: str, rows: int) -> "QuantizedMatrix | None":
+        """Load saved codes, or None if they were built for other vectors."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            kind = str(data["kind"])
+            matrix = cls(
+                kind,
+                data["codes"],
+                data["scale"] if kind == "int8" else None,
+                data["offset"] if kind == "int8" else None,
+            )
+        if len(matrix) != rows:
+            return None
+        return matrix
+
+    @classmethod
+    def from_embeddings(cls, embeddings: np.ndarray, kind: str) -> "QuantizedMatrix":
+        """Normalize and quantize block by block, so `embeddings` can be a
+        memory-mapped array larger than RAM."""
+        if kind not in QUANTIZATION_KINDS:
+            raise ValueError(f"unknown quantization {kind!r}")
+
+        n, dim = embeddings.shape
+        blocks = range(0, n, BLOCK_ROWS)
+
+        if kind == "float16":
+            codes = np.empty((n, dim), dtype=np.float16)
+            for start in blocks:
+                block = normalize_rows(embeddings[start : start + BLOCK_ROWS])
+                codes[start : start + len(block)] = block
+            return cls(kind, codes)
+
+        low = np.full(dim, np.inf, dtype=np.float32)
+        high = np.full(dim, -np.inf, dtype=np.float32)
+        for start in blocks:
+            block = normalize_rows(embeddings[start : start + BLOCK_ROWS])
+            low = np.minimum(low, block.min(axis=0))
+            high = np.maximum(high, block.max(axis=0))
+
+        offset = (low + high) / 2
+        scale = (high - low) / 254
+        scale[scale == 0] = 1
+
+        codes = np.empty((n, dim), dtype=np.int8)
+        for start in blocks:
+            block = normalize_rows(embeddings[start : start + BLOCK_ROWS])
+            codes[start : start + len(block)] = np.clip(
+                np.rint((block - offset) / scale), -127, 127
+            )
+        return cls(kind, codes, scale, offset)
+
+
+def rescore(embeddings: np.ndarray, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """Exact cosine scores of the given rows against a normalized query."""
+    return normalize_rows(embeddings[rows]) @ query
+
+
+def search_quantized(
+    quantized: QuantizedMatrix,
+    embeddings: np.ndarray,
+    query: np.ndarray,
+    k: int,
+    rescore_factor: int = RESCORE_FACTOR,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k by an approximate pass over `quantized`, then exact rescoring
+    of the best `k * rescore_factor` rows from full-precision `embeddings`."""
+    approx = quantized.scores(query)
+    rows = np.sort(top_k_indices(approx, k * rescore_factor))
+    exact = rescore(embeddings, rows, query)
+    top = top_k_indices(exact, k)
+    return rows[top], exact[top]
@@ -0,0 +1,222 @@
+import fcntl
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from tracing.trace import count
+
+from .embedding_store import text_keys
+from .helpers import QUERY_CACHE_DISK_SIZE, QUERY_CACHE_SIZE
+
+KEYS_FILE = "keys.npy"
+VECTORS_FILE = "vectors.npy"
+# entries ever written, shared by every process using the store; the next
+# slot to write is this modulo the ring size
+CURSOR_FILE = "cursor.npy"
+LOCK_FILE = "lock"
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split())
+
+
+class QueryEmbeddingCache:
+    """Embeddings of recent queries for one model.
+
+    Queries are keyed by `text_keys` of the whitespace-normalized text, with
+    the model name as namespace. A bounded LRU keeps them in memory; with a
+    `directory`, they are also kept in a fixed-size memory-mapped ring there,
+    so repeats are answered across restarts and by other processes. The ring
+    holds `disk_size` entries, chosen by whichever process creates it.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        size: int = QUERY_CACHE_SIZE,
+        directory: str | None = None,
+        disk_size: int = QUERY_CACHE_DISK_SIZE,
+    ) -> None:
+        self.model_name = model_name
+        self.size = size
+        self.disk_size = disk_size
+        self.directory = None
+        if directory is not None:
+            self.directory = os.path.join(
+                directory, re.sub(r"[^\w.-]", "_", model_name)
+            )
+        self.entries: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # the server looks queries up from several threads
+        self.lock = threading.Lock()
+        # on-disk ring, opened on first use
+        self.keys = None
+        self.vectors = None
+        self.cursor = None
+        self.slots: dict[bytes, int] | None = None
+        # the cursor when `slots` was last in step with the ring; when other
+        # processes have written since, a miss rebuilds `slots`
+        self.synced_writes = 0
+
+    def embed(self, queries: list[str], encode) -> np.ndarray:
+        """Embeddings of `queries`, one row each; `encode(texts)` runs once
+        on the queries not in the cache."""
+        keys = text_keys([normalize_query(q) for q in queries], self.model_name)
+        found: dict[bytes, np.ndarray] = {}
+        missing: dict[bytes, str] = {}
+        with self.lock:
+            for key, query in zip(keys.tolist(), queries):
+                if key in found or key in missing:
+                    continue
+                embedding = self.__get(key)
+                if embedding is None:
+                    missing[key] = query
+                else:
+                    found[key] = embedding
+
+        count("query_cache.hits", len(queries) - len(missing))
+        count("query_cache.misses", len(missing))
+        if missing:
+            encoded = encode(list(missing.values()))
+            with self.lock:
+                for key, embedding in zip(missing, encoded):
+                    found[key] = embedding
+                    self.__put(key, embedding)
+
+        return np.stack([found[key] for key in keys.tolist()])
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "disk_entries": len(self.slots) if self.slots is not None else 0,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def __get(self, key: bytes) -> np.ndarray | None:
+        embedding = self.entries.get(key)
+        if embedding is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+        embedding = self.__read_disk(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self.__remember(key, embedding)
+        return embedding
+
+    def __put(self, key: bytes, embedding: np.ndarray) -> None:
+        self.__remember(key, embedding)
+        self.__write_disk(key, embedding)
+
+    def __remember(self, key: bytes, embedding: np.ndarray) -> None:
+        if self.size <= 0:
+            return
+        # read-only, since the same array is handed out on every hit
+        embedding = np.array(embedding)
+        embedding.flags.writeable = False
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def __read_disk(self, key: bytes) -> np.ndarray | None:
+        if not self.__open_disk():
+            return None
+        slot = self.slots.get(key)
+        if slot is None and int(self.cursor[0]) != self.synced_writes:
+            self.__index_slots()
+            slot = self.slots.get(key)
+        if slot is None:
+            return None
+        embedding = np.array(self.vectors[slot])
+        # another process may have reused the slot since it was indexed
+        if self.keys[slot] != key:
+            del self.slots[key]
+            return None
+        return embedding
+
+    def __write_disk(self, key: bytes, embedding: np.ndarray) -> None:
+        if not self.__open_disk(create_dim=len(embedding)):
+            return
+        if self.vectors.shape[1] != len(embedding):
+            return
+
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            writes = int(self.cursor[0])
+            slot = writes % len(self.keys)
+            old_key = bytes(self.keys[slot])
+            # the key goes last, so readers never pair it with another vector
+            self.keys[slot] = b""
+            self.vectors[slot] = embedding
+            self.keys[slot] = key
+            self.cursor[0] = writes + 1
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        if writes == self.synced_writes:
+            self.synced_writes = writes + 1
+
+        if self.slots.get(old_key) == slot:
+            del self.slots[old_key]
+        self.slots[key] = slot
+
+    def __open_disk(self, create_dim: int | None = None) -> bool:
+        """Map the on-disk ring, creating it if `create_dim` is given; False
+        if there is none."""
+        if self.directory is None:
+            return False
+        if self.keys is not None:
+            return True
+
+        keys_path = os.path.join(self.directory, KEYS_FILE)
+        vectors_path = os.path.join(self.directory, VECTORS_FILE)
+        cursor_path = os.path.join(self.directory, CURSOR_FILE)
+        if not os.path.exists(cursor_path):
+            if create_dim is None:
+                return False
+            self.__create_disk(create_dim)
+
+        self.keys = np.load(keys_path, mmap_mode="r+")
+        self.vectors = np.load(vectors_path, mmap_mode="r+")
+        self.cursor = np.load(cursor_path, mmap_mode="r+")
+        self.__index_slots()
+        return True
+
+    def __index_slots(self) -> None:
+        self.synced_writes = int(self.cursor[0])
+        self.slots = {key: slot for slot, key in enumerate(self.keys.tolist()) if key}
+
+    def __create_disk(self, dim: int) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another process may have created it while this one waited
+            cursor_path = os.path.join(self.directory, CURSOR_FILE)
+            if not os.path.exists(cursor_path):
+                np.lib.format.open_memmap(
+                    os.path.join(self.directory, KEYS_FILE),
+                    mode="w+",
+                    dtype="S64",
+                    shape=(self.disk_size,),
+                ).flush()
+                np.lib.format.open_memmap(
+                    os.path.join(self.directory, VECTORS_FILE),
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(self.disk_size, dim),
+                ).flush()
+                # the cursor last, since its presence marks the ring complete
+                np.save(cursor_path, np.zeros(1, dtype=np.int64))
+            fcntl.flock(lock, fcntl.LOCK_UN)
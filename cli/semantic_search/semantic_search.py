@@ -1,20 +1,223 @@
+import json
 import numpy as np
 import os
 
-from sentence_transformers import SentenceTransformer
-from .helpers import CACHE_DIR, cosine_similarity
+from common.helpers import CACHE_DIR
+from result_cache.cache import ResultCache, new_generation
+from tracing.trace import count, span, traced
+
+from .ann import IVFIndex, result_cache_params
+from .embedding_store import EmbeddingStore
+from .helpers import QUANTIZATION_KINDS, QUERY_BLOCK_SIZE, QUERY_CACHE_DIR
+from .quantization import QuantizedMatrix, rescore, search_quantized
+from .query_cache import QueryEmbeddingCache
+from .vectors import normalize_rows, normalize_vector, top_k_cosine, top_k_indices
+
+DOCUMENT_NAMESPACE = "document"
+# the only document fields results show
+RESULT_FIELDS = ("title", "description")
 
 
 class SemanticSearch:
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name="all-MiniLM-L6-v2", quantization=None, model=None):
+        self.model_name = model_name
+        # anything with encode(texts); loaded on first use when not given,
+        # since importing sentence_transformers pulls in torch
+        self._model = model
+        self.embedding_store = EmbeddingStore(self.__encode, model_name)
+        # None encodes every query
+        self.query_cache = QueryEmbeddingCache(model_name, directory=QUERY_CACHE_DIR)
+        # "int8"/"float16" keeps only a compressed copy in memory and reads
+        # full-precision rows from a memory-mapped .npy for rescoring
+        self.quantization = quantization
+        # DocumentStore; embedding row i is the document at row i
         self.documents = None
         self.embeddings = None
-        self.document_map = {}
+        # row-normalized copy of embeddings, so cosine is a plain dot product
+        self.normalized_embeddings = None
+        self.quantized_embeddings = None
+        # approximate index; search falls back to exact scoring without one
+        self.ann_index = None
+        # stamped when embeddings are built; keys the result cache
+        self.generation = None
+        self.result_cache = ResultCache()
 
         self.embeddings_path = os.path.join(CACHE_DIR, "movie_embeddings.npy")
+        # fingerprint of the document store movie_embeddings.npy was built
+        # from, and the generation of the build
+        self.embedding_meta_path = os.path.join(CACHE_DIR, "movie_embeddings.json")
+        self.ann_index_path = os.path.join(CACHE_DIR, "movie_embeddings.ivf.npz")
+        self.quantized_paths = {
+            kind: os.path.join(CACHE_DIR, f"movie_embeddings.{kind}.npz")
+            for kind in QUANTIZATION_KINDS
+        }
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load_model()
+        return self._model
+
+    def load_model(self) -> None:
+        """Load the model now instead of on the first query that needs it."""
+        if self._model is not None:
+            return
+        with span("semantic.model_load"):
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name)
+
+    def search(self, query, limit, nprobe=None, candidate_ids=None):
+        """Top documents by cosine similarity to `query`.
+
+        With `candidate_ids`, only those documents are scored, e.g. the BM25
+        matches of a cascade search.
+        """
+        self.__check_loaded()
+        return self.result_cache.search(
+            "semantic",
+            self.generation,
+            [query],
+            lambda missing: [self.__search(missing[0], limit, nprobe, candidate_ids)],
+            **self.__search_params(limit, nprobe),
+            candidate_ids=candidate_ids,
+        )[0]
+
+    def __search(self, query, limit, nprobe, candidate_ids):
+        count("semantic.queries")
+
+        query_embedding = self.generate_embedding(query)
+        if candidate_ids is not None:
+            indices, scores = self.__search_rows(
+                query_embedding, limit, self.candidate_rows(candidate_ids)
+            )
+        else:
+            indices, scores = self.__search_embedding(query_embedding, limit, nprobe)
+        with span("semantic.format"):
+            return self.__results(indices, scores)
+
+    def candidate_rows(self, candidate_ids) -> np.ndarray:
+        """Sorted embedding rows of the given document ids; unknown ids are
+        skipped."""
+        return np.unique(self.documents.rows(candidate_ids))
+
+    def search_batch(self, queries: list[str], limit: int, nprobe=None):
+        """`search` for many queries at once.
+
+        Queries are encoded in batches, and exact searches score a whole block
+        of queries with one matrix product.
+        """
+        self.__check_loaded()
+        if not queries:
+            return []
+        if any(not q or q.isspace() for q in queries):
+            raise ValueError("text must be nonempty")
+
+        return self.result_cache.search(
+            "semantic",
+            self.generation,
+            queries,
+            lambda missing: self.__search_batch(missing, limit, nprobe),
+            **self.__search_params(limit, nprobe),
+            candidate_ids=None,
+        )
+
+    def __search_batch(self, queries, limit, nprobe):
+        count("semantic.queries", len(queries))
+        query_embeddings = normalize_rows(self.embed_queries(queries))
+        if self.ann_index is not None or self.quantized_embeddings is not None:
+            return [
+                self.__results(*self.__search_embedding(q, limit, nprobe))
+                for q in query_embeddings
+            ]
+
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            block = query_embeddings[start : start + QUERY_BLOCK_SIZE]
+            with span("semantic.score"):
+                block_scores = block @ self.normalized_embeddings.T
+            for scores in block_scores:
+                with span("top_k"):
+                    indices = top_k_indices(scores, limit)
+                results.append(self.__results(indices, scores[indices]))
+        return results
+
+    def build_embeddings(self, documents, workers: int = 1):
+        self.documents = documents
+
+        docs = _document_texts(documents)
+        self.embeddings = self.embedding_store.encode(docs, DOCUMENT_NAMESPACE, workers)
+
+        np.save(self.embeddings_path, self.embeddings)
+        self.generation = new_generation()
+        with open(self.embedding_meta_path, "w") as f:
+            json.dump(
+                {"fingerprint": documents.fingerprint, "generation": self.generation},
+                f,
+            )
+        # indexes derived from the old vectors would be stale
+        self.ann_index = None
+        for path in [self.ann_index_path, *self.quantized_paths.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.__prepare_embeddings()
+
+        return self.embeddings
 
-    def search(self, query, limit):
+    def load_or_create_embeddings(self, documents, workers: int = 1):
+        """Embeddings of the documents in `documents`, a DocumentStore; cached
+        embeddings are reused while the store's fingerprint matches."""
+        self.documents = documents
+        if self.__load_embeddings(documents):
+            return self.embeddings
+        return self.build_embeddings(documents, workers)
+
+    @traced("semantic.load")
+    def __load_embeddings(self, documents) -> bool:
+        """Load the cached embeddings if they match `documents`."""
+        if not (
+            os.path.exists(self.embeddings_path)
+            and os.path.exists(self.embedding_meta_path)
+        ):
+            return False
+
+        with open(self.embedding_meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["fingerprint"] != documents.fingerprint:
+            return False
+        self.generation = meta["generation"]
+        mmap_mode = "r" if self.quantization else None
+        self.embeddings = np.load(self.embeddings_path, mmap_mode=mmap_mode)
+        self.__prepare_embeddings()
+        return True
+
+    def load_or_create_ann_index(self):
+        if self.normalized_embeddings is None:
+            raise ValueError(
+                "No full-precision embeddings loaded. Call "
+                "`load_or_create_embeddings` first, without quantization."
+            )
+
+        self.ann_index = IVFIndex.load(
+            self.ann_index_path, self.normalized_embeddings, self.generation
+        )
+        if self.ann_index is None:
+            self.ann_index = IVFIndex.build(
+                self.normalized_embeddings, embeddings_generation=self.generation
+            )
+            self.ann_index.save(self.ann_index_path)
+
+        return self.ann_index
+
+    def __search_params(self, limit, nprobe) -> dict:
+        # how results were searched for, besides the query and candidates
+        return {
+            "limit": limit,
+            "quantization": self.quantization,
+            **result_cache_params(self.ann_index, nprobe),
+        }
+
+    def __check_loaded(self):
         if self.embeddings is None:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
@@ -25,19 +228,37 @@ class SemanticSearch:
                 "No documents loaded. Call `load_or_create_embeddings` first."
             )
 
-        query_embedding = self.generate_embedding(query)
+    @traced("semantic.score")
+    def __search_rows(self, query_embedding, limit, rows):
+        query_embedding = normalize_vector(query_embedding)
+        if self.normalized_embeddings is not None:
+            scores = self.normalized_embeddings[rows] @ query_embedding
+        else:
+            scores = rescore(self.embeddings, rows, query_embedding)
+        top = top_k_indices(scores, limit)
+        return rows[top], scores[top]
 
-        similarities = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            similarities.append(
-                (self.documents[i], cosine_similarity(query_embedding, doc_embedding))
+    @traced("semantic.score")
+    def __search_embedding(self, query_embedding, limit, nprobe=None):
+        if self.ann_index is not None:
+            return self.ann_index.search(
+                normalize_vector(query_embedding), limit, nprobe
             )
+        if self.quantized_embeddings is not None:
+            return search_quantized(
+                self.quantized_embeddings,
+                self.embeddings,
+                normalize_vector(query_embedding),
+                limit,
+            )
+        return top_k_cosine(self.normalized_embeddings, query_embedding, limit)
 
-        sorted_scores = sorted(similarities, key=lambda x: x[1], reverse=True)[:limit]
-
+    def __results(self, indices, scores):
         results = []
-        for doc, score in sorted_scores:
+        for i, score in zip(indices.tolist(), scores.tolist()):
+            doc = self.documents.get(i, RESULT_FIELDS)
             result = {
+                "id": doc["id"],
                 "score": score,
                 "title": doc["title"],
                 "description": doc["description"],
@@ -46,35 +267,46 @@ class SemanticSearch:
 
         return results
 
-    def build_embeddings(self, documents: list[dict]):
-        self.documents = documents
-
-        docs = []
-        for d in documents:
-            self.document_map[d["id"]] = d
-            docs.append(f"{d['title']}: {d['description']}")
-
-        self.embeddings = self.model.encode(docs, show_progress_bar=True)
-
-        np.save(self.embeddings_path, self.embeddings)
-
-        return self.embeddings
+    def __prepare_embeddings(self):
+        if self.quantization is None:
+            self.normalized_embeddings = normalize_rows(self.embeddings)
+            return
 
-    def load_or_create_embeddings(self, documents):
-        self.documents = documents
-        self.document_map = {d["id"]: d for d in documents}
-
-        if os.path.exists(self.embeddings_path):
-            self.embeddings = np.load(self.embeddings_path)
-            if len(self.embeddings) == len(documents):
-                return self.embeddings
+        path = self.quantized_paths[self.quantization]
+        self.quantized_embeddings = QuantizedMatrix.load(path, len(self.embeddings))
+        if self.quantized_embeddings is None:
+            self.quantized_embeddings = QuantizedMatrix.from_embeddings(
+                self.embeddings, self.quantization
+            )
+            self.quantized_embeddings.save(path)
 
-        return self.build_embeddings(documents)
+    def __encode(self, texts: list[str]):
+        # called per batch; the embedding store reports progress
+        return self.model.encode(texts)
 
     def generate_embedding(self, text: str):
         if not text or text.isspace():
             raise ValueError("text must be nonempty")
 
-        embedding = self.model.encode([text])[0]
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, queries: list[str]) -> np.ndarray:
+        """Query embeddings, one row each, from the query cache where
+        possible."""
+        if self.query_cache is None:
+            return self.__encode_queries(queries)
+        return self.query_cache.embed(queries, self.__encode_queries)
+
+    def __encode_queries(self, queries: list[str]) -> np.ndarray:
+        model = self.model
+        with span("semantic.encode"):
+            return model.encode(queries)
+
 
-        return embedding
+def _document_texts(documents) -> list[str]:
+    return [
+        f"{title}: {description}"
+        for title, description in zip(
+            documents.values("title"), documents.values("description")
+        )
+    ]
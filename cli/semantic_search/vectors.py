@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def cosine_similarity(vec1, vec2) -> float:
+    dot_product = np.dot(vec1, vec2)
+    norm1 = np.linalg.norm(vec1)
+    norm2 = np.linalg.norm(vec2)
+
+    if norm1 == 0 or norm2 == 0:
+        return 0.0
+
+    return dot_product / (norm1 * norm2)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalize each row; all-zero rows stay zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def normalize_vector(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+
+def group_max(groups: np.ndarray, scores: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Max score per group, with the groups in ascending order."""
+    if len(groups) == 0:
+        return groups, scores
+    order = np.argsort(groups, kind="stable")
+    groups, scores = groups[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    return groups[starts], np.maximum.reduceat(scores, starts)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, descending, ties by lower index."""
+    if k <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+        # keep every index tied with the k-th score so ties resolve by index
+        candidates = np.flatnonzero(scores >= scores[part].min())
+    else:
+        candidates = np.arange(len(scores))
+
+    order = np.lexsort((candidates, -scores[candidates]))[:k]
+    return candidates[order]
+
+
+def top_k_cosine(
+    normalized: np.ndarray, query: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Top-k rows of an L2-normalized matrix by cosine similarity to query."""
+    scores = normalized @ normalize_vector(query)
+    indices = top_k_indices(scores, k)
+    return indices, scores[indices]
@@ -2,7 +2,14 @@
 
 import argparse
 
-from semantic_search.helpers import DEFAULT_SEARCH_LIMIT
+from semantic_search.helpers import (
+    DEFAULT_CASCADE_CANDIDATES,
+    DEFAULT_NPROBE,
+    DEFAULT_SEARCH_LIMIT,
+    QUANTIZATION_KINDS,
+    QUERY_CACHE_DISK_SIZE,
+    positive_int,
+)
 
 from semantic_search.commands import (
     handler_verify_model,
@@ -14,7 +21,10 @@ from semantic_search.commands import (
     handler_semantic_chunk,
     handler_embed_chunks,
     handler_search_chunks,
+    handler_batch_search,
+    handler_warm_queries,
 )
+from tracing.trace import add_profile_arguments, profiled
 
 
 def main():
@@ -31,6 +41,9 @@ def main():
     verify_embeddings_parser = subparsers.add_parser(
         "verify_embeddings", help="Load/generate and verify embeddings"
     )
+    verify_embeddings_parser.add_argument(
+        "--workers", type=int, default=1, help="Number of encoding threads"
+    )
 
     embed_query_parser = subparsers.add_parser(
         "embedquery", help="Create embedding from query"
@@ -48,6 +61,30 @@ def main():
         default=DEFAULT_SEARCH_LIMIT,
         help="Number of results",
     )
+    # the IVF index scores full-precision rows, which --quantize never loads
+    search_mode = search_parser.add_mutually_exclusive_group()
+    search_mode.add_argument(
+        "--ann", action="store_true", help="Use the approximate (IVF) index"
+    )
+    search_parser.add_argument(
+        "--nprobe",
+        type=positive_int,
+        default=DEFAULT_NPROBE,
+        help="IVF lists to scan with --ann; higher is slower but more accurate",
+    )
+    search_mode.add_argument(
+        "--quantize",
+        choices=QUANTIZATION_KINDS,
+        help="Scan compressed embeddings and rescore the top candidates",
+    )
+    search_parser.add_argument(
+        "--cascade",
+        type=int,
+        nargs="?",
+        const=DEFAULT_CASCADE_CANDIDATES,
+        metavar="N",
+        help="Only re-rank the top N BM25 matches (default N: %(const)s)",
+    )
 
     chunk_parser = subparsers.add_parser("chunk", help="Turn text into n sized chunks")
     chunk_parser.add_argument("text", help="The target text")
@@ -75,6 +112,9 @@ def main():
     embed_chunks_parser = subparsers.add_parser(
         "embed_chunks", help="Create chunked embeddings from document"
     )
+    embed_chunks_parser.add_argument(
+        "--workers", type=int, default=1, help="Number of encoding threads"
+    )
 
     search_chunked_parser = subparsers.add_parser(
         "search_chunked", help="Search for movies using chunked semantic search"
@@ -83,28 +123,122 @@ def main():
     search_chunked_parser.add_argument(
         "--limit", type=int, default=5, help="The number of results"
     )
+    search_chunked_mode = search_chunked_parser.add_mutually_exclusive_group()
+    search_chunked_mode.add_argument(
+        "--ann", action="store_true", help="Use the approximate (IVF) index"
+    )
+    search_chunked_parser.add_argument(
+        "--nprobe",
+        type=positive_int,
+        default=DEFAULT_NPROBE,
+        help="IVF lists to scan with --ann; higher is slower but more accurate",
+    )
+    search_chunked_mode.add_argument(
+        "--quantize",
+        choices=QUANTIZATION_KINDS,
+        help="Scan compressed embeddings and rescore the top candidates",
+    )
+    search_chunked_parser.add_argument(
+        "--cascade",
+        type=int,
+        nargs="?",
+        const=DEFAULT_CASCADE_CANDIDATES,
+        metavar="N",
+        help="Only re-rank the top N BM25 matches (default N: %(const)s)",
+    )
 
+    batch_search_parser = subparsers.add_parser(
+        "batch-search", help="Search for many queries, one per line, as JSON lines"
+    )
+    batch_search_parser.add_argument(
+        "path", nargs="?", default="-", help="File of queries, or - for stdin"
+    )
+    batch_search_parser.add_argument(
+        "-l",
+        "--limit",
+        type=int,
+        default=DEFAULT_SEARCH_LIMIT,
+        help="Number of results per query",
+    )
+    batch_search_mode = batch_search_parser.add_mutually_exclusive_group()
+    batch_search_mode.add_argument(
+        "--ann", action="store_true", help="Use the approximate (IVF) index"
+    )
+    batch_search_parser.add_argument(
+        "--nprobe",
+        type=positive_int,
+        default=DEFAULT_NPROBE,
+        help="IVF lists to scan with --ann; higher is slower but more accurate",
+    )
+    batch_search_mode.add_argument(
+        "--quantize",
+        choices=QUANTIZATION_KINDS,
+        help="Scan compressed embeddings and rescore the top candidates",
+    )
+
+    warm_queries_parser = subparsers.add_parser(
+        "warm-queries",
+        help="Embed queries from a log, one per line, into the query cache",
+    )
+    warm_queries_parser.add_argument(
+        "path", nargs="?", default="-", help="File of queries, or - for stdin"
+    )
+    warm_queries_parser.add_argument(
+        "--disk-size",
+        type=positive_int,
+        default=QUERY_CACHE_DISK_SIZE,
+        help="Queries the on-disk cache holds, allocated in full when it is "
+        "first created: 64 bytes plus 4 per dimension each, about 100 MB at "
+        "the default for a 384-dimension model",
+    )
+
+    add_profile_arguments(parser, subparsers)
     args = parser.parse_args()
 
+    with profiled(args.profile, args.profile_stats, command=args.command):
+        run_command(args, parser)
+
+
+def run_command(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
     match args.command:
         case "verify":
             handler_verify_model()
         case "embed_text":
             handler_embed_text(args.text)
         case "verify_embeddings":
-            handler_verify_embeddings()
+            handler_verify_embeddings(args.workers)
         case "embedquery":
             handler_embed_query(args.query)
         case "search":
-            handler_search(args.query, args.limit)
+            handler_search(
+                args.query,
+                args.limit,
+                args.ann,
+                args.nprobe,
+                args.quantize,
+                args.cascade,
+            )
         case "chunk":
             handler_chunk(args.text, args.chunk_size, args.overlap)
         case "semantic_chunk":
             handler_semantic_chunk(args.text, args.max_chunk_size, args.overlap)
         case "embed_chunks":
-            handler_embed_chunks()
+            handler_embed_chunks(args.workers)
         case "search_chunked":
-            handler_search_chunks(args.query, args.limit)
+            handler_search_chunks(
+                args.query,
+                args.limit,
+                args.ann,
+                args.nprobe,
+                args.quantize,
+                args.cascade,
+            )
+        case "batch-search":
+            handler_batch_search(
+                args.path, args.limit, args.ann, args.nprobe, args.quantize
+            )
+        case "warm-queries":
+            handler_warm_queries(args.path, args.disk_size)
         case _:
             parser.print_help()
 
@@ -0,0 +1,7 @@
+# Set to anything but "" or "0" to trace every CLI command, like --profile.
+PROFILE_ENV = "HOOPLA_PROFILE"
+# Path for a cProfile dump, like --profile-stats.
+PROFILE_STATS_ENV = "HOOPLA_PROFILE_STATS"
+
+# Digits kept in the millisecond timings of a trace.
+TIMING_PRECISION = 3
@@ -0,0 +1,164 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from .helpers import PROFILE_ENV, PROFILE_STATS_ENV, TIMING_PRECISION
+
+_NULL_SPAN = nullcontext()
+
+# the trace being recorded; None whenever profiling is off, which is all the
+# instrumented code checks
+_trace = None
+
+
+class Trace:
+    """Wall time per named span and totals per named counter.
+
+    Spans are inclusive: a span nested in another counts toward both, and
+    spans on concurrent threads may add up to more than the total.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # name -> [seconds, calls]
+        self.spans = {}
+        self.counters = {}
+        # the hybrid retrievers record from two threads at once
+        self.lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float) -> None:
+        with self.lock:
+            entry = self.spans.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_count(self, name: str, n: int) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self, **fields) -> dict:
+        total = time.perf_counter() - self.start
+        return {
+            **fields,
+            "total_ms": round(total * 1000, TIMING_PRECISION),
+            "spans": {
+                name: {"ms": round(seconds * 1000, TIMING_PRECISION), "calls": calls}
+                for name, (seconds, calls) in self.spans.items()
+            },
+            "counters": self.counters,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.trace.add_span(self.name, time.perf_counter() - self.start)
+
+
+def enabled() -> bool:
+    return _trace is not None
+
+
+def span(name: str):
+    """Context manager timing `name`; a shared no-op when profiling is off."""
+    if _trace is None:
+        return _NULL_SPAN
+    return _Span(_trace, name)
+
+
+def traced(name: str):
+    """Decorator timing each call of the function as span `name`."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace is None:
+                return fn(*args, **kwargs)
+            with _Span(_trace, name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(name: str, n: int = 1) -> None:
+    if _trace is not None:
+        _trace.add_count(name, n)
+
+
+def emit(**fields) -> None:
+    """Write the current trace to stderr as one JSON line and start a new one.
+
+    Batch commands call this once per batch; single commands get one trace
+    for the whole run when `profiled` exits.
+    """
+    global _trace
+    if _trace is None:
+        return
+    trace, _trace = _trace, Trace()
+    print(json.dumps(trace.to_dict(**fields)), file=sys.stderr)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser, subparsers) -> None:
+    """--profile and --profile-stats, accepted before or after the command."""
+    for p in [parser, *subparsers.choices.values()]:
+        # a subcommand must not reset what was given before the command
+        defaults = {} if p is parser else {"default": argparse.SUPPRESS}
+        p.add_argument(
+            "--profile",
+            action="store_true",
+            help=f"Print a JSON timing breakdown to stderr (or set {PROFILE_ENV}=1)",
+            **defaults,
+        )
+        p.add_argument(
+            "--profile-stats",
+            type=str,
+            metavar="PATH",
+            help="Also write cProfile stats of the main thread here, for pstats",
+            **defaults,
+        )
+
+
+@contextmanager
+def profiled(profile: bool = False, stats_path: str | None = None, **fields):
+    """Trace everything run inside, then emit the trace with `fields`."""
+    global _trace
+    profile = profile or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+    stats_path = stats_path or os.environ.get(PROFILE_STATS_ENV)
+    if not profile and not stats_path:
+        yield
+        return
+
+    profiler = None
+    if stats_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+    _trace = Trace()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(stats_path)
+        # after per-batch emits only an empty trace is left
+        if _trace.spans or _trace.counters:
+            emit(**fields)
+        _trace = None